@@ -0,0 +1,84 @@
+"""Cluster mode (src.cluster) end to end with a fake update source and offline workers.
+
+A seeded database is shared by worker processes started with ``--fake``
+(no network). Browsing sessions of many users are dispatched interleaved,
+as raw update JSON, the way the supervisor forwards getUpdates results;
+latency is measured from dispatch to the worker's acknowledgement. Runs
+once with one worker and once with ``workers``; the speedup is bounded by
+the CPU cores of the machine.
+
+Usage: python -m benchmarks.bench_cluster [users] [workers]
+"""
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from benchmarks.common import Result, print_results, seed_database, summarize
+from benchmarks.fake_telegram import callback_update_data, message_update_data
+from src.cluster import Supervisor
+from src.db import DB, init_db
+from src.handlers.callbacks import AddToCart, CategoryPage, ProductCard
+
+
+async def _sessions(db: DB, users: int) -> List[List[dict]]:
+    shop = await seed_database(db, categories=20, products=20_000, users=users, orders=100)
+    rnd = random.Random(5)
+    sessions = []
+    for u in range(users):
+        cid = rnd.choice(shop['categories'])
+        items = (await db.list_products_page(cid, limit=8))['items']
+        sessions.append([
+            message_update_data(u + 1, '/catalog'),
+            callback_update_data(u + 1, CategoryPage(category_id=cid).pack()),
+            callback_update_data(u + 1, CategoryPage(category_id=cid, after_id=items[-1]['id']).pack()),
+            callback_update_data(u + 1, ProductCard(product_id=rnd.choice(items)['id']).pack()),
+            callback_update_data(u + 1, AddToCart(product_id=rnd.choice(items)['id']).pack()),
+        ])
+    return sessions
+
+
+async def _run_cluster(path: str, sessions: List[List[dict]], workers: int) -> Result:
+    supervisor = Supervisor(workers, worker_args=['--fake'], env={'DB_PATH': path, 'FSM_STORAGE': 'memory', 'LOG_FILE': '', 'LOG_LEVEL': 'WARNING'})
+    await supervisor.start()
+    try:
+        await asyncio.wait_for(supervisor.wait_ready(), 60)
+        supervisor.latencies = []
+        start = time.perf_counter()
+        # round-robin over users: each user's updates stay in order, users interleave
+        for update in itertools.chain.from_iterable(zip(*sessions)):
+            await supervisor.dispatch(update)
+        await supervisor.drain()
+        elapsed = time.perf_counter() - start
+        if sum(w['restarts'] for w in supervisor.stats()):
+            raise AssertionError(f'workers restarted during the run: {supervisor.stats()}')
+        return summarize(supervisor.latencies, elapsed)
+    finally:
+        await supervisor.stop()
+
+
+async def run(path: str, users: int = 500, workers: int = 4) -> Dict[str, Result]:
+    await init_db(path)
+    db = DB(path)
+    await db.connect()
+    try:
+        sessions = await _sessions(db, users)
+    finally:
+        await db.close()
+    results: Dict[str, Result] = {}
+    for n in sorted({1, workers}):
+        results[f'cluster.{n}_workers'] = await _run_cluster(path, sessions, n)
+    return results
+
+
+def main(users: int = 500, workers: int = 4) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        print_results(asyncio.run(run(os.path.join(tmp, 'bench_cluster.db'), users, workers)))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
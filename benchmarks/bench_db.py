@@ -0,0 +1,70 @@
+"""Micro-benchmarks of the DB methods used by handlers, on a large seeded database.
+
+Usage: python -m benchmarks.bench_db [products]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict
+
+from benchmarks.common import Result, measure, print_results, seed_database
+from src.db import DB, init_db
+
+
+async def run(path: str, products: int = 100_000, count: int = 500) -> Dict[str, Result]:
+    await init_db(path)
+    results: Dict[str, Result] = {}
+    async with DB(path) as db:
+        start = time.perf_counter()
+        shop = await seed_database(db, categories=50, products=products, users=max(products // 10, 100), orders=max(products // 2, 100))
+        print(f'seeded {products:,} products in {time.perf_counter() - start:.1f}s')
+        rnd = random.Random(2)
+        lo, hi = shop['product_range']
+        cats, users = shop['categories'], shop['users']
+
+        def pid() -> int:
+            return rnd.randint(lo, hi)
+
+        async def deep_page(i):
+            # a cursor far into a big category costs the same as the first page
+            await db.list_products_page(cats[i % len(cats)], after_id=lo + (hi - lo) * 3 // 4, limit=8)
+
+        async def checkout(i):
+            user = 2_000_000 + i
+            await db.add_to_cart(user, pid(), 2)
+            await db.checkout(user, 'Bench', '+7000', 'Addr')
+
+        cases = {
+            'list_categories': lambda i: db.list_categories(),
+            'list_categories_page': lambda i: db.list_categories_page(limit=8),
+            'list_products_page': lambda i: db.list_products_page(cats[i % len(cats)], limit=8),
+            'list_products_page (deep)': deep_page,
+            'get_product': lambda i: db.get_product(pid()),
+            'get_products (20)': lambda i: db.get_products([pid() for _ in range(20)]),
+            'search_products': lambda i: db.search_products(rnd.choice(['стул', 'лам', 'товар 12', 'диван 5'])),
+            'add_to_cart': lambda i: db.add_to_cart(rnd.choice(users), pid()),
+            'change_qty': lambda i: db.change_qty(rnd.choice(users), pid(), 1),
+            'get_cart_view': lambda i: db.get_cart_view(rnd.choice(users)),
+            'cart_total': lambda i: db.cart_total(rnd.choice(users)),
+            'checkout': checkout,
+            'list_orders_page (status)': lambda i: db.list_orders_page(status='paid', limit=20),
+            'get_order': lambda i: db.get_order(rnd.randint(1, 1000)),
+            'update_order_status': lambda i: db.update_order_status(rnd.randint(1, 1000), 'paid'),
+            'set_stock': lambda i: db.set_stock(pid(), 1000),
+            'adjust_stock (10)': lambda i: db.adjust_stock({pid(): 1 for _ in range(10)}),
+        }
+        for name, fn in cases.items():
+            results[f'db.{name}'] = await measure(fn, count)
+    return results
+
+
+def main(products: int = 100_000) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        print_results(asyncio.run(run(os.path.join(tmp, 'bench_db.db'), products)))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,89 @@
+"""Cost of routing one callback query through the full router set of src.main.
+
+An inner middleware stops every update right before the handler would run, so
+the timings cover update parsing, the dispatcher's outer middlewares, router
+propagation and filter/callback_data parsing — but no handler or DB work.
+
+Usage: python -m benchmarks.bench_dispatch [count]
+"""
+import asyncio
+import sys
+import time
+from typing import Any, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from benchmarks.common import Result, print_results, summarize
+from benchmarks.fake_telegram import callback_update, fake_bot
+from src.db import DB
+from src.handlers.callbacks import (
+    AddToCart,
+    CartAction,
+    CartOp,
+    CategoriesPage,
+    CategoryPage,
+    OrderAction,
+    OrderOp,
+    OrdersPage,
+    ProductCard,
+    SearchPage,
+)
+from src.main import build_dispatcher
+
+CALLBACKS = {
+    'categories page': CategoriesPage(after_id=8),
+    'category': CategoryPage(category_id=5),
+    'category page': CategoryPage(category_id=5, after_id=120),
+    'product card': ProductCard(product_id=1),
+    'add to cart': AddToCart(product_id=1),
+    'cart clear': CartAction(op=CartOp.clear),
+    'cart remove': CartAction(op=CartOp.remove, product_id=1),
+    'order start': OrderAction(op=OrderOp.start),
+    'order cancel': OrderAction(op=OrderOp.cancel),
+    'orders page': OrdersPage(before_id=10, filters='status=new'),
+    'search page': SearchPage(offset=8, query='стул'),
+}
+
+
+class StopBeforeHandler(BaseMiddleware):
+    """Records which handler an update was routed to and does not call it."""
+
+    def __init__(self):
+        self.routed = None
+
+    async def __call__(self, handler, event, data: Dict[str, Any]) -> Any:
+        self.routed = (data.get('callback_handler') or data['handler']).callback.__name__
+
+
+async def run(count: int = 3000) -> Dict[str, Result]:
+    # the DB is never opened: no handler runs
+    dp = build_dispatcher(DB(':memory:'), MemoryStorage())
+    stop = StopBeforeHandler()
+    dp.callback_query.middleware(stop)
+    bot = fake_bot()
+    results: Dict[str, Result] = {}
+    cases = {name: data.pack() for name, data in CALLBACKS.items()}
+    cases['unknown prefix'] = 'nope:1'
+    for name, data in cases.items():
+        # distinct users: one user this fast would be throttled (src.middlewares.throttle)
+        updates = [callback_update(u + 1, data) for u in range(count)]
+        timings = []
+        start = time.perf_counter()
+        for update in updates:
+            stop.routed = None
+            t = time.perf_counter()
+            await dp.feed_update(bot, update)
+            timings.append(time.perf_counter() - t)
+        results[f'dispatch.{name}'] = summarize(timings, time.perf_counter() - start)
+        if (stop.routed is None) != (name == 'unknown prefix'):
+            raise AssertionError(f'{data!r} routed to {stop.routed}')
+    return results
+
+
+def main(count: int = 3000) -> None:
+    print_results(asyncio.run(run(count)))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:2]))
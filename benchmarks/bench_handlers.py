@@ -0,0 +1,98 @@
+"""Load test of the real routers with synthetic updates and an offline Bot.
+
+Scenarios: catalog browsing, an add-to-cart storm from many users at once,
+and concurrent checkouts through the whole FSM. Every update goes through
+``Dispatcher.feed_update`` of the dispatcher built by ``src.main``.
+
+Usage: python -m benchmarks.bench_handlers [users]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+from benchmarks.common import Result, print_results, seed_database, summarize
+from benchmarks.fake_telegram import callback_update, fake_bot, message_update
+from src.db import DB, init_db
+from src.handlers.callbacks import AddToCart, CategoryPage, OrderAction, OrderOp, ProductCard
+from src.main import build_dispatcher
+
+
+async def _drive(dp, bot, sessions: List[List[Update]], concurrency: int) -> Result:
+    """Feed each session's updates in order; sessions run concurrently (like distinct users)."""
+    timings: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def session(updates: List[Update]) -> None:
+        async with semaphore:
+            for update in updates:
+                t = time.perf_counter()
+                await dp.feed_update(bot, update)
+                timings.append(time.perf_counter() - t)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(s) for s in sessions))
+    return summarize(timings, time.perf_counter() - start)
+
+
+async def run(path: str, users: int = 500, concurrency: int = 50) -> Dict[str, Result]:
+    await init_db(path)
+    results: Dict[str, Result] = {}
+    db = DB(path)
+    dp = build_dispatcher(db, MemoryStorage())
+    bot = fake_bot()
+    await dp.emit_startup(dispatcher=dp, bot=bot, bots=[bot], **dp.workflow_data)
+    try:
+        shop = await seed_database(db, categories=20, products=20_000, users=users, orders=1000)
+        rnd = random.Random(3)
+        lo, hi = shop['product_range']
+        cats = shop['categories']
+        browse = []
+        for u in range(users):
+            cid = rnd.choice(cats)
+            page = await db.list_products_page(cid, limit=8)
+            browse.append([
+                message_update(u + 1, '/catalog'),
+                callback_update(u + 1, CategoryPage(category_id=cid).pack()),
+                callback_update(u + 1, CategoryPage(category_id=cid, after_id=page['items'][-1]['id']).pack()),
+                callback_update(u + 1, ProductCard(product_id=rnd.choice(page['items'])['id']).pack()),
+            ])
+        results['handlers.browse'] = await _drive(dp, bot, browse, concurrency)
+
+        storm = [[callback_update(u + 1, AddToCart(product_id=rnd.randint(lo, hi)).pack()) for _ in range(5)] for u in range(users)]
+        results['handlers.add_to_cart_storm'] = await _drive(dp, bot, storm, concurrency * 4)
+
+        orders_before = (await db.fetchall('SELECT COUNT(*) AS n FROM orders'))[0]['n']
+        checkouts = [
+            [
+                callback_update(u + 1, OrderAction(op=OrderOp.start).pack()),
+                message_update(u + 1, f'User {u}'),
+                message_update(u + 1, '+70000000000'),
+                message_update(u + 1, 'Москва, ул. Тестовая, 1'),
+                callback_update(u + 1, OrderAction(op=OrderOp.confirm).pack()),
+            ]
+            for u in range(users)
+        ]
+        results['handlers.checkout'] = await _drive(dp, bot, checkouts, concurrency)
+        created = (await db.fetchall('SELECT COUNT(*) AS n FROM orders'))[0]['n'] - orders_before
+        if created != users:
+            raise AssertionError(f'expected {users} orders from the checkout scenario, got {created}')
+        print(f'Bot API calls: {dict(bot.session.calls)}')
+    finally:
+        await dp.emit_shutdown(dispatcher=dp, bot=bot, bots=[bot], **dp.workflow_data)
+    return results
+
+
+def main(users: int = 500) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        print_results(asyncio.run(run(os.path.join(tmp, 'bench_handlers.db'), users)))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:2]))
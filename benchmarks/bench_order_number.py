@@ -0,0 +1,36 @@
+"""Throughput and uniqueness of order number generation.
+
+Usage: python -m benchmarks.bench_order_number [count]
+"""
+import sys
+import time
+
+import src.utils as utils
+from src.utils import OrderNumberGenerator, gen_order_number
+
+
+def bench(label: str, fn, count: int) -> None:
+    start = time.perf_counter()
+    numbers = [fn() for _ in range(count)]
+    elapsed = time.perf_counter() - start
+    duplicates = count - len(set(numbers))
+    print(f'{label:<28} {count / elapsed:>12,.0f} numbers/s  duplicates={duplicates}')
+
+
+def main(count: int = 1_000_000) -> None:
+    generator = OrderNumberGenerator(node_id=1)
+    bench('sequence (generator)', generator.next_number, count)
+    # the process generator normally leases its node id from the database at the first checkout
+    utils.order_numbers = OrderNumberGenerator(node_id=3)
+    utils.ORDER_NUMBER_MODE = 'sequence'
+    bench('sequence (gen_order_number)', gen_order_number, count)
+    utils.ORDER_NUMBER_MODE = 'random'
+    bench('random (gen_order_number)', gen_order_number, count)
+    # ids from two replicas interleaved, as they would land in one orders table
+    a, b = OrderNumberGenerator(node_id=1), OrderNumberGenerator(node_id=2)
+    merged = [g.next_id() for _ in range(count // 2) for g in (a, b)]
+    print(f'two nodes: {len(merged) - len(set(merged))} duplicates in {len(merged):,} ids')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
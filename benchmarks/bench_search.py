@@ -0,0 +1,67 @@
+"""Latency of full-text product search on a synthetic catalog.
+
+Usage: python -m benchmarks.bench_search [products] [queries]
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from src.db import DB, init_db
+
+ADJECTIVES = ['красивый', 'удобный', 'деревянный', 'металлический', 'складной', 'белый', 'чёрный', 'мягкий', 'compact', 'premium']
+NOUNS = ['стул', 'стол', 'диван', 'шкаф', 'кресло', 'полка', 'лампа', 'кровать', 'комод', 'table', 'chair', 'sofa']
+QUERIES = ['стул', 'крас', 'дерев сто', 'мягк кресло', 'prem', 'лампа белый', 'комод 12', 'несуществующий']
+
+
+def seed(path: str, count: int) -> None:
+    rnd = random.Random(1)
+    conn = sqlite3.connect(path)
+    conn.execute('INSERT INTO categories(name) VALUES (?)', ('Bench',))
+    rows = (
+        (1, f'{rnd.choice(ADJECTIVES).capitalize()} {rnd.choice(NOUNS)} {i}', f'{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)}, артикул {i}', float(rnd.randint(100, 99999)))
+        for i in range(count)
+    )
+    conn.executemany('INSERT INTO products(category_id, name, description, price) VALUES (?,?,?,?)', rows)
+    conn.commit()
+    conn.close()
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(path: str, queries: int) -> None:
+    async with DB(path) as db:
+        for q in QUERIES:
+            await db.search_products(q)  # warm up page cache
+        for q in QUERIES:
+            timings = []
+            for _ in range(queries):
+                start = time.perf_counter()
+                found = await db.search_products(q, limit=10)
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f'{q!r:<20} p50={statistics.median(timings):7.2f} ms  p99={percentile(timings, 0.99):7.2f} ms  results={len(found)}')
+        # baseline: what a LIKE scan over the same catalog costs
+        start = time.perf_counter()
+        await db.fetchall("SELECT id FROM products WHERE name LIKE '%мягк%' AND name LIKE '%кресло%' LIMIT 10")
+        print(f'{"LIKE scan (once)":<20} {(time.perf_counter() - start) * 1000:7.2f} ms')
+
+
+def main(count: int = 100_000, queries: int = 200) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench_search.db')
+        asyncio.run(init_db(path))
+        start = time.perf_counter()
+        seed(path, count)
+        print(f'seeded {count:,} products (with FTS triggers) in {time.perf_counter() - start:.1f}s')
+        asyncio.run(run(path, queries))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,59 @@
+"""Overhead of the per-user rate limit (src.middlewares.throttle) per update.
+
+The middleware wraps a handler that does nothing, so the timings are the
+middleware alone: a user seen for the first time (bucket created), a known
+user within the limit, and a flooding user whose updates are rejected
+(callback queries are answered through the offline bot, repeated messages
+are dropped silently). ``throttle.direct`` calls the handler without it.
+
+Usage: python -m benchmarks.bench_throttle [count]
+"""
+import asyncio
+import sys
+from typing import Any, Dict
+
+from aiogram import Bot
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.types import CallbackQuery, Message, User
+
+from benchmarks.common import Result, measure, print_results
+from benchmarks.fake_telegram import DATE, callback_update, fake_bot
+from src.middlewares import ThrottleMiddleware
+
+
+async def noop(event: Any, data: Dict[str, Any]) -> None:
+    return None
+
+
+async def run(count: int = 20_000) -> Dict[str, Result]:
+    bot = fake_bot()
+    Bot.set_current(bot)
+    users = [User(id=u + 1, is_bot=False, first_name=f'User{u + 1}') for u in range(count)]
+    message = Message(message_id=1, date=DATE, chat={'id': 1, 'type': 'private'}, text='/catalog')
+    query: CallbackQuery = callback_update(1, 'add:1').callback_query
+    browse = HandlerObject(callback=noop)
+    cart = HandlerObject(callback=noop, flags={'throttle': 'cart'})
+    throttle = ThrottleMiddleware()
+
+    def data(i: int) -> Dict[str, Any]:
+        return {'event_from_user': users[i], 'handler': browse}
+
+    results: Dict[str, Result] = {}
+    results['throttle.direct'] = await measure(lambda i: noop(message, data(i)), count)
+    results['throttle.new_user'] = await measure(lambda i: throttle(noop, message, data(i)), count)
+    results['throttle.known_user'] = await measure(lambda i: throttle(noop, message, data(i)), count)
+    flooder = {'event_from_user': users[0], 'handler': browse, 'callback_handler': cart}
+    results['throttle.rejected_callback'] = await measure(lambda i: throttle(noop, query, flooder), count)
+    results['throttle.rejected_message'] = await measure(lambda i: throttle(noop, message, data(0)), count)
+    if throttle.throttled < 2 * count * 0.95:
+        raise AssertionError(f'flooding user was throttled only {throttle.throttled} times')
+    print(f'active limits: {throttle.active_users()}, Bot API calls: {dict(bot.session.calls)}')
+    return results
+
+
+def main(count: int = 20_000) -> None:
+    print_results(asyncio.run(run(count)))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:2]))
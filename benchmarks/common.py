@@ -0,0 +1,80 @@
+"""Shared helpers of the benchmark suite: timing summaries and a large seeded database."""
+import json
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from src.db import DB
+
+Result = Dict[str, float]
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(timings: List[float], elapsed: float) -> Result:
+    """p50/p99 latency in ms and throughput in operations per second."""
+    return {
+        'count': len(timings),
+        'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+        'ops_per_s': round(len(timings) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+async def measure(fn: Callable[[int], Awaitable[Any]], count: int) -> Result:
+    """Call ``fn(i)`` sequentially ``count`` times."""
+    timings = []
+    start = time.perf_counter()
+    for i in range(count):
+        t = time.perf_counter()
+        await fn(i)
+        timings.append(time.perf_counter() - t)
+    return summarize(timings, time.perf_counter() - start)
+
+
+def print_results(results: Dict[str, Result]) -> None:
+    for name, r in results.items():
+        print(f"{name:<34} p50={r['p50_ms']:8.3f} ms  p99={r['p99_ms']:8.3f} ms  {r['ops_per_s']:>10,.0f} ops/s  (n={r['count']})")
+
+
+async def seed_database(db: DB, categories: int, products: int, users: int, orders: int, seed: int = 1) -> Dict[str, Any]:
+    """Fill an initialized database with a synthetic shop; returns ids used by the scenarios."""
+    rnd = random.Random(seed)
+    cat_ids = await db.category_ids(f'Категория {i}' for i in range(categories))
+    cats = list(cat_ids.values())
+    batch = []
+    for i in range(products):
+        batch.append({
+            'category_id': cats[i % categories],
+            'name': f'Товар {i} {rnd.choice(["стул", "стол", "лампа", "диван", "полка"])}',
+            'description': f'Описание товара {i}',
+            'price': rnd.randint(100, 99999) / 100,
+            'stock': None if i % 3 else 1_000_000,
+        })
+        if len(batch) == 5000:
+            await db.upsert_products(batch)
+            batch = []
+    if batch:
+        await db.upsert_products(batch)
+    rows = await db.fetchall('SELECT MIN(id) AS lo, MAX(id) AS hi FROM products')
+    lo, hi = rows[0]['lo'], rows[0]['hi']
+    user_ids = list(range(1_000_000, 1_000_000 + users))
+    now = time.time()
+    async with db.transaction() as conn:
+        await conn.executemany(
+            'INSERT INTO cart_items(user_id, product_id, qty) VALUES (?,?,?) ON CONFLICT DO NOTHING',
+            [(u, rnd.randint(lo, hi), rnd.randint(1, 3)) for u in user_ids for _ in range(3)],
+        )
+        await conn.executemany(
+            'INSERT INTO orders(order_number, user_id, customer_name, phone, address, delivery_method, items, total, status, created_at) '
+            'VALUES (?,?,?,?,?,?,?,?,?,?)',
+            [
+                (f'SEED{i}', rnd.choice(user_ids), 'Покупатель', '+70000000000', 'Адрес', 'standard',
+                 json.dumps({str(rnd.randint(lo, hi)): 1}), 100.0, rnd.choice(['new', 'paid', 'shipped', 'done']), now - (orders - i) * 60)
+                for i in range(orders)
+            ],
+        )
+    return {'categories': cats, 'product_range': (lo, hi), 'users': user_ids}
@@ -0,0 +1,109 @@
+"""Offline stand-ins for Telegram: a Bot session that never touches the network and synthetic updates.
+
+The session answers every Bot API method locally (a Message for methods that
+return one, True otherwise) after running the method's real request
+serialization, so handler benchmarks measure aiogram + our code but not HTTP.
+"""
+import asyncio
+import itertools
+import typing
+from collections import Counter
+from typing import Any, AsyncGenerator, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Message, Update
+
+BOT_ID = 42
+DATE = 1700000000
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _returns_message(method: TelegramMethod) -> bool:
+    returning = method.__returning__
+    return returning is Message or Message in typing.get_args(returning)
+
+
+class FakeSession(BaseSession):
+    """Bot session answering locally; ``latency`` simulates the Bot API round trip."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        request = method.build_request(bot)
+        self.calls[request.method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not _returns_message(method):
+            return True
+        chat_id = getattr(method, 'chat_id', None) or 0
+        return Message(
+            message_id=next(_message_ids),
+            date=DATE,
+            chat={'id': chat_id, 'type': 'private'},
+            from_user={'id': BOT_ID, 'is_bot': True, 'first_name': 'Bot'},
+            text=getattr(method, 'text', None),
+        )
+
+    async def stream_content(self, url: str, timeout: int, chunk_size: int) -> AsyncGenerator[bytes, None]:
+        yield b''
+
+    async def close(self) -> None:
+        pass
+
+
+def fake_bot(latency: float = 0.0) -> Bot:
+    return Bot(f'{BOT_ID}:FAKE', session=FakeSession(latency))
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+
+def message_update_data(user_id: int, text: str) -> Dict[str, Any]:
+    """Raw JSON of a private text message update, as getUpdates returns it."""
+    return {
+        'update_id': next(_update_ids),
+        'message': {
+            'message_id': next(_message_ids),
+            'date': DATE,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': _user(user_id),
+            'text': text,
+        },
+    }
+
+
+def callback_update_data(user_id: int, data: str) -> Dict[str, Any]:
+    """Raw JSON of a callback query update from a button under a bot message."""
+    update_id = next(_update_ids)
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': next(_message_ids),
+                'date': DATE,
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bot'},
+                'text': 'Выберите категорию:',
+            },
+        },
+    }
+
+
+def message_update(user_id: int, text: str) -> Update:
+    return Update(**message_update_data(user_id, text))
+
+
+def callback_update(user_id: int, data: str) -> Update:
+    return Update(**callback_update_data(user_id, data))
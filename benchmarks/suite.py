@@ -0,0 +1,119 @@
+"""Run all benchmarks and compare them with a stored baseline.
+
+    python -m benchmarks.suite                   # compare with benchmarks/baseline.json
+    python -m benchmarks.suite --save-baseline   # record a new baseline on this machine
+
+The suite runs ``--runs`` times and every metric of a case is the median over
+the runs, for the baseline as well as for the comparison, so one slow run
+does not decide. A case regresses when its p99 grows by more than
+``--tolerance`` (a fraction) and by at least ``--min-delta-ms``, or when its
+throughput drops by the same fraction and the mean time per operation grows
+by at least ``--min-delta-ms``. The p99 of fewer than P99_MIN_COUNT samples
+is a few outliers, so such cases are compared on p50 instead. Timings are
+machine-relative: record the baseline on the machine that runs the
+comparison. Exits with status 1 on any regression.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+from benchmarks.common import Result, print_results
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Cases with fewer samples per run are gated on p50: their p99 is a handful of outliers
+P99_MIN_COUNT = 1000
+
+
+def compare(results: Dict[str, Result], baseline: Dict[str, Result], tolerance: float, min_delta_ms: float) -> List[str]:
+    """Human-readable descriptions of every regression against ``baseline``."""
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        latency = 'p99_ms' if current['count'] >= P99_MIN_COUNT else 'p50_ms'
+        value, base_value = current[latency], base[latency]
+        if value > base_value * (1 + tolerance) and value - base_value >= min_delta_ms:
+            regressions.append(f'{name}: {latency[:3]} {base_value:.3f} -> {value:.3f} ms')
+        ops, base_ops = current['ops_per_s'], base['ops_per_s']
+        # compare the mean cost per operation so sub-millisecond jitter is not a regression
+        if ops < base_ops / (1 + tolerance) and 1000 / ops - 1000 / base_ops >= min_delta_ms:
+            regressions.append(f'{name}: throughput {base_ops:,.0f} -> {ops:,.0f} ops/s')
+    return regressions
+
+
+def _run_module(module: str, *args: Any) -> Dict[str, Result]:
+    return asyncio.run(importlib.import_module(f'benchmarks.{module}').run(*args))
+
+
+def median_results(runs: List[Dict[str, Result]]) -> Dict[str, Result]:
+    """Every metric of every case as the median over ``runs``."""
+    return {
+        name: {key: statistics.median(run[name][key] for run in runs) for key in result}
+        for name, result in runs[0].items()
+    }
+
+
+def run_all(products: int, users: int) -> Dict[str, Result]:
+    """Each benchmark runs in a fresh process: the routers of src.handlers attach to one dispatcher only."""
+    results: Dict[str, Result] = {}
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        for module, args in (
+            ('bench_db', (os.path.join(tmp, 'bench_db.db'), products)),
+            ('bench_handlers', (os.path.join(tmp, 'bench_handlers.db'), users)),
+            ('bench_dispatch', ()),
+            ('bench_throttle', ()),
+        ):
+            with ctx.Pool(1) as pool:
+                results.update(pool.apply(_run_module, (module, *args)))
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Run benchmarks and check them against the baseline.')
+    parser.add_argument('--products', type=int, default=100_000, help='catalog size for the DB benchmarks')
+    parser.add_argument('--users', type=int, default=500, help='simulated users for the handler scenarios')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slowdown (0.5 = 50%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=0.5, help='ignore latency growth smaller than this')
+    parser.add_argument('--runs', type=int, default=3, help='repeat the suite and compare the median of the runs')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = median_results([run_all(args.products, args.users) for _ in range(max(args.runs, 1))])
+    print_results(results)
+    scale = {'products': args.products, 'users': args.users}
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'scale': scale, 'results': results}, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f'baseline saved to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}; run with --save-baseline first')
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('scale') != scale:
+        print(f"baseline was recorded at {baseline.get('scale')}, not comparable with {scale}")
+        return 0
+    regressions = compare(results, baseline['results'], args.tolerance, args.min_delta_ms)
+    for line in regressions:
+        print(f'REGRESSION {line}')
+    if not regressions:
+        print('no regressions against the baseline')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+"""Bulk import (or export) of the product catalog.
+
+Usage:
+    python -m scripts.import_catalog products.csv            # CSV, .json (array) or .jsonl
+    python -m scripts.import_catalog --export catalog.csv    # or catalog.jsonl
+"""
+import argparse
+import asyncio
+import time
+
+from src.catalog_io import CATALOG_IMPORT_BATCH, export_catalog, import_catalog
+from src.db import DB, init_db
+
+
+async def run(args: argparse.Namespace) -> None:
+    await init_db()
+    start = time.perf_counter()
+    async with DB() as db:
+        if args.export:
+            written = await export_catalog(db, args.path)
+            print(f'Exported catalog to {args.path} ({written:,} bytes) in {time.perf_counter() - start:.1f}s')
+            return
+        report = await import_catalog(db, args.path, batch_size=args.batch)
+    print(f"Inserted {report['inserted']:,}, updated {report['updated']:,}, errors {report['errors']:,} in {time.perf_counter() - start:.1f}s")
+    for line_no, error in report['error_samples']:
+        print(f'  line {line_no}: {error}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path')
+    parser.add_argument('--export', action='store_true', help='write the catalog to PATH instead of importing it')
+    parser.add_argument('--batch', type=int, default=CATALOG_IMPORT_BATCH, help='products per transaction')
+    asyncio.run(run(parser.parse_args()))
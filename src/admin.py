@@ -1,7 +1,9 @@
-from db import DB
+from src.db import DB
 
 
 class AdminAPI:
+    """Thin admin facade over the shared `DB` instance (pass the one created in `src.main`)."""
+
     def __init__(self, db: DB):
         self.db = db
 
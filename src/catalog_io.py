@@ -0,0 +1,202 @@
+"""Bulk catalog import/export in CSV, JSON (array) and JSON Lines.
+
+Rows have the fields ``id`` (optional: rows with an id update that product,
+rows without one are added), ``category`` (name, created if missing) or
+``category_id``, ``name``, ``description``, ``price``, ``photo`` and
+``stock`` (empty: not tracked). Files are parsed as a stream in a worker
+thread and written in batched transactions, so memory does not grow with
+the file and the event loop keeps serving updates during an import.
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from src.db import DB
+
+logger = logging.getLogger(__name__)
+
+# Products written per transaction
+CATALOG_IMPORT_BATCH = int(os.getenv('CATALOG_IMPORT_BATCH', '5000'))
+# How many individual errors are kept for the report (all are counted)
+MAX_ERROR_SAMPLES = 20
+
+EXPORT_COLUMNS = ['id', 'category', 'name', 'description', 'price', 'photo', 'stock']
+
+Row = Dict[str, Any]
+
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if ext == '.json':
+        return 'json'
+    return 'csv'
+
+
+def _iter_json_array(f: TextIO, chunk_size: int = 1 << 16) -> Iterator[Tuple[int, Any]]:
+    """Yield (index, element) of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_size).lstrip()
+    if not buf.startswith('['):
+        raise ValueError('JSON catalog must be an array of objects')
+    buf = buf[1:]
+    index = 0
+    eof = False
+    while True:
+        buf = buf.lstrip().lstrip(',').lstrip()
+        if buf.startswith(']'):
+            return
+        try:
+            obj, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf += chunk
+            continue
+        index += 1
+        yield index, obj
+        buf = buf[end:]
+
+
+def iter_records(f: TextIO, fmt: str) -> Iterator[Tuple[int, Any]]:
+    """Yield (line or element number, raw record) from an open catalog file."""
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield line_no, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_no, e
+    else:
+        yield from _iter_json_array(f)
+
+
+def _blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def validate(record: Any) -> Row:
+    """Normalize one raw record into product fields; raises ValueError with a readable reason."""
+    if isinstance(record, Exception):
+        raise ValueError(f'invalid JSON: {record}')
+    if not isinstance(record, dict):
+        raise ValueError('record is not an object')
+    name = str(record.get('name') or '').strip()
+    if not name:
+        raise ValueError('name is required')
+    try:
+        price = float(record.get('price'))
+    except (TypeError, ValueError):
+        raise ValueError(f"bad price {record.get('price')!r}")
+    if price < 0:
+        raise ValueError('price must not be negative')
+    product: Row = {'name': name, 'description': str(record.get('description') or ''), 'price': price}
+    product['photo'] = None if _blank(record.get('photo')) else str(record['photo'])
+    try:
+        product['id'] = None if _blank(record.get('id')) else int(record['id'])
+        product['stock'] = None if _blank(record.get('stock')) else int(record['stock'])
+        if not _blank(record.get('category_id')):
+            product['category_id'] = int(record['category_id'])
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'bad number: {e}')
+    if product['stock'] is not None and product['stock'] < 0:
+        raise ValueError('stock must not be negative')
+    if 'category_id' not in product:
+        category = str(record.get('category') or '').strip()
+        if not category:
+            raise ValueError('category or category_id is required')
+        product['category'] = category
+    return product
+
+
+def read_batches(f: TextIO, fmt: str, batch_size: int) -> Iterator[Tuple[List[Row], List[Tuple[int, str]]]]:
+    """Group valid products into batches; each batch comes with the errors met while reading it."""
+    products: List[Row] = []
+    errors: List[Tuple[int, str]] = []
+    try:
+        for line_no, record in iter_records(f, fmt):
+            try:
+                products.append(validate(record))
+            except ValueError as e:
+                errors.append((line_no, str(e)))
+            if len(products) >= batch_size:
+                yield products, errors
+                products, errors = [], []
+    except (ValueError, csv.Error) as e:
+        # the rest of the file cannot be parsed; keep what was read so far
+        errors.append((0, f'unreadable file: {e}'))
+    yield products, errors
+
+
+async def import_catalog(db: DB, path: str, fmt: Optional[str] = None, batch_size: int = CATALOG_IMPORT_BATCH) -> Dict[str, Any]:
+    """Import a catalog file; returns counts of inserted/updated products and errors.
+
+    Every batch is its own transaction: rows of an invalid line are skipped
+    and reported, valid rows are kept.
+    """
+    fmt = fmt or detect_format(path)
+    report: Dict[str, Any] = {'inserted': 0, 'updated': 0, 'errors': 0, 'error_samples': []}
+    categories: Dict[str, int] = {}
+    done = object()
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        batches = read_batches(f, fmt, batch_size)
+        while True:
+            # parsing and validation run in a worker thread
+            batch = await asyncio.to_thread(next, batches, done)
+            if batch is done:
+                break
+            products, errors = batch
+            report['errors'] += len(errors)
+            report['error_samples'].extend(errors[:MAX_ERROR_SAMPLES - len(report['error_samples'])])
+            missing = {p['category'] for p in products if 'category' in p and p['category'] not in categories}
+            if missing:
+                categories.update(await db.category_ids(missing))
+            for p in products:
+                if 'category' in p:
+                    p['category_id'] = categories[p.pop('category')]
+            if products:
+                counts = await db.upsert_products(products)
+                report['inserted'] += counts['inserted']
+                report['updated'] += counts['updated']
+    logger.info('Catalog import from %s: %s inserted, %s updated, %s errors', path, report['inserted'], report['updated'], report['errors'])
+    return report
+
+
+async def iter_catalog(db: DB, fmt: str = 'csv', chunk_size: int = 1000) -> AsyncIterator[str]:
+    """Yield the whole catalog as text chunks (CSV with header, or JSON Lines)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+    async for products in db.iter_products(chunk_size):
+        for p in products:
+            if fmt == 'csv':
+                writer.writerow([p[c] if p[c] is not None else '' for c in EXPORT_COLUMNS])
+            else:
+                buffer.write(json.dumps({c: p[c] for c in EXPORT_COLUMNS}, ensure_ascii=False) + '\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def export_catalog(db: DB, path: str, fmt: Optional[str] = None) -> int:
+    """Write the catalog to ``path`` (format from the extension); returns the number of bytes written."""
+    fmt = 'csv' if (fmt or detect_format(path)) == 'csv' else 'jsonl'
+    written = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        async for chunk in iter_catalog(db, fmt):
+            written += await asyncio.to_thread(f.write, chunk)
+    return written
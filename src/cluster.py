@@ -0,0 +1,500 @@
+"""Cluster mode (BOT_MODE=cluster): one supervisor receives updates, N worker processes handle them.
+
+The supervisor long-polls getUpdates and keeps the updates as raw JSON: it
+only looks up the chat (or user) id and forwards the update to worker
+``id % N`` over the worker's stdin, one JSON object per line. All updates of
+a chat therefore reach the same worker in order, and FSM state, the per-chat
+send buckets and per-user caches stay in one process. Each worker runs the
+regular dispatcher of src.main with its own DB pool, bot and send scheduler;
+it handles the updates of one chat one after another and different chats
+concurrently.
+
+Workers acknowledge handled updates and send heartbeats on stdout. A worker
+that exits or stays silent for CLUSTER_HEALTH_TIMEOUT is (killed and)
+restarted, and its unacknowledged updates are delivered again, so an update
+may be handled twice after a crash. Catalog cache invalidations of one worker
+are relayed to the others through the supervisor.
+
+Worker processes are started as ``python -m src.cluster INDEX COUNT [--fake]``;
+``--fake`` uses the offline bot of benchmarks.fake_telegram (see
+benchmarks/bench_cluster.py for a local run with a fake update source).
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from collections import OrderedDict, deque
+from contextlib import suppress
+from typing import Any, Callable, Deque, Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from src.middlewares import UpdateDedupMiddleware
+from src.utils import NODE_ID
+
+logger = logging.getLogger(__name__)
+
+# Worker processes; each one uses about one CPU core at full load
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', str(os.cpu_count() or 2)))
+# Updates a worker handles at the same time (updates of one chat always run one after another)
+CLUSTER_WORKER_CONCURRENCY = int(os.getenv('CLUSTER_WORKER_CONCURRENCY', '64'))
+# Seconds between worker heartbeats
+CLUSTER_HEARTBEAT_INTERVAL = float(os.getenv('CLUSTER_HEARTBEAT_INTERVAL', '1'))
+# A worker silent for this long (busy loop, deadlock) is killed and restarted
+CLUSTER_HEALTH_TIMEOUT = float(os.getenv('CLUSTER_HEALTH_TIMEOUT', '15'))
+# Unacknowledged updates per worker before the supervisor stops fetching new ones
+CLUSTER_MAX_PENDING = int(os.getenv('CLUSTER_MAX_PENDING', '1000'))
+# Delay before restarting an exited worker; doubles while it keeps crashing right after start (up to 30 s)
+CLUSTER_RESTART_DELAY = float(os.getenv('CLUSTER_RESTART_DELAY', '1'))
+
+# Longest protocol line (one update) accepted on either side
+MAX_LINE = 16 * 1024 * 1024
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def shard_key(update: Mapping[str, Any]) -> int:
+    """Chat id of a raw update, else the id of its sender, else the update id."""
+    for name, event in update.items():
+        if name == 'update_id' or not isinstance(event, dict):
+            continue
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+    return update['update_id']
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+
+class Worker:
+    """Feeds the updates of one shard to the dispatcher: chats concurrently, each chat in order.
+
+    ``send`` delivers protocol messages to the supervisor; handled update ids
+    are acknowledged in batches, once per event loop iteration. Updates are
+    registered with ``dedup`` (the dispatcher's UpdateDedupMiddleware) as soon
+    as they are submitted, so its stored mark never passes an update that is
+    still queued here and would be delivered again after a crash.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        send: Callable[[Dict[str, Any]], None],
+        concurrency: int = CLUSTER_WORKER_CONCURRENCY,
+        dedup: Optional[UpdateDedupMiddleware] = None,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.send = send
+        self.dedup = dedup
+        self.handled = 0
+        self.queued = 0
+        self._chats: Dict[int, Deque[Dict[str, Any]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._acks: List[int] = []
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def submit(self, update: Dict[str, Any]) -> None:
+        self.queued += 1
+        if self.dedup is not None:
+            self.dedup.accept(update['update_id'])
+        key = shard_key(update)
+        chat = self._chats.get(key)
+        if chat is not None:
+            chat.append(update)
+            return
+        self._chats[key] = deque([update])
+        self._idle.clear()
+        task = asyncio.create_task(self._run_chat(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_chat(self, key: int) -> None:
+        chat = self._chats[key]
+        while chat:
+            update = chat[0]
+            async with self._slots:
+                try:
+                    await self.dp.feed_update(self.bot, Update(**update))
+                except Exception:
+                    logger.exception('Failed to process update %s', update.get('update_id'))
+                finally:
+                    if self.dedup is not None:
+                        self.dedup.release(update['update_id'])
+            chat.popleft()
+            self.queued -= 1
+            self.handled += 1
+            self._ack(update['update_id'])
+        del self._chats[key]
+        if not self._chats:
+            self._idle.set()
+
+    def _ack(self, update_id: int) -> None:
+        self._acks.append(update_id)
+        if len(self._acks) == 1:
+            asyncio.get_running_loop().call_soon(self.flush_acks)
+
+    def flush_acks(self) -> None:
+        if self._acks:
+            self.send({'ack': self._acks})
+            self._acks = []
+
+    async def join(self) -> None:
+        """Wait until every submitted update has been handled."""
+        await self._idle.wait()
+        self.flush_acks()
+
+    def heartbeat(self) -> None:
+        self.send({'heartbeat': {'queued': self.queued, 'handled': self.handled}})
+
+
+class _WorkerProcess:
+    """Supervisor-side state of one worker slot; survives restarts of its process."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.reader: Optional[asyncio.Task] = None
+        # update_id -> (protocol line, time it was dispatched), in dispatch order
+        self.pending: 'OrderedDict[int, Tuple[bytes, float]]' = OrderedDict()
+        self.space = asyncio.Event()
+        self.space.set()
+        # set by the first heartbeat of the current process (its dispatcher has started)
+        self.ready = asyncio.Event()
+        self.started_at = 0.0
+        self.last_seen = 0.0
+        self.queued = 0
+        self.handled = 0
+        self.restarts = 0
+        self.crashes = 0
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    def write(self, line: bytes) -> None:
+        if self.alive() and not self.process.stdin.is_closing():
+            self.process.stdin.write(line)
+
+
+class Supervisor:
+    """Starts the worker processes, shards updates between them and restarts them when they fail."""
+
+    def __init__(
+        self,
+        workers: int = CLUSTER_WORKERS,
+        worker_args: Sequence[str] = (),
+        env: Optional[Mapping[str, str]] = None,
+        max_pending: int = CLUSTER_MAX_PENDING,
+        health_timeout: float = CLUSTER_HEALTH_TIMEOUT,
+        restart_delay: float = CLUSTER_RESTART_DELAY,
+    ):
+        if workers < 1:
+            raise ValueError('at least one worker is required')
+        self.workers = [_WorkerProcess(i) for i in range(workers)]
+        self.worker_args = list(worker_args)
+        self.env = dict(env or {})
+        self.max_pending = max_pending
+        self.health_timeout = health_timeout
+        self.restart_delay = restart_delay
+        # dispatch-to-acknowledgement seconds of every update, when set to a list
+        self.latencies: Optional[List[float]] = None
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._closing = False
+        self._monitor: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        for worker in self.workers:
+            await self._spawn(worker)
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def _spawn(self, worker: _WorkerProcess) -> None:
+        env = {
+            **os.environ,
+            **self.env,
+            # each worker sees its own share of the updates and keeps its own handled-updates mark
+            'UPDATE_MARK_SCOPE': f'cluster-{worker.index}-of-{len(self.workers)}',
+        }
+        if NODE_ID is not None:
+            # order numbers embed NODE_ID, so every worker gets its own (without it each leases one)
+            env['NODE_ID'] = str((NODE_ID + worker.index) % 1024)
+        worker.process = await asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'src.cluster', str(worker.index), str(len(self.workers)), *self.worker_args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=env,
+            cwd=PROJECT_ROOT,
+            limit=MAX_LINE,
+        )
+        worker.started_at = worker.last_seen = time.monotonic()
+        worker.ready.clear()
+        # redeliver what the previous process did not acknowledge, in the original order
+        for line, _ in worker.pending.values():
+            worker.write(line)
+        worker.reader = asyncio.create_task(self._read(worker, worker.process))
+        logger.info('Worker %s started (pid %s)', worker.index, worker.process.pid)
+
+    async def _read(self, worker: _WorkerProcess, process: asyncio.subprocess.Process) -> None:
+        while True:
+            try:
+                line = await process.stdout.readline()
+            except ValueError:
+                logger.error('Worker %s sent an oversized line, killing it', worker.index)
+                process.kill()
+                break
+            if not line:
+                break
+            worker.last_seen = time.monotonic()
+            try:
+                self._handle(worker, json.loads(line))
+            except Exception:
+                logger.exception('Bad message from worker %s: %r', worker.index, line[:200])
+        code = await process.wait()
+        if self._closing:
+            return
+        uptime = time.monotonic() - worker.started_at
+        worker.crashes = worker.crashes + 1 if uptime < 30 else 1
+        delay = min(30.0, self.restart_delay * 2 ** (worker.crashes - 1))
+        logger.error(
+            'Worker %s exited with code %s; restarting in %.1f s, %s unacknowledged updates will be redelivered',
+            worker.index, code, delay, len(worker.pending),
+        )
+        await asyncio.sleep(delay)
+        if not self._closing:
+            worker.restarts += 1
+            await self._spawn(worker)
+
+    def _handle(self, worker: _WorkerProcess, message: Dict[str, Any]) -> None:
+        acked = message.get('ack')
+        if acked is not None:
+            now = time.monotonic()
+            for update_id in acked:
+                entry = worker.pending.pop(update_id, None)
+                if entry is not None and self.latencies is not None:
+                    self.latencies.append(now - entry[1])
+            worker.handled += len(acked)
+            if len(worker.pending) < self.max_pending:
+                worker.space.set()
+            if not any(w.pending for w in self.workers):
+                self._drained.set()
+        elif 'heartbeat' in message:
+            worker.queued = message['heartbeat']['queued']
+            worker.ready.set()
+        elif 'invalidate' in message:
+            line = _encode(message)
+            for other in self.workers:
+                if other is not worker:
+                    other.write(line)
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(CLUSTER_HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.alive() and now - worker.last_seen > self.health_timeout:
+                    logger.error('Worker %s sent no heartbeat for %.0f s, killing it', worker.index, now - worker.last_seen)
+                    worker.process.kill()
+
+    def shard(self, update: Mapping[str, Any]) -> int:
+        return shard_key(update) % len(self.workers)
+
+    async def dispatch(self, update: Dict[str, Any]) -> None:
+        """Send a raw update to its worker; waits while that worker has too many unacknowledged updates."""
+        worker = self.workers[self.shard(update)]
+        while len(worker.pending) >= self.max_pending:
+            worker.space.clear()
+            await worker.space.wait()
+        line = _encode({'update': update})
+        worker.pending[update['update_id']] = (line, time.monotonic())
+        self._drained.clear()
+        worker.write(line)
+
+    async def wait_ready(self) -> None:
+        """Wait until every worker has started its dispatcher."""
+        await asyncio.gather(*(w.ready.wait() for w in self.workers))
+
+    async def drain(self) -> None:
+        """Wait until every dispatched update has been acknowledged."""
+        await self._drained.wait()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                'worker': w.index,
+                'pid': w.process.pid if w.alive() else None,
+                'pending': len(w.pending),
+                'queued': w.queued,
+                'handled': w.handled,
+                'restarts': w.restarts,
+            }
+            for w in self.workers
+        ]
+
+    async def stop(self, timeout: float = 15) -> None:
+        """Close the workers' input and wait for them to finish what they already received."""
+        self._closing = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._monitor
+        for worker in self.workers:
+            if worker.alive():
+                worker.process.stdin.close()
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            try:
+                await asyncio.wait_for(worker.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning('Worker %s did not stop in %s s, killing it', worker.index, timeout)
+                worker.process.kill()
+                await worker.process.wait()
+        await asyncio.gather(*(w.reader for w in self.workers if w.reader is not None), return_exceptions=True)
+
+
+async def poll_updates(supervisor: Supervisor, bot: Bot, allowed_updates: List[str], timeout: int = 30) -> None:
+    """Long-poll getUpdates and dispatch the raw updates (they are parsed by the workers only)."""
+    url = bot.session.api.api_url(token=bot.token, method='getUpdates')
+    offset: Optional[int] = None
+    backoff = 1.0
+    async with aiohttp.ClientSession() as session:
+        while True:
+            params: Dict[str, Any] = {'timeout': timeout, 'allowed_updates': json.dumps(allowed_updates)}
+            if offset is not None:
+                params['offset'] = offset
+            try:
+                async with session.post(url, data=params, timeout=aiohttp.ClientTimeout(total=timeout + 10)) as response:
+                    body = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning('getUpdates failed (%s), retrying in %.0f s', e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            if not body.get('ok'):
+                retry_after = (body.get('parameters') or {}).get('retry_after') or backoff
+                logger.warning('getUpdates error: %s, retrying in %s s', body.get('description'), retry_after)
+                await asyncio.sleep(retry_after)
+                continue
+            backoff = 1.0
+            for update in body['result']:
+                offset = update['update_id'] + 1
+                await supervisor.dispatch(update)
+
+
+async def run_cluster(bot: Bot, allowed_updates: List[str]) -> None:
+    """Poll for updates in this process and handle them in CLUSTER_WORKERS workers until SIGINT/SIGTERM."""
+    supervisor = Supervisor()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):  # not supported on Windows
+            loop.add_signal_handler(sig, stop.set)
+    await supervisor.start()
+    poller = asyncio.create_task(poll_updates(supervisor, bot, allowed_updates))
+    logger.info('Cluster running with %s workers', len(supervisor.workers))
+    try:
+        await asyncio.wait([poller, asyncio.create_task(stop.wait())], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        poller.cancel()
+        with suppress(asyncio.CancelledError):
+            await poller
+        await supervisor.stop()
+        await bot.session.close()
+
+
+async def run_worker(index: int, workers: int, fake: bool = False) -> None:
+    """Body of a worker process: read protocol lines from stdin until EOF."""
+    # imported here: src.main imports this module
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    from src.db import DB
+    from src.fsm_storage import SQLiteStorage
+    from src.main import API_TOKEN, FSM_STORAGE, build_dispatcher
+    from src.notifier import Notifier
+    from src.sender import SEND_GLOBAL_BURST, SEND_GLOBAL_RATE, SendScheduler, setup_send_scheduler
+    from src import metrics
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=MAX_LINE, loop=loop)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader, loop=loop), sys.stdin)
+    # stdout carries the protocol; anything printed by other code goes to stderr
+    out = os.fdopen(os.dup(1), 'wb', buffering=0)
+    os.dup2(2, 1)
+    transport, _ = await loop.connect_write_pipe(asyncio.Protocol, out)
+
+    def send(message: Dict[str, Any]) -> None:
+        if not transport.is_closing():
+            transport.write(_encode(message))
+
+    db = DB()
+    storage = SQLiteStorage(db) if FSM_STORAGE == 'sqlite' else MemoryStorage()
+    if fake:
+        # offline bot without Telegram's rate limits, for load tests of the handlers
+        from benchmarks.fake_telegram import fake_bot
+
+        bot = fake_bot()
+    else:
+        bot = Bot(token=API_TOKEN)
+    dp = build_dispatcher(db, storage, Notifier(db, bot))
+    if not fake:
+        # Telegram's global limit is per bot: the workers share it
+        scheduler = setup_send_scheduler(bot, SendScheduler(
+            global_rate=SEND_GLOBAL_RATE / workers,
+            global_burst=max(1.0, SEND_GLOBAL_BURST / workers),
+        ))
+        dp.shutdown.register(scheduler.close)
+    if metrics.METRICS_PORT:
+        metrics_runner = await metrics.start_metrics_server(port=metrics.METRICS_PORT + 1 + index)
+        dp.shutdown.register(metrics_runner.cleanup)
+    db.catalog_cache.on_invalidate = lambda change: send({'invalidate': change})
+    worker = Worker(dp, bot, send, dedup=dp['update_dedup'])
+
+    async def heartbeat() -> None:
+        while True:
+            worker.heartbeat()
+            await asyncio.sleep(CLUSTER_HEARTBEAT_INTERVAL)
+
+    await dp.emit_startup(dispatcher=dp, bot=bot, bots=[bot], **dp.workflow_data)
+    beat = asyncio.create_task(heartbeat())
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if 'update' in message:
+                worker.submit(message['update'])
+            elif 'invalidate' in message:
+                db.catalog_cache.apply(message['invalidate'])
+        await worker.join()
+    finally:
+        beat.cancel()
+        await dp.emit_shutdown(dispatcher=dp, bot=bot, bots=[bot], **dp.workflow_data)
+        await bot.session.close()
+        transport.close()
+
+
+if __name__ == '__main__':
+    from src.logging_setup import LOG_FILE, setup_logging
+
+    # Ctrl+C reaches the whole process group; workers stop when the supervisor closes their stdin
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_index, worker_count = int(sys.argv[1]), int(sys.argv[2])
+    root, ext = os.path.splitext(LOG_FILE)
+    listener = setup_logging(log_file=f'{root}.worker{worker_index}{ext}' if LOG_FILE else '')
+    try:
+        asyncio.run(run_worker(worker_index, worker_count, fake='--fake' in sys.argv[3:]))
+    finally:
+        listener.stop()
@@ -1,14 +1,42 @@
 import aiosqlite
 import asyncio
+import json
 import logging
-from typing import List, Optional, Dict, Any
+import re
+import sqlite3
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
 
 logger = logging.getLogger(__name__)
 
 import os
 
+from src import metrics
+from src.utils import OrderNumberGenerator, gen_order_number, order_numbers
+
 # Allow overriding DB path via environment (useful for Docker)
 DB_PATH = os.getenv('DB_PATH', 'bot_store.db')
+# Number of read-only connections kept open next to the single writer
+DB_READERS = int(os.getenv('DB_READERS', '4'))
+# Page cache per connection in KiB and memory-mapped I/O window in bytes
+DB_CACHE_KIB = int(os.getenv('DB_CACHE_KIB', '16384'))
+DB_MMAP_BYTES = int(os.getenv('DB_MMAP_BYTES', str(256 * 1024 * 1024)))
+# Seconds a connection waits for a lock held by another process before failing
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '5'))
+# How many order numbers checkout tries before giving up on UNIQUE conflicts
+ORDER_NUMBER_ATTEMPTS = 5
+# Seconds a leased order number node id stays reserved without renewal (see DB.lease_node_id)
+ORDER_NODE_LEASE = float(os.getenv('ORDER_NODE_LEASE', '3600'))
+# Rendered catalog views (keyboards and texts) kept by CatalogCache; when full it starts over
+CATALOG_VIEW_CACHE_SIZE = int(os.getenv('CATALOG_VIEW_CACHE_SIZE', '10000'))
+# Seconds between checks for catalog changes made by other processes (replicas, scripts); 0 checks on every read
+CATALOG_SYNC_INTERVAL = float(os.getenv('CATALOG_SYNC_INTERVAL', '1'))
+# Rows kept in the catalog_changes log; a process further behind drops its whole catalog cache
+CATALOG_CHANGES_KEPT = 10000
+# More pending changes than this are not replayed one by one: the catalog cache is dropped instead
+CATALOG_SYNC_BATCH = 500
 
 CREATE_SQL = [
     """
@@ -25,16 +53,25 @@ CREATE_SQL = [
         description TEXT,
         price REAL NOT NULL,
         photo TEXT,
+        stock INTEGER, -- NULL means the product is not stock-tracked
         FOREIGN KEY(category_id) REFERENCES categories(id)
     )
     """,
     """
     CREATE TABLE IF NOT EXISTS carts (
         user_id INTEGER PRIMARY KEY,
-        items TEXT -- JSON encoded {product_id: qty}
+        items TEXT -- legacy JSON encoded {product_id: qty}, migrated into cart_items by init_db
     )
     """,
     """
+    CREATE TABLE IF NOT EXISTS cart_items (
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        qty INTEGER NOT NULL,
+        PRIMARY KEY (user_id, product_id)
+    ) WITHOUT ROWID
+    """,
+    """
     CREATE TABLE IF NOT EXISTS orders (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         order_number TEXT UNIQUE,
@@ -45,11 +82,198 @@ CREATE_SQL = [
         delivery_method TEXT,
         items TEXT,
         total REAL,
-        status TEXT DEFAULT 'new'
+        status TEXT DEFAULT 'new',
+        created_at REAL -- unix time; NULL for orders placed before it was recorded
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS fsm_state (
+        key TEXT PRIMARY KEY, -- bot_id:chat_id:user_id:destiny
+        state TEXT,
+        data TEXT, -- JSON encoded FSM data
+        updated_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        created_by INTEGER,
+        total INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        finished_at REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL, -- 'order_status' | 'broadcast'
+        broadcast_id INTEGER,
+        text TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending', -- pending -> sending -> sent | failed
+        attempts INTEGER NOT NULL DEFAULT 0,
+        not_before REAL NOT NULL DEFAULT 0,
+        claimed_at REAL,
+        error TEXT,
+        created_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS update_marks (
+        scope TEXT PRIMARY KEY, -- one per process receiving its own stream of updates (src.middlewares.dedup)
+        update_id INTEGER NOT NULL, -- every update up to this id has been handled
+        updated_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS node_leases (
+        node_id INTEGER PRIMARY KEY, -- order number node id (src.utils.OrderNumberGenerator)
+        owner TEXT NOT NULL, -- generator holding it: host, pid and a random token
+        expires_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS catalog_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, -- written by the triggers of CATALOG_CHANGES_SQL
+        product_id INTEGER,
+        category_id INTEGER,
+        old_category_id INTEGER, -- category of the product before an update
+        categories INTEGER NOT NULL DEFAULT 0, -- the category list changed
+        clear INTEGER NOT NULL DEFAULT 0 -- bulk change: every cached catalog entry is stale
     )
     """,
 ]
 
+# Indexes for the hot lookups: products per category, orders per user/status
+INDEX_SQL = [
+    'CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id, id)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id, id)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status, id)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state(updated_at)',
+    'CREATE INDEX IF NOT EXISTS idx_notifications_status ON notifications(status, id)',
+    'CREATE INDEX IF NOT EXISTS idx_notifications_broadcast ON notifications(broadcast_id, status)',
+]
+
+# Columns added after the first release: (table, column, declaration)
+ADD_COLUMNS = [
+    ('products', 'stock', 'INTEGER'),
+    ('orders', 'created_at', 'REAL'),
+]
+
+# Data migrations; each statement is idempotent and cheap once applied
+MIGRATE_SQL = [
+    # legacy JSON carts -> normalized cart_items
+    """
+    INSERT INTO cart_items(user_id, product_id, qty)
+    SELECT c.user_id, CAST(j.key AS INTEGER), SUM(CAST(j.value AS INTEGER))
+    FROM carts c, json_each(c.items) j
+    WHERE CAST(j.value AS INTEGER) > 0
+    GROUP BY c.user_id, CAST(j.key AS INTEGER)
+    ON CONFLICT(user_id, product_id) DO UPDATE SET qty = qty + excluded.qty
+    """,
+    'DELETE FROM carts',
+]
+
+# Full-text index over product names/descriptions (external content: the text lives only in products)
+FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, content='products', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    # a row here (only ever inside a DB.upsert_products transaction) makes the
+    # insert/update triggers stand aside while the batch is indexed set-wise
+    # (and logged as a single catalog change)
+    'CREATE TABLE IF NOT EXISTS fts_bulk_load (active INTEGER)',
+    # triggers are recreated on every start so that changes to them reach existing databases
+    'DROP TRIGGER IF EXISTS products_fts_insert',
+    'DROP TRIGGER IF EXISTS products_fts_delete',
+    'DROP TRIGGER IF EXISTS products_fts_update',
+    """
+    CREATE TRIGGER products_fts_insert AFTER INSERT ON products
+    WHEN NOT EXISTS (SELECT 1 FROM fts_bulk_load) BEGIN
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    # only text changes touch the index (stock updates at checkout do not)
+    """
+    CREATE TRIGGER products_fts_update AFTER UPDATE OF name, description ON products
+    WHEN NOT EXISTS (SELECT 1 FROM fts_bulk_load) BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+# Catalog changes logged for the caches of other processes (DB.sync_catalog_cache), whoever makes them
+CATALOG_CHANGES_SQL = [
+    'DROP TRIGGER IF EXISTS catalog_changes_prune',
+    'DROP TRIGGER IF EXISTS products_changes_insert',
+    'DROP TRIGGER IF EXISTS products_changes_update',
+    'DROP TRIGGER IF EXISTS products_changes_delete',
+    'DROP TRIGGER IF EXISTS categories_changes_insert',
+    'DROP TRIGGER IF EXISTS categories_changes_update',
+    'DROP TRIGGER IF EXISTS categories_changes_delete',
+    f"""
+    CREATE TRIGGER catalog_changes_prune AFTER INSERT ON catalog_changes
+    WHEN new.id % 1000 = 0 BEGIN
+        DELETE FROM catalog_changes WHERE id <= new.id - {CATALOG_CHANGES_KEPT};
+    END
+    """,
+    """
+    CREATE TRIGGER products_changes_insert AFTER INSERT ON products
+    WHEN NOT EXISTS (SELECT 1 FROM fts_bulk_load) BEGIN
+        INSERT INTO catalog_changes(product_id, category_id) VALUES (new.id, new.category_id);
+    END
+    """,
+    """
+    CREATE TRIGGER products_changes_update AFTER UPDATE ON products
+    WHEN NOT EXISTS (SELECT 1 FROM fts_bulk_load) BEGIN
+        INSERT INTO catalog_changes(product_id, category_id, old_category_id) VALUES (new.id, new.category_id, old.category_id);
+    END
+    """,
+    """
+    CREATE TRIGGER products_changes_delete AFTER DELETE ON products BEGIN
+        INSERT INTO catalog_changes(product_id, category_id) VALUES (old.id, old.category_id);
+    END
+    """,
+    """
+    CREATE TRIGGER categories_changes_insert AFTER INSERT ON categories BEGIN
+        INSERT INTO catalog_changes(category_id, categories) VALUES (new.id, 1);
+    END
+    """,
+    """
+    CREATE TRIGGER categories_changes_update AFTER UPDATE ON categories BEGIN
+        INSERT INTO catalog_changes(category_id, categories) VALUES (new.id, 1);
+    END
+    """,
+    """
+    CREATE TRIGGER categories_changes_delete AFTER DELETE ON categories BEGIN
+        INSERT INTO catalog_changes(category_id, categories) VALUES (old.id, 1);
+    END
+    """,
+]
+
+# Relative weight of name vs description matches in search ranking (bm25)
+SEARCH_NAME_WEIGHT = 10.0
+
+_SEARCH_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# Per-connection settings applied to every pooled connection
+CONNECTION_PRAGMAS = [
+    'PRAGMA synchronous = NORMAL',
+    f'PRAGMA cache_size = -{DB_CACHE_KIB}',
+    f'PRAGMA mmap_size = {DB_MMAP_BYTES}',
+    'PRAGMA temp_store = MEMORY',
+]
+
 
 async def init_db(path: str = DB_PATH) -> None:
     """Initialize database schema.
@@ -58,72 +282,534 @@ async def init_db(path: str = DB_PATH) -> None:
         path: Path to sqlite database file.
     """
     async with aiosqlite.connect(path) as db:
+        # WAL is persistent in the file: readers no longer block on the writer and vice versa
+        cur = await db.execute('PRAGMA journal_mode = WAL')
+        journal_mode = (await cur.fetchone())[0]
         for sql in CREATE_SQL:
             await db.execute(sql)
+        for table, column, decl in ADD_COLUMNS:
+            cur = await db.execute(f'PRAGMA table_info({table})')
+            if column not in [r[1] for r in await cur.fetchall()]:
+                await db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+                logger.info('Added column %s.%s', table, column)
+        for sql in INDEX_SQL + MIGRATE_SQL:
+            await db.execute(sql)
+        cur = await db.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")
+        fts_exists = await cur.fetchone() is not None
+        for sql in FTS_SQL + CATALOG_CHANGES_SQL:
+            await db.execute(sql)
+        if not fts_exists:
+            # index the products that existed before the search index
+            await db.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+            logger.info('Built full-text product index')
         await db.commit()
-    logger.info('Database initialized')
+        await db.execute('PRAGMA optimize')
+    logger.info('Database initialized (journal_mode=%s)', journal_mode)
+
+
+
+
+class OutOfStockError(Exception):
+    """Raised by :meth:`DB.checkout` when some cart lines exceed available stock.
+
+    ``items`` holds dicts with product_id, name, requested and available.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.items = items
+        super().__init__(', '.join(f"{i['name']} ({i['requested']} > {i['available']})" for i in items))
+
 
+class CatalogCache:
+    """In-process cache of catalog reads (categories and products).
 
+    Every invalidation bumps ``version``; a reader stores its result only if
+    the version did not change while it was querying, so a concurrent admin
+    edit can never be overwritten by stale rows.
+
+    ``views`` holds values rendered from the catalog by handlers (message text
+    and keyboard of a page or product card) under a scope that is dropped
+    together with the data: ``'categories'``, ``('category', id)`` or
+    ``('product', id)``.
+
+    ``on_invalidate`` is called with a JSON-serializable description of every
+    local invalidation; other processes replay it with :meth:`apply` (see
+    src.cluster, where each worker process has its own cache).
+    """
+
+    def __init__(self, max_views: int = CATALOG_VIEW_CACHE_SIZE) -> None:
+        self.version = 0
+        self.categories: Optional[List[Dict[str, Any]]] = None
+        self.by_category: Dict[int, List[Dict[str, Any]]] = {}
+        self.products: Dict[int, Optional[Dict[str, Any]]] = {}
+        self.views: Dict[Any, Dict[Any, Any]] = {}
+        self.max_views = max_views
+        self.view_count = 0
+        self._rendering: Dict[Any, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.view_hits = 0
+        self.view_misses = 0
+        self.on_invalidate: Optional[Callable[[Dict[str, Any]], None]] = None
+
+    def invalidate(
+        self,
+        categories: bool = False,
+        category_ids: Iterable[Optional[int]] = (),
+        product_ids: Iterable[int] = (),
+        notify: bool = True,
+    ) -> None:
+        category_ids, product_ids = list(category_ids), list(product_ids)
+        self.version += 1
+        if categories:
+            self.categories = None
+            self._drop_views('categories')
+        for cid in category_ids:
+            self.by_category.pop(cid, None)
+            self._drop_views(('category', cid))
+        for pid in product_ids:
+            self.products.pop(pid, None)
+            self._drop_views(('product', pid))
+        if notify and self.on_invalidate is not None:
+            self.on_invalidate({'categories': categories, 'category_ids': category_ids, 'product_ids': product_ids})
+
+    def clear(self, notify: bool = True) -> None:
+        self.version += 1
+        self.categories = None
+        self.by_category.clear()
+        self.products.clear()
+        self.views.clear()
+        self.view_count = 0
+        if notify and self.on_invalidate is not None:
+            self.on_invalidate({'clear': True})
+
+    def apply(self, change: Dict[str, Any]) -> None:
+        """Replay an invalidation reported by ``on_invalidate`` of another process's cache."""
+        if change.get('clear'):
+            self.clear(notify=False)
+        else:
+            self.invalidate(change.get('categories', False), change.get('category_ids', ()), change.get('product_ids', ()), notify=False)
+
+    def _drop_views(self, scope: Any) -> None:
+        self.view_count -= len(self.views.pop(scope, ()))
+
+    async def view(self, scope: Any, key: Any, render: Callable[[], Awaitable[Any]]) -> Any:
+        """Cached ``await render()`` for ``key`` in ``scope``; rendered again after the scope is invalidated.
+
+        Concurrent misses of one key share a single render.
+        """
+        views = self.views.get(scope)
+        if views is not None and key in views:
+            self.view_hits += 1
+            return views[key]
+        self.view_misses += 1
+        task = self._rendering.get((scope, key))
+        if task is None:
+            task = asyncio.ensure_future(self._render(scope, key, render))
+            self._rendering[(scope, key)] = task
+        # a cancelled caller must not cancel the render other callers wait for
+        return await asyncio.shield(task)
+
+    async def _render(self, scope: Any, key: Any, render: Callable[[], Awaitable[Any]]) -> Any:
+        version = self.version
+        try:
+            value = await render()
+        finally:
+            self._rendering.pop((scope, key), None)
+        if self.version == version:
+            if self.view_count >= self.max_views:
+                self.views.clear()
+                self.view_count = 0
+            views = self.views.setdefault(scope, {})
+            if key not in views:
+                self.view_count += 1
+            views[key] = value
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'categories': int(self.categories is not None),
+            'category_lists': len(self.by_category),
+            'products': len(self.products),
+            'view_hits': self.view_hits,
+            'view_misses': self.view_misses,
+            'views': self.view_count,
+        }
 
 
 class DB:
-    def __init__(self, path: str = DB_PATH):
+    """Async data access layer backed by a small SQLite connection pool.
+
+    The pool holds one writer connection (all modifications go through it,
+    serialized by ``_lock``) and ``readers`` read-only connections handed out
+    to waiting coroutines in FIFO order. Connections are opened by :meth:`connect` (or lazily on
+    first use) and kept for the lifetime of the instance; call :meth:`close`
+    on shutdown.
+
+    Catalog reads are served from ``catalog_cache`` and invalidated by the
+    category/product write methods of this instance; changes made by other
+    processes on the same file are picked up by :meth:`sync_catalog_cache`.
+    """
+
+    def __init__(self, path: str = DB_PATH, readers: int = DB_READERS):
         self.path = path
+        # an in-memory database is private to its connection, so readers would not see the writer's data
+        self.readers = 0 if path == ':memory:' else max(readers, 0)
         self._lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._idle_readers: deque = deque()
+        self._reader_waiters: deque = deque()
+        self.catalog_cache = CatalogCache()
+        # last catalog_changes row applied to catalog_cache, and when to look for newer ones
+        self._catalog_change_id: Optional[int] = None
+        self._catalog_sync_due = 0.0
+
+    async def __aenter__(self) -> 'DB':
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    @property
+    def is_connected(self) -> bool:
+        return self._writer is not None
+
+    async def _open_connection(self) -> aiosqlite.Connection:
+        conn = aiosqlite.connect(self.path, timeout=DB_BUSY_TIMEOUT)
+        # worker threads must not keep the interpreter alive if close() is never reached
+        conn.daemon = True
+        conn = await conn
+        conn.row_factory = aiosqlite.Row
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    async def connect(self) -> None:
+        """Open the writer and reader connections (no-op if already open)."""
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            writer = await self._open_connection()
+            readers = [await self._open_connection() for _ in range(self.readers)]
+            self._writer = writer
+            self._reader_conns = readers
+            self._idle_readers = deque(readers)
+        logger.info('DB pool opened: %s (1 writer, %s readers)', self.path, self.readers)
+
+    async def close(self) -> None:
+        """Close all pooled connections."""
+        async with self._open_lock:
+            conns = ([self._writer] if self._writer else []) + self._reader_conns
+            self._writer = None
+            self._reader_conns = []
+            self._idle_readers = deque()
+        for conn in conns:
+            try:
+                await conn.close()
+            except Exception:
+                logger.exception('Failed to close DB connection')
+        if conns:
+            logger.info('DB pool closed: %s', self.path)
+
+    async def _get_writer(self) -> aiosqlite.Connection:
+        if self._writer is None:
+            await self.connect()
+        return self._writer
+
+    @asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a reader connection from the pool (the writer when there are no readers)."""
+        writer = await self._get_writer()
+        if not self._reader_conns:
+            yield writer
+            return
+        if self._idle_readers:
+            conn = self._idle_readers.popleft()
+        else:
+            # asyncio.Queue lets a newcomer take a connection released for a woken
+            # waiter, which then queues again; handing off directly keeps waits FIFO
+            waiter = asyncio.get_running_loop().create_future()
+            self._reader_waiters.append(waiter)
+            try:
+                conn = await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release_reader(waiter.result())
+                raise
+        try:
+            yield conn
+        finally:
+            self._release_reader(conn)
+
+    def _release_reader(self, conn: aiosqlite.Connection) -> None:
+        if conn not in self._reader_conns:
+            # the pool was closed (and maybe reopened) while the connection was borrowed
+            return
+        while self._reader_waiters:
+            waiter = self._reader_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(conn)
+                return
+        self._idle_readers.append(conn)
 
     async def _execute(self, sql: str, params: tuple = ()) -> aiosqlite.Cursor:  # simple helper
         async with self._lock:
-            async with aiosqlite.connect(self.path) as db:
-                try:
+            db = await self._get_writer()
+            try:
+                with metrics.track_db(sql):
                     cur = await db.execute(sql, params)
                     await db.commit()
-                    return cur
-                except Exception as e:
-                    logger.exception('DB execute failed: %s | %s', sql, params)
-                    raise
+                return cur
+            except Exception:
+                logger.exception('DB execute failed: %s | %s', sql, params)
+                await db.rollback()
+                raise
+
+    async def _execute_fetchall(self, sql: str, params: tuple = ()) -> List[aiosqlite.Row]:
+        """Run a modifying statement with a RETURNING clause and return its rows."""
+        async with self.transaction() as db:
+            cur = await db.execute(sql, params)
+            rows = await cur.fetchall()
+            await cur.close()
+            return rows
+
+    @asynccontextmanager
+    async def transaction(self, immediate: bool = False) -> AsyncIterator[aiosqlite.Connection]:
+        """Run several statements on the writer connection as one transaction.
+
+        Commits on success and rolls back on any error. ``immediate`` takes the
+        database write lock up front (BEGIN IMMEDIATE) so that reads done inside
+        the transaction cannot be invalidated by another process.
+        """
+        async with self._lock:
+            db = await self._get_writer()
+            try:
+                with metrics.track_db('BEGIN IMMEDIATE ... COMMIT' if immediate else 'BEGIN ... COMMIT'):
+                    if immediate:
+                        await db.execute('BEGIN IMMEDIATE')
+                    yield db
+                    await db.commit()
+            except Exception:
+                logger.exception('DB transaction failed')
+                await db.rollback()
+                raise
+            except BaseException:
+                await db.rollback()
+                raise
 
     async def fetchall(self, sql: str, params: tuple = ()) -> List[aiosqlite.Row]:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._reader() as db:
             try:
-                cur = await db.execute(sql, params)
-                rows = await cur.fetchall()
-                return rows
+                with metrics.track_db(sql):
+                    # one round trip to the connection thread: a borrowed reader is
+                    # held until this coroutine is resumed, not just while SQLite works
+                    rows = await db.execute_fetchall(sql, params)
+                return list(rows)
             except Exception:
                 logger.exception('DB fetchall failed: %s | %s', sql, params)
                 raise
 
+    async def sync_catalog_cache(self) -> None:
+        """Drop the cached catalog entries changed by other processes since the last check.
+
+        Every catalog write is logged in ``catalog_changes`` by triggers, so
+        edits of other replicas and scripts (e.g. an import) reach this cache
+        at most CATALOG_SYNC_INTERVAL seconds later. Called by the catalog
+        reads and before serving a cached catalog view.
+        """
+        now = time.monotonic()
+        if now < self._catalog_sync_due:
+            return
+        self._catalog_sync_due = now + CATALOG_SYNC_INTERVAL
+        last_id = self._catalog_change_id
+        try:
+            if last_id is None:
+                rows = await self.fetchall('SELECT COALESCE(MAX(id), 0) AS id FROM catalog_changes')
+                self._catalog_change_id = rows[0]['id']
+                return
+            rows = await self.fetchall(
+                'SELECT * FROM catalog_changes WHERE id > ? ORDER BY id LIMIT ?', (last_id, CATALOG_SYNC_BATCH + 1)
+            )
+        except Exception:
+            logger.exception('Reading catalog changes failed')
+            return
+        if not rows or self._catalog_change_id != last_id:
+            return
+        cache = self.catalog_cache
+        # a gap means the log was pruned past the rows this process has not seen
+        if len(rows) > CATALOG_SYNC_BATCH or rows[0]['id'] != last_id + 1 or any(r['clear'] for r in rows):
+            cache.clear(notify=False)
+        else:
+            cache.invalidate(
+                categories=any(r['categories'] for r in rows),
+                category_ids={c for r in rows for c in (r['category_id'], r['old_category_id']) if c is not None},
+                product_ids={r['product_id'] for r in rows if r['product_id'] is not None},
+                notify=False,
+            )
+        self._catalog_change_id = rows[-1]['id']
+
+    async def catalog_view(self, scope: Any, key: Any, render: Callable[[], Awaitable[Any]]) -> Any:
+        """:meth:`CatalogCache.view` after picking up the catalog changes of other processes."""
+        await self.sync_catalog_cache()
+        return await self.catalog_cache.view(scope, key, render)
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Return catalog cache counters (hits, misses, version, sizes)."""
+        return self.catalog_cache.stats()
+
     # Categories
     async def list_categories(self) -> List[Dict[str, Any]]:
+        await self.sync_catalog_cache()
+        cache = self.catalog_cache
+        if cache.categories is not None:
+            cache.hits += 1
+            return [dict(c) for c in cache.categories]
+        cache.misses += 1
+        version = cache.version
         rows = await self.fetchall('SELECT id, name FROM categories')
-        return [dict(r) for r in rows]
+        cats = [dict(r) for r in rows]
+        if cache.version == version:
+            cache.categories = cats
+        return [dict(c) for c in cats]
 
     async def add_category(self, name: str) -> int:
         """Add a category and return its id."""
         cur = await self._execute('INSERT INTO categories(name) VALUES (?)', (name,))
         cid = cur.lastrowid
+        self.catalog_cache.invalidate(categories=True)
         logger.info('Category added: %s (id=%s)', name, cid)
         return cid
 
     # Products
     async def list_products_by_category(self, category_id: int) -> List[Dict[str, Any]]:
         """Return list of products for a category."""
+        await self.sync_catalog_cache()
+        cache = self.catalog_cache
+        products = cache.by_category.get(category_id)
+        if products is not None:
+            cache.hits += 1
+            return [dict(p) for p in products]
+        cache.misses += 1
+        version = cache.version
         rows = await self.fetchall('SELECT * FROM products WHERE category_id = ?', (category_id,))
-        return [dict(r) for r in rows]
+        products = [dict(r) for r in rows]
+        if cache.version == version:
+            cache.by_category[category_id] = products
+            for p in products:
+                cache.products[p['id']] = p
+        return [dict(p) for p in products]
+
+    async def _keyset_page(self, sql: str, params: tuple, after_id: int, before_id: Optional[int], limit: int) -> Dict[str, Any]:
+        """One page of ``sql`` (a SELECT whose WHERE clause ends with ``AND``) keyed on ``id``.
+
+        Pages forward from ``after_id`` or, if ``before_id`` is given, backward
+        from it; one extra row tells whether there is a further page, so every
+        page is a single LIMIT query on an index whatever its position.
+        """
+        if before_id is None:
+            rows = await self.fetchall(f'{sql} id > ? ORDER BY id LIMIT ?', params + (after_id, limit + 1))
+            items = [dict(r) for r in rows[:limit]]
+            return {'items': items, 'has_prev': after_id > 0 and bool(items), 'has_next': len(rows) > limit}
+        rows = await self.fetchall(f'{sql} id < ? ORDER BY id DESC LIMIT ?', params + (before_id, limit + 1))
+        if not rows:
+            return await self._keyset_page(sql, params, 0, None, limit)
+        items = [dict(r) for r in reversed(rows[:limit])]
+        return {'items': items, 'has_prev': len(rows) > limit, 'has_next': True}
+
+    async def list_categories_page(self, after_id: int = 0, before_id: Optional[int] = None, limit: int = 10) -> Dict[str, Any]:
+        """Page of categories ordered by id: {'items', 'has_prev', 'has_next'}."""
+        return await self._keyset_page('SELECT id, name FROM categories WHERE', (), after_id, before_id, limit)
+
+    async def list_products_page(self, category_id: int, after_id: int = 0, before_id: Optional[int] = None, limit: int = 10) -> Dict[str, Any]:
+        """Page of a category's products ordered by id (uses idx_products_category)."""
+        return await self._keyset_page(
+            'SELECT id, name, price FROM products WHERE category_id = ? AND', (category_id,), after_id, before_id, limit
+        )
 
     async def get_product(self, product_id: int) -> Optional[Dict[str, Any]]:
         """Return product dict or None if not found."""
+        await self.sync_catalog_cache()
+        cache = self.catalog_cache
+        if product_id in cache.products:
+            cache.hits += 1
+            p = cache.products[product_id]
+            return dict(p) if p else None
+        cache.misses += 1
+        version = cache.version
         rows = await self.fetchall('SELECT * FROM products WHERE id = ?', (product_id,))
-        return dict(rows[0]) if rows else None
+        p = dict(rows[0]) if rows else None
+        if cache.version == version:
+            cache.products[product_id] = p
+        return dict(p) if p else None
 
     async def get_products(self, product_ids: List[int]) -> List[Dict[str, Any]]:
-        """Return multiple products by ids."""
+        """Return multiple products by ids (only the missing ones are queried)."""
         if not product_ids:
             return []
-        qmarks = ','.join(['?'] * len(product_ids))
-        rows = await self.fetchall(f'SELECT * FROM products WHERE id IN ({qmarks})', tuple(product_ids))
+        await self.sync_catalog_cache()
+        cache = self.catalog_cache
+        found = []
+        missing = []
+        for pid in product_ids:
+            if pid in cache.products:
+                cache.hits += 1
+                if cache.products[pid]:
+                    found.append(dict(cache.products[pid]))
+            else:
+                cache.misses += 1
+                missing.append(pid)
+        if missing:
+            version = cache.version
+            qmarks = ','.join(['?'] * len(missing))
+            rows = await self.fetchall(f'SELECT * FROM products WHERE id IN ({qmarks})', tuple(missing))
+            fetched = {r['id']: dict(r) for r in rows}
+            if cache.version == version:
+                for pid in missing:
+                    cache.products[pid] = fetched.get(pid)
+            found.extend(dict(p) for p in fetched.values())
+        return found
+
+    @staticmethod
+    def search_match(query: str) -> Optional[str]:
+        """FTS5 MATCH expression for free user text: every word must match as a prefix."""
+        tokens = _SEARCH_TOKEN.findall(query)[:8]
+        return ' '.join(f'"{t}"*' for t in tokens) or None
+
+    async def search_products(self, query: str, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+        """Products matching ``query`` ranked by relevance (name matches first).
+
+        Each word is matched as a prefix, so "кра сту" finds "Красивый стул".
+        """
+        match = self.search_match(query)
+        if match is None:
+            return []
+        rows = await self.fetchall(
+            f"""
+            SELECT p.id, p.category_id, p.name, p.description, p.price, p.stock
+            FROM (
+                SELECT rowid, bm25(products_fts, {SEARCH_NAME_WEIGHT}, 1.0) AS score FROM products_fts
+                WHERE products_fts MATCH ? ORDER BY score, rowid LIMIT ? OFFSET ?
+            ) hit JOIN products p ON p.id = hit.rowid
+            ORDER BY hit.score, hit.rowid
+            """,
+            (match, limit, offset),
+        )
         return [dict(r) for r in rows]
 
+    async def _product_category(self, product_id: int) -> Optional[int]:
+        """Category of a product, from the cache when possible (used for precise invalidation)."""
+        p = self.catalog_cache.products.get(product_id)
+        if p:
+            return p['category_id']
+        rows = await self.fetchall('SELECT category_id FROM products WHERE id = ?', (product_id,))
+        return rows[0]['category_id'] if rows else None
+
     async def add_product(self, category_id: int, name: str, description: str, price: float, photo: Optional[str] = None) -> int:
         """Insert a new product and return its id."""
         cur = await self._execute(
@@ -131,6 +817,7 @@ class DB:
             (category_id, name, description, price, photo),
         )
         pid = cur.lastrowid
+        self.catalog_cache.invalidate(category_ids=[category_id], product_ids=[pid])
         logger.info('Product added: %s (id=%s) in category %s price=%s', name, pid, category_id, price)
         return pid
 
@@ -147,52 +834,181 @@ class DB:
         if not set_parts:
             return
         params.append(product_id)
+        old_category = await self._product_category(product_id)
         sql = f"UPDATE products SET {', '.join(set_parts)} WHERE id = ?"
         await self._execute(sql, tuple(params))
+        self.catalog_cache.invalidate(category_ids=[old_category, fields.get('category_id')], product_ids=[product_id])
         logger.info('Product %s updated fields: %s', product_id, list(fields.keys()))
 
     async def delete_product(self, product_id: int) -> None:
         """Delete product by id."""
+        old_category = await self._product_category(product_id)
         await self._execute('DELETE FROM products WHERE id = ?', (product_id,))
+        self.catalog_cache.invalidate(category_ids=[old_category], product_ids=[product_id])
         logger.info('Product %s deleted', product_id)
 
-    # Cart (simple JSON storage)
-    async def get_cart(self, user_id: int) -> Dict[int, int]:
-        """Return user cart as dict product_id->qty. Empty dict if none."""
-        rows = await self.fetchall('SELECT items FROM carts WHERE user_id = ?', (user_id,))
-        if not rows:
+    # Bulk catalog import/export (src.catalog_io)
+    async def category_ids(self, names: Iterable[str]) -> Dict[str, int]:
+        """Ids of categories by name, creating the missing ones.
+
+        Runs under BEGIN IMMEDIATE: names are not unique in the schema, so two
+        processes importing at once must not both miss a name and insert it.
+        """
+        names = list(dict.fromkeys(names))
+        if not names:
             return {}
-        import json
-        return json.loads(rows[0]['items'])
+        async with self.transaction(immediate=True) as db:
+            cur = await db.execute('SELECT name, MIN(id) AS id FROM categories WHERE name IN (SELECT value FROM json_each(?)) GROUP BY name', (json.dumps(names),))
+            ids = {r['name']: r['id'] for r in await cur.fetchall()}
+            await cur.close()
+            for name in names:
+                if name not in ids:
+                    cur = await db.execute('INSERT INTO categories(name) VALUES (?)', (name,))
+                    ids[name] = cur.lastrowid
+                    logger.info('Category added: %s (id=%s)', name, ids[name])
+        self.catalog_cache.invalidate(categories=True)
+        return ids
+
+    async def upsert_products(self, products: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Insert or update a batch of products in one transaction.
 
-    async def set_cart(self, user_id: int, items: Dict[int, int]) -> None:
+        Products with an ``id`` replace the existing row with that id (or are
+        inserted with it); products without one are inserted. Returns counts
+        of inserted and updated rows; of several products with the same ``id``
+        the last one is stored. The whole catalog cache is dropped.
+        """
+        columns = ('category_id', 'name', 'description', 'price', 'photo', 'stock')
+        keyed = list({p['id']: p for p in products if p.get('id') is not None}.values())
+        new = [tuple(p.get(c) for c in columns) for p in products if p.get('id') is None]
+        index_sql = 'INSERT INTO products_fts(rowid, name, description) SELECT id, name, description FROM products WHERE '
+        async with self.transaction() as db:
+            # per-row FTS triggers cost several times the insert itself; index the batch in one statement instead
+            await db.execute('INSERT INTO fts_bulk_load VALUES (1)')
+            existing = 0
+            if keyed:
+                ids = json.dumps([p['id'] for p in keyed])
+                cur = await db.execute('SELECT COUNT(*) FROM products WHERE id IN (SELECT value FROM json_each(?))', (ids,))
+                existing = (await cur.fetchone())[0]
+                await cur.close()
+                await db.execute(
+                    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+                    "SELECT 'delete', id, name, description FROM products WHERE id IN (SELECT value FROM json_each(?))",
+                    (ids,),
+                )
+                await db.executemany(
+                    'INSERT INTO products(id, category_id, name, description, price, photo, stock) VALUES (?,?,?,?,?,?,?) '
+                    'ON CONFLICT(id) DO UPDATE SET category_id = excluded.category_id, name = excluded.name, '
+                    'description = excluded.description, price = excluded.price, photo = excluded.photo, stock = excluded.stock',
+                    [(p['id'],) + tuple(p.get(c) for c in columns) for p in keyed],
+                )
+                await db.execute(index_sql + 'id IN (SELECT value FROM json_each(?))', (ids,))
+            if new:
+                cur = await db.execute('SELECT COALESCE(MAX(id), 0) FROM products')
+                max_id = (await cur.fetchone())[0]
+                await cur.close()
+                await db.executemany('INSERT INTO products(category_id, name, description, price, photo, stock) VALUES (?,?,?,?,?,?)', new)
+                await db.execute(index_sql + 'id > ?', (max_id,))
+            await db.execute('INSERT INTO catalog_changes(clear) VALUES (1)')
+            await db.execute('DELETE FROM fts_bulk_load')
+        self.catalog_cache.clear()
+        return {'inserted': len(new) + len(keyed) - existing, 'updated': existing}
+
+    async def iter_products(self, chunk_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield every product (with its category name) in id order, ``chunk_size`` rows per keyset query."""
+        last_id = 0
+        while True:
+            rows = await self.fetchall(
+                'SELECT p.id, c.name AS category, p.name, p.description, p.price, p.photo, p.stock '
+                'FROM products p LEFT JOIN categories c ON c.id = p.category_id WHERE p.id > ? ORDER BY p.id LIMIT ?',
+                (last_id, chunk_size),
+            )
+            if not rows:
+                return
+            yield [dict(r) for r in rows]
+            last_id = rows[-1]['id']
+
+    # Cart (one cart_items row per product)
+    async def get_cart(self, user_id: int) -> Dict[str, int]:
+        """Return user cart as dict str(product_id)->qty. Empty dict if none."""
+        rows = await self.fetchall('SELECT product_id, qty FROM cart_items WHERE user_id = ?', (user_id,))
+        return {str(r['product_id']): r['qty'] for r in rows}
+
+    async def set_cart(self, user_id: int, items: Dict[Any, int]) -> None:
         """Set user cart (overwrites)."""
-        import json
-        items_json = json.dumps(items)
-        rows = await self.fetchall('SELECT user_id FROM carts WHERE user_id = ?', (user_id,))
-        if rows:
-            await self._execute('UPDATE carts SET items = ? WHERE user_id = ?', (items_json, user_id))
-        else:
-            await self._execute('INSERT INTO carts(user_id, items) VALUES (?,?)', (user_id, items_json))
+        async with self.transaction() as db:
+            await db.execute('DELETE FROM cart_items WHERE user_id = ?', (user_id,))
+            await db.executemany(
+                'INSERT INTO cart_items(user_id, product_id, qty) VALUES (?,?,?)',
+                [(user_id, int(pid), int(qty)) for pid, qty in items.items() if int(qty) > 0],
+            )
+
+    async def add_to_cart(self, user_id: int, product_id: int, qty: int = 1) -> int:
+        """Add ``qty`` of a product to the cart and return the new quantity."""
+        rows = await self._execute_fetchall(
+            'INSERT INTO cart_items(user_id, product_id, qty) VALUES (?,?,?) '
+            'ON CONFLICT(user_id, product_id) DO UPDATE SET qty = qty + excluded.qty RETURNING qty',
+            (user_id, product_id, qty),
+        )
+        return rows[0]['qty']
+
+    async def change_qty(self, user_id: int, product_id: int, delta: int) -> int:
+        """Change quantity of a cart line by ``delta`` and return the new quantity.
+
+        The line is removed once its quantity drops to zero; decrementing a
+        product that is not in the cart is a no-op returning 0.
+        """
+        if delta > 0:
+            return await self.add_to_cart(user_id, product_id, delta)
+        async with self.transaction() as db:
+            cur = await db.execute(
+                'UPDATE cart_items SET qty = qty + ? WHERE user_id = ? AND product_id = ? RETURNING qty',
+                (delta, user_id, product_id),
+            )
+            rows = await cur.fetchall()
+            await cur.close()
+            qty = rows[0]['qty'] if rows else 0
+            if qty <= 0:
+                await db.execute('DELETE FROM cart_items WHERE user_id = ? AND product_id = ?', (user_id, product_id))
+        return max(qty, 0)
+
+    async def remove_from_cart(self, user_id: int, product_id: int) -> None:
+        """Remove a product line from the cart."""
+        await self._execute('DELETE FROM cart_items WHERE user_id = ? AND product_id = ?', (user_id, product_id))
 
     async def clear_cart(self, user_id: int) -> None:
-        """Remove cart entry for user."""
-        await self._execute('DELETE FROM carts WHERE user_id = ?', (user_id,))
+        """Remove all cart lines of a user."""
+        await self._execute('DELETE FROM cart_items WHERE user_id = ?', (user_id,))
+
+    async def get_cart_view(self, user_id: int) -> Dict[str, Any]:
+        """Return the rendered cart of a user in one joined query.
+
+        Result: ``{'lines': [{product_id, name, price, qty, subtotal}, ...],
+        'items': {str(product_id): qty}, 'total': float}``. Lines whose
+        product no longer exists are skipped.
+        """
+        rows = await self.fetchall(
+            'SELECT p.id AS product_id, p.name, p.price, c.qty '
+            'FROM cart_items c JOIN products p ON p.id = c.product_id '
+            'WHERE c.user_id = ? ORDER BY c.product_id',
+            (user_id,),
+        )
+        lines = []
+        total = 0.0
+        for r in rows:
+            line = dict(r)
+            line['subtotal'] = line['price'] * line['qty']
+            total += line['subtotal']
+            lines.append(line)
+        return {
+            'lines': lines,
+            'items': {str(line['product_id']): line['qty'] for line in lines},
+            'total': total,
+        }
 
     async def cart_total(self, user_id: int) -> float:
         """Calculate total price for user's cart."""
-        cart = await self.get_cart(user_id)
-        if not cart:
-            return 0.0
-        prod_ids = [int(pid) for pid in cart.keys()]
-        prods = await self.get_products(prod_ids)
-        price_map = {p['id']: p['price'] for p in prods}
-        total = 0.0
-        for pid_str, qty in cart.items():
-            pid = int(pid_str)
-            price = price_map.get(pid, 0.0)
-            total += price * int(qty)
-        return total
+        view = await self.get_cart_view(user_id)
+        return view['total']
 
     # Orders
     async def create_order(self, order_number: str, user_id: int, customer_name: str, phone: str, address: str, delivery_method: str, items: Dict[int, int], total: float) -> int:
@@ -200,24 +1016,338 @@ class DB:
         import json
         items_json = json.dumps(items)
         cur = await self._execute(
-            'INSERT INTO orders(order_number,user_id,customer_name,phone,address,delivery_method,items,total) VALUES (?,?,?,?,?,?,?,?)',
-            (order_number, user_id, customer_name, phone, address, delivery_method, items_json, total),
+            'INSERT INTO orders(order_number,user_id,customer_name,phone,address,delivery_method,items,total,created_at) VALUES (?,?,?,?,?,?,?,?,?)',
+            (order_number, user_id, customer_name, phone, address, delivery_method, items_json, total, time.time()),
         )
         oid = cur.lastrowid
         logger.info('Order created: %s id=%s user=%s total=%s', order_number, oid, user_id, total)
         return oid
 
+    async def checkout(self, user_id: int, customer_name: str, phone: str, address: str, delivery_method: str = 'standard', order_number: Optional[str] = None) -> Optional[str]:
+        """Turn the user's cart into an order in one transaction.
+
+        Prices are snapshotted, stock of tracked products is decremented, the
+        order is inserted and the cart cleared under BEGIN IMMEDIATE, so there
+        is never an order with an uncleared cart or oversold stock.
+        Returns the order number, or None when the cart is empty (e.g. the
+        second of two fast taps on "Подтвердить").
+
+        Raises:
+            OutOfStockError: some line asks for more than is in stock; nothing is written.
+        """
+        import json
+        if order_number is None and order_numbers.leased and time.time() >= order_numbers.lease_due:
+            await self.lease_node_id(order_numbers)
+        order_number = order_number or gen_order_number()
+        async with self.transaction(immediate=True) as db:
+            cur = await db.execute(
+                'SELECT c.product_id, c.qty, p.name, p.price, p.stock, p.category_id '
+                'FROM cart_items c JOIN products p ON p.id = c.product_id '
+                'WHERE c.user_id = ? ORDER BY c.product_id',
+                (user_id,),
+            )
+            lines = await cur.fetchall()
+            await cur.close()
+            short = [
+                {'product_id': r['product_id'], 'name': r['name'], 'requested': r['qty'], 'available': r['stock']}
+                for r in lines if r['stock'] is not None and r['stock'] < r['qty']
+            ]
+            # an empty cart or a shortage leaves the transaction without writing anything
+            if lines and not short:
+                tracked = [r for r in lines if r['stock'] is not None]
+                if tracked:
+                    # the IMMEDIATE lock makes the check above and this decrement atomic
+                    await db.execute(
+                        'UPDATE products SET stock = products.stock - c.qty FROM cart_items c '
+                        'WHERE c.user_id = ? AND c.product_id = products.id AND products.stock IS NOT NULL',
+                        (user_id,),
+                    )
+                items = {str(r['product_id']): r['qty'] for r in lines}
+                total = sum(r['price'] * r['qty'] for r in lines)
+                for attempt in range(ORDER_NUMBER_ATTEMPTS):
+                    try:
+                        cur = await db.execute(
+                            'INSERT INTO orders(order_number,user_id,customer_name,phone,address,delivery_method,items,total,created_at) VALUES (?,?,?,?,?,?,?,?,?)',
+                            (order_number, user_id, customer_name, phone, address, delivery_method, json.dumps(items), total, time.time()),
+                        )
+                        break
+                    except sqlite3.IntegrityError as e:
+                        # only the failed statement is rolled back; the transaction stays usable
+                        if 'order_number' not in str(e) or attempt == ORDER_NUMBER_ATTEMPTS - 1:
+                            raise
+                        logger.warning('Order number %s already taken, retrying', order_number)
+                        order_number = gen_order_number()
+                oid = cur.lastrowid
+                await db.execute('DELETE FROM cart_items WHERE user_id = ?', (user_id,))
+        if short:
+            raise OutOfStockError(short)
+        if not lines:
+            return None
+        if tracked:
+            self.catalog_cache.invalidate(
+                category_ids={r['category_id'] for r in tracked},
+                product_ids=[r['product_id'] for r in tracked],
+            )
+        logger.info('Order checked out: %s id=%s user=%s total=%s', order_number, oid, user_id, total)
+        return order_number
+
+    # Stock
+    async def set_stock(self, product_id: int, stock: Optional[int]) -> bool:
+        """Set stock level of a product (None stops tracking). Returns False if no such product."""
+        category_id = await self._product_category(product_id)
+        cur = await self._execute('UPDATE products SET stock = ? WHERE id = ?', (stock, product_id))
+        self.catalog_cache.invalidate(category_ids=[category_id], product_ids=[product_id])
+        logger.info('Product %s stock set to %s', product_id, stock)
+        return cur.rowcount > 0
+
+    async def adjust_stock(self, deltas: Dict[int, int]) -> int:
+        """Add signed deltas to stock levels in one transaction (floored at zero).
+
+        Untracked products start counting from zero. Returns the number of
+        products updated.
+        """
+        if not deltas:
+            return 0
+        async with self.transaction() as db:
+            cur = await db.executemany(
+                'UPDATE products SET stock = MAX(COALESCE(stock, 0) + ?, 0) WHERE id = ?',
+                [(delta, pid) for pid, delta in deltas.items()],
+            )
+            updated = cur.rowcount
+        cache = self.catalog_cache
+        cache.invalidate(category_ids=list(cache.by_category), product_ids=list(deltas))
+        logger.info('Stock adjusted for %s products', updated)
+        return updated
+
     async def list_orders(self) -> List[Dict[str, Any]]:
         """List orders ordered by most recent."""
         rows = await self.fetchall('SELECT * FROM orders ORDER BY id DESC')
         return [dict(r) for r in rows]
 
+    @staticmethod
+    def _orders_filter(status: Optional[str], user_id: Optional[int], date_from: Optional[float], date_to: Optional[float]) -> tuple:
+        """WHERE conditions (joined with AND, possibly none) and params for order filters."""
+        conditions, params = [], []
+        for condition, value in (('status = ?', status), ('user_id = ?', user_id), ('created_at >= ?', date_from), ('created_at < ?', date_to)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        return conditions, params
+
+    async def list_orders_page(
+        self,
+        status: Optional[str] = None,
+        user_id: Optional[int] = None,
+        date_from: Optional[float] = None,
+        date_to: Optional[float] = None,
+        before_id: Optional[int] = None,
+        limit: int = 20,
+    ) -> Dict[str, Any]:
+        """Newest-first page of orders matching the filters: {'items', 'has_more'}.
+
+        Pass the id of the last order of a page as ``before_id`` to get the next one.
+        """
+        conditions, params = self._orders_filter(status, user_id, date_from, date_to)
+        if before_id is not None:
+            conditions.append('id < ?')
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = await self.fetchall(
+            f'SELECT id, order_number, user_id, customer_name, status, total, created_at FROM orders {where} ORDER BY id DESC LIMIT ?',
+            tuple(params) + (limit + 1,),
+        )
+        return {'items': [dict(r) for r in rows[:limit]], 'has_more': len(rows) > limit}
+
+    async def iter_orders(
+        self,
+        status: Optional[str] = None,
+        user_id: Optional[int] = None,
+        date_from: Optional[float] = None,
+        date_to: Optional[float] = None,
+        chunk_size: int = 500,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield all matching orders oldest first, ``chunk_size`` rows at a time.
+
+        Each chunk is a separate keyset query, so memory stays constant and no
+        read transaction is held open between chunks.
+        """
+        conditions, params = self._orders_filter(status, user_id, date_from, date_to)
+        last_id = 0
+        while True:
+            where = ' AND '.join(conditions + ['id > ?'])
+            rows = await self.fetchall(f'SELECT * FROM orders WHERE {where} ORDER BY id LIMIT ?', tuple(params) + (last_id, chunk_size))
+            if not rows:
+                return
+            yield [dict(r) for r in rows]
+            last_id = rows[-1]['id']
+
     async def get_order(self, order_id: int) -> Optional[Dict[str, Any]]:
         """Return single order by id or None."""
         rows = await self.fetchall('SELECT * FROM orders WHERE id = ?', (order_id,))
         return dict(rows[0]) if rows else None
 
-    async def update_order_status(self, order_id: int, status: str) -> None:
-        """Change order status."""
-        await self._execute('UPDATE orders SET status = ? WHERE id = ?', (status, order_id))
+    async def update_order_status(self, order_id: int, status: str, notify_text: Optional[str] = None) -> bool:
+        """Change order status. Returns False if there is no such order.
+
+        With ``notify_text`` (formatted with ``order_number`` and ``status``) a
+        notification for the customer is queued in the same transaction.
+        """
+        async with self.transaction() as db:
+            cur = await db.execute('UPDATE orders SET status = ? WHERE id = ? RETURNING user_id, order_number', (status, order_id))
+            row = await cur.fetchone()
+            await cur.close()
+            if row is not None and notify_text and row['user_id'] is not None:
+                await db.execute(
+                    "INSERT INTO notifications(user_id, kind, text, created_at) VALUES (?, 'order_status', ?, ?)",
+                    (row['user_id'], notify_text.format(order_number=row['order_number'], status=status), time.time()),
+                )
         logger.info('Order %s status changed to %s', order_id, status)
+        return row is not None
+
+    # Notifications (delivered by src.notifier.Notifier)
+    async def create_broadcast(self, text: str, created_by: Optional[int] = None) -> Dict[str, int]:
+        """Queue ``text`` for every known user (anyone with an order or a cart).
+
+        Returns the broadcast id and the number of recipients.
+        """
+        now = time.time()
+        async with self.transaction() as db:
+            cur = await db.execute('INSERT INTO broadcasts(text, created_by, created_at) VALUES (?,?,?)', (text, created_by, now))
+            broadcast_id = cur.lastrowid
+            cur = await db.execute(
+                """
+                INSERT INTO notifications(user_id, kind, broadcast_id, text, created_at)
+                SELECT user_id, 'broadcast', ?, ?, ? FROM (
+                    SELECT user_id FROM orders UNION SELECT user_id FROM cart_items UNION SELECT user_id FROM carts
+                ) WHERE user_id IS NOT NULL
+                ORDER BY user_id
+                """,
+                (broadcast_id, text, now),
+            )
+            total = cur.rowcount
+            # a broadcast without recipients is finished right away
+            await db.execute('UPDATE broadcasts SET total = ?, finished_at = CASE WHEN ? = 0 THEN ? END WHERE id = ?', (total, total, now, broadcast_id))
+        logger.info('Broadcast %s queued for %s users', broadcast_id, total)
+        return {'id': broadcast_id, 'total': total}
+
+    async def claim_notifications(self, limit: int) -> List[Dict[str, Any]]:
+        """Mark up to ``limit`` due pending notifications as sending and return them (oldest first)."""
+        now = time.time()
+        rows = await self._execute_fetchall(
+            """
+            UPDATE notifications SET status = 'sending', attempts = attempts + 1, claimed_at = ?
+            WHERE id IN (
+                SELECT id FROM notifications WHERE status = 'pending' AND not_before <= ? ORDER BY id LIMIT ?
+            )
+            RETURNING id, user_id, kind, broadcast_id, text, attempts
+            """,
+            (now, now, limit),
+        )
+        return sorted((dict(r) for r in rows), key=lambda r: r['id'])
+
+    async def finish_notifications(self, sent: Iterable[int] = (), failed: Iterable[tuple] = (), retry: Iterable[tuple] = ()) -> None:
+        """Record delivery results in one transaction.
+
+        ``failed`` holds (id, error) pairs, ``retry`` holds (id, error, not_before).
+        """
+        async with self.transaction() as db:
+            if sent:
+                await db.executemany("UPDATE notifications SET status = 'sent', error = NULL WHERE id = ?", [(i,) for i in sent])
+            if failed:
+                await db.executemany("UPDATE notifications SET status = 'failed', error = ? WHERE id = ?", [(e, i) for i, e in failed])
+            if retry:
+                await db.executemany(
+                    "UPDATE notifications SET status = 'pending', error = ?, not_before = ? WHERE id = ?",
+                    [(e, t, i) for i, e, t in retry],
+                )
+
+    async def release_notifications(self, older_than: Optional[float] = None, ids: Iterable[int] = ()) -> int:
+        """Put claimed notifications back to pending: the given ``ids``, or claims older than ``older_than`` seconds."""
+        async with self.transaction() as db:
+            if older_than is not None:
+                cur = await db.execute(
+                    "UPDATE notifications SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+                    (time.time() - older_than,),
+                )
+            else:
+                cur = await db.executemany("UPDATE notifications SET status = 'pending' WHERE id = ? AND status = 'sending'", [(i,) for i in ids])
+            return cur.rowcount
+
+    async def finish_broadcasts(self, broadcast_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        """Mark broadcasts with nothing left to deliver as finished; returns their progress."""
+        finished = []
+        async with self.transaction() as db:
+            for broadcast_id in set(broadcast_ids):
+                cur = await db.execute(
+                    """
+                    UPDATE broadcasts SET finished_at = ? WHERE id = ? AND finished_at IS NULL
+                    AND NOT EXISTS (SELECT 1 FROM notifications WHERE broadcast_id = ? AND status IN ('pending', 'sending'))
+                    RETURNING id
+                    """,
+                    (time.time(), broadcast_id, broadcast_id),
+                )
+                if await cur.fetchone() is not None:
+                    finished.append(broadcast_id)
+                await cur.close()
+        return [await self.broadcast_progress(b) for b in finished]
+
+    async def broadcast_progress(self, broadcast_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Delivery counters of a broadcast (the latest one if no id is given)."""
+        if broadcast_id is None:
+            rows = await self.fetchall('SELECT * FROM broadcasts ORDER BY id DESC LIMIT 1')
+        else:
+            rows = await self.fetchall('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,))
+        if not rows:
+            return None
+        progress = dict(rows[0])
+        progress.update(pending=0, sending=0, sent=0, failed=0)
+        counts = await self.fetchall('SELECT status, COUNT(*) AS n FROM notifications WHERE broadcast_id = ? GROUP BY status', (progress['id'],))
+        progress.update({r['status']: r['n'] for r in counts})
+        return progress
+
+    async def lease_node_id(self, generator: OrderNumberGenerator) -> int:
+        """Give ``generator`` a node id that no other process holds, or renew the one it has.
+
+        Processes without NODE_ID agree on distinct node ids through
+        ``node_leases``: a lease not renewed for ORDER_NODE_LEASE seconds (its
+        process is gone) can be taken over. The generator is due for renewal
+        halfway through, and :meth:`checkout` renews it before numbering an
+        order, so a process that lost its lease moves to a free node id first.
+        """
+        now = time.time()
+        async with self.transaction(immediate=True) as db:
+            renewed = 0
+            if generator.node_id is not None:
+                cur = await db.execute(
+                    'UPDATE node_leases SET expires_at = ? WHERE node_id = ? AND owner = ?',
+                    (now + ORDER_NODE_LEASE, generator.node_id, generator.owner),
+                )
+                renewed = cur.rowcount
+            if not renewed:
+                cur = await db.execute('SELECT node_id FROM node_leases WHERE expires_at > ?', (now,))
+                taken = {r[0] for r in await cur.fetchall()}
+                await cur.close()
+                free = next((i for i in range(1 << generator.NODE_BITS) if i not in taken), None)
+                if free is None:
+                    raise RuntimeError('Every order number node id is leased; set NODE_ID explicitly')
+                await db.execute(
+                    'INSERT OR REPLACE INTO node_leases(node_id, owner, expires_at) VALUES (?,?,?)',
+                    (free, generator.owner, now + ORDER_NODE_LEASE),
+                )
+                if generator.node_id is not None:
+                    logger.warning('Order number node id %s was taken over, leased %s', generator.node_id, free)
+                generator.node_id = free
+        generator.lease_due = now + ORDER_NODE_LEASE / 2
+        return generator.node_id
+
+    async def get_update_mark(self, scope: str) -> Optional[Dict[str, Any]]:
+        """The stored update_id high-water mark of ``scope`` with its ``updated_at``, or None."""
+        rows = await self.fetchall('SELECT update_id, updated_at FROM update_marks WHERE scope = ?', (scope,))
+        return dict(rows[0]) if rows else None
+
+    async def set_update_mark(self, scope: str, update_id: int) -> None:
+        await self._execute(
+            'INSERT INTO update_marks(scope, update_id, updated_at) VALUES (?,?,?) '
+            'ON CONFLICT(scope) DO UPDATE SET update_id = excluded.update_id, updated_at = excluded.updated_at',
+            (scope, update_id, time.time()),
+        )
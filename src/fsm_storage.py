@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Set
+
+from aiogram import Bot
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from src.db import DB
+
+logger = logging.getLogger(__name__)
+
+# Seconds between batched writes; 0 makes the storage write-through with no in-memory layer
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '1'))
+# Abandoned checkouts (no FSM activity for this many seconds) are deleted
+FSM_TTL = float(os.getenv('FSM_TTL', str(24 * 3600)))
+# Clean entries idle for this long are dropped from memory (they stay in SQLite)
+FSM_CACHE_IDLE = float(os.getenv('FSM_CACHE_IDLE', '300'))
+
+
+class _Entry:
+    __slots__ = ('state', 'data', 'updated_at')
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], updated_at: float):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage persisted in the bot's SQLite database (table ``fsm_state``).
+
+    Reads and writes go to an in-memory write-back layer; dirty keys are
+    written in one batched transaction every ``flush_interval`` seconds and on
+    :meth:`close`, so FSM steps do not wait for disk. Entries untouched for
+    ``ttl`` seconds are expired.
+
+    The write-back layer assumes that all updates of one user are handled by
+    one process at a time (single process, or the user-sharded supervisor).
+    Processes sharing the database without such affinity should use
+    ``flush_interval=0``, which reads and writes SQLite directly.
+    """
+
+    def __init__(self, db: DB, flush_interval: float = FSM_FLUSH_INTERVAL, ttl: float = FSM_TTL, cache_idle: float = FSM_CACHE_IDLE):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.cache_idle = cache_idle
+        self._entries: Dict[str, _Entry] = {}
+        self._dirty: Set[str] = set()
+        self._flusher: Optional[asyncio.Task] = None
+
+    @property
+    def write_back(self) -> bool:
+        return self.flush_interval > 0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f'{key.bot_id}:{key.chat_id}:{key.user_id}:{key.destiny}'
+
+    async def _load(self, skey: str) -> _Entry:
+        entry = self._entries.get(skey)
+        if entry is not None:
+            return entry
+        rows = await self.db.fetchall('SELECT state, data, updated_at FROM fsm_state WHERE key = ?', (skey,))
+        if rows and rows[0]['updated_at'] >= time.time() - self.ttl:
+            entry = _Entry(rows[0]['state'], json.loads(rows[0]['data'] or '{}'), rows[0]['updated_at'])
+        else:
+            entry = _Entry(None, {}, time.time())
+        if self.write_back:
+            self._entries[skey] = entry
+        return entry
+
+    async def _store(self, skey: str, entry: _Entry) -> None:
+        entry.updated_at = time.time()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if not self.write_back:
+            await self._write({skey: entry})
+            return
+        self._entries[skey] = entry
+        self._dirty.add(skey)
+
+    async def set_state(self, bot: Bot, key: StorageKey, state: StateType = None) -> None:
+        skey = self._key(key)
+        entry = await self._load(skey)
+        entry.state = state.state if isinstance(state, State) else state
+        await self._store(skey, entry)
+
+    async def get_state(self, bot: Bot, key: StorageKey) -> Optional[str]:
+        return (await self._load(self._key(key))).state
+
+    async def set_data(self, bot: Bot, key: StorageKey, data: Dict[str, Any]) -> None:
+        skey = self._key(key)
+        entry = await self._load(skey)
+        entry.data = data.copy()
+        await self._store(skey, entry)
+
+    async def get_data(self, bot: Bot, key: StorageKey) -> Dict[str, Any]:
+        return (await self._load(self._key(key))).data.copy()
+
+    async def _write(self, entries: Dict[str, _Entry]) -> None:
+        # a cleared context (no state, no data) is deleted rather than stored
+        upserts = [(k, e.state, json.dumps(e.data), e.updated_at) for k, e in entries.items() if e.state is not None or e.data]
+        deletes = [(k,) for k, e in entries.items() if e.state is None and not e.data]
+        async with self.db.transaction() as conn:
+            if upserts:
+                await conn.executemany(
+                    'INSERT INTO fsm_state(key, state, data, updated_at) VALUES (?,?,?,?) '
+                    'ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at',
+                    upserts,
+                )
+            if deletes:
+                await conn.executemany('DELETE FROM fsm_state WHERE key = ?', deletes)
+
+    async def flush(self) -> None:
+        """Write all dirty entries in one transaction."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        batch = {k: self._entries[k] for k in dirty if k in self._entries}
+        try:
+            await self._write(batch)
+        except BaseException:
+            # keep them dirty so the next flush (or close) retries
+            self._dirty |= dirty
+            raise
+        logger.debug('Flushed %s FSM entries', len(batch))
+
+    async def expire(self) -> int:
+        """Delete entries idle for longer than ``ttl`` and evict idle clean entries from memory."""
+        now = time.time()
+        for skey in [k for k, e in self._entries.items() if k not in self._dirty and e.updated_at < now - min(self.ttl, self.cache_idle)]:
+            del self._entries[skey]
+        async with self.db.transaction() as conn:
+            cur = await conn.execute('DELETE FROM fsm_state WHERE updated_at < ?', (now - self.ttl,))
+            expired = cur.rowcount
+        if expired:
+            logger.info('Expired %s abandoned FSM entries', expired)
+        return expired
+
+    async def _flush_loop(self) -> None:
+        interval = self.flush_interval if self.write_back else 60.0
+        last_expire = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_expire >= min(self.ttl, self.cache_idle):
+                    await self.expire()
+                    last_expire = time.monotonic()
+            except Exception:
+                logger.exception('FSM flush failed')
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
@@ -1,3 +1,3 @@
-from . import catalog, cart, order, admin
+from . import callbacks, catalog, cart, order, admin, search
 
-__all__ = ['catalog', 'cart', 'order', 'admin']
+__all__ = ['callbacks', 'catalog', 'cart', 'order', 'admin', 'search']
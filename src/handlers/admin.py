@@ -1,22 +1,33 @@
 import os
+import tempfile
+from datetime import datetime, timedelta
 from aiogram import Router
 from aiogram.filters import Command
-from aiogram.types import Message
-from typing import Dict
+from aiogram.types import CallbackQuery, FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup, Message
+from typing import Any, Dict, List, Optional, Tuple
+from src.catalog_io import detect_format, export_catalog, import_catalog
 from src.db import DB
+from src.handlers.callbacks import OrdersPage, edit_message, pack_or_none, table
+from src.notifier import ORDER_STATUS_TEXT, Notifier
+from src.order_export import export_orders_csv, format_time
 
 router = Router()
 
 # Простая проверка admin по ID (можно расширить через env)
 ADMIN_IDS = {int(x) for x in os.getenv('ADMIN_IDS', '1').split(',') if x}
 
+# Orders per /list_orders page (keeps the message under Telegram's 4096 characters)
+ORDERS_PAGE_SIZE = int(os.getenv('ORDERS_PAGE_SIZE', '20'))
+# Bots cannot download files larger than this through the Bot API
+BOT_API_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+
 
 def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
 
-@router.message(Command(commands=['add_category']))
-async def cmd_add_category(message: Message):
+@router.message(Command(commands=['add_category']), flags={'throttle': 'admin'})
+async def cmd_add_category(message: Message, db: DB):
     if not is_admin(message.from_user.id):
         await message.answer('Только для админов')
         return
@@ -26,7 +37,6 @@ async def cmd_add_category(message: Message):
         return
     name = parts[1]
     try:
-        db: DB = DB()
         cid: int = await db.add_category(name)
         logger = __import__('logging').getLogger('handlers.admin')
         logger.info('Admin %s added category %s (id=%s)', message.from_user.id, name, cid)
@@ -37,8 +47,8 @@ async def cmd_add_category(message: Message):
         await message.answer('Не удалось добавить категорию')
 
 
-@router.message(Command(commands=['add_product']))
-async def cmd_add_product(message: Message):
+@router.message(Command(commands=['add_product']), flags={'throttle': 'admin'})
+async def cmd_add_product(message: Message, db: DB):
     if not is_admin(message.from_user.id):
         await message.answer('Только для админов')
         return
@@ -54,7 +64,6 @@ async def cmd_add_product(message: Message):
         await message.answer('Неверный формат')
         return
     try:
-        db: DB = DB()
         pid: int = await db.add_product(int(cat_id), name.strip(), desc.strip(), price, None)
         logger = __import__('logging').getLogger('handlers.admin')
         logger.info('Admin %s added product %s id=%s', message.from_user.id, name.strip(), pid)
@@ -65,8 +74,8 @@ async def cmd_add_product(message: Message):
         await message.answer('Не удалось добавить товар')
 
 
-@router.message(Command(commands=['edit_product']))
-async def cmd_edit_product(message: Message):
+@router.message(Command(commands=['edit_product']), flags={'throttle': 'admin'})
+async def cmd_edit_product(message: Message, db: DB):
     if not is_admin(message.from_user.id):
         await message.answer('Только для админов')
         return
@@ -82,13 +91,12 @@ async def cmd_edit_product(message: Message):
     except Exception:
         await message.answer('Неверный формат')
         return
-    db: DB = DB()
     await db.update_product(pid, name=name.strip(), description=desc.strip(), price=price)
     await message.answer('Товар обновлён')
 
 
-@router.message(Command(commands=['delete_product']))
-async def cmd_delete_product(message: Message):
+@router.message(Command(commands=['delete_product']), flags={'throttle': 'admin'})
+async def cmd_delete_product(message: Message, db: DB):
     if not is_admin(message.from_user.id):
         await message.answer('Только для админов')
         return
@@ -101,32 +109,218 @@ async def cmd_delete_product(message: Message):
     except ValueError:
         await message.answer('Неверный product_id')
         return
-    db: DB = DB()
     await db.delete_product(pid)
     await message.answer('Товар удалён')
 
 
-@router.message(Command(commands=['list_orders']))
-async def cmd_list_orders(message: Message):
+@router.message(Command(commands=['set_stock']), flags={'throttle': 'admin'})
+async def cmd_set_stock(message: Message, db: DB):
     if not is_admin(message.from_user.id):
         await message.answer('Только для админов')
         return
+    # Формат: /set_stock <product_id> <qty|none>
+    parts = message.text.split()
+    if len(parts) != 3:
+        await message.answer('Использование: /set_stock <product_id> <qty|none>')
+        return
     try:
-        db: DB = DB()
-        orders = await db.list_orders()
-        if not orders:
-            await message.answer('Заказов нет')
+        pid = int(parts[1])
+        stock = None if parts[2].lower() == 'none' else int(parts[2])
+        if stock is not None and stock < 0:
+            raise ValueError(stock)
+    except ValueError:
+        await message.answer('Неверный формат')
+        return
+    try:
+        if not await db.set_stock(pid, stock):
+            await message.answer('Товар не найден')
             return
-        lines = [f"{o['id']}: {o['order_number']} - {o['customer_name']} - {o['status']} - {o['total']}" for o in orders]
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.info('Admin %s set stock of product %s to %s', message.from_user.id, pid, stock)
+        await message.answer('Остаток обновлён' if stock is not None else 'Учёт остатка отключён')
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.exception('Error setting stock')
+        await message.answer('Не удалось обновить остаток')
+
+
+@router.message(Command(commands=['adjust_stock']), flags={'throttle': 'admin'})
+async def cmd_adjust_stock(message: Message, db: DB):
+    if not is_admin(message.from_user.id):
+        await message.answer('Только для админов')
+        return
+    # Формат: /adjust_stock <product_id>:<delta>[,<product_id>:<delta>...] (пробелы и переводы строк тоже разделяют)
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer('Использование: /adjust_stock <product_id>:<delta>,<product_id>:<delta>...')
+        return
+    deltas: Dict[int, int] = {}
+    try:
+        for entry in parts[1].replace(',', ' ').split():
+            pid, delta = entry.split(':')
+            deltas[int(pid)] = deltas.get(int(pid), 0) + int(delta)
+    except ValueError:
+        await message.answer('Неверный формат')
+        return
+    try:
+        updated = await db.adjust_stock(deltas)
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.info('Admin %s adjusted stock of %s products', message.from_user.id, updated)
+        await message.answer(f'Остатки обновлены: {updated} из {len(deltas)}')
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.exception('Error adjusting stock')
+        await message.answer('Не удалось обновить остатки')
+
+
+@router.message(Command(commands=['import_catalog']), flags={'throttle': 'admin'})
+async def cmd_import_catalog(message: Message, db: DB):
+    if not is_admin(message.from_user.id):
+        await message.answer('Только для админов')
+        return
+    # the file comes as a document with /import_catalog in its caption
+    document = message.document
+    if document is None:
+        await message.answer('Пришлите файл (CSV, JSON или JSONL) с подписью /import_catalog')
+        return
+    if (document.file_size or 0) > BOT_API_DOWNLOAD_LIMIT:
+        await message.answer('Файл больше 20 МБ: Telegram не отдаёт боту такие файлы, используйте scripts/import_catalog.py')
+        return
+    fmt = detect_format(document.file_name or '')
+    fd, path = tempfile.mkstemp(prefix='catalog-', suffix=f'.{fmt}')
+    os.close(fd)
+    try:
+        await message.bot.download(document, destination=path)
+        report = await import_catalog(db, path, fmt)
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.info('Admin %s imported catalog: %s', message.from_user.id, {k: v for k, v in report.items() if k != 'error_samples'})
+        lines = [f"Импорт завершён: добавлено {report['inserted']}, обновлено {report['updated']}, ошибок {report['errors']}"]
+        lines += [f'строка {line_no}: {error}' for line_no, error in report['error_samples'][:10]]
         await message.answer('\n'.join(lines))
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.exception('Error importing catalog')
+        await message.answer('Не удалось импортировать каталог')
+    finally:
+        os.remove(path)
+
+
+@router.message(Command(commands=['export_catalog']), flags={'throttle': 'admin'})
+async def cmd_export_catalog(message: Message, db: DB):
+    if not is_admin(message.from_user.id):
+        await message.answer('Только для админов')
+        return
+    parts = message.text.split()
+    fmt = parts[1].lower() if len(parts) > 1 else 'csv'
+    if fmt not in ('csv', 'jsonl'):
+        await message.answer('Использование: /export_catalog [csv|jsonl]')
+        return
+    fd, path = tempfile.mkstemp(prefix='catalog-', suffix=f'.{fmt}')
+    os.close(fd)
+    try:
+        await export_catalog(db, path, fmt)
+        await message.answer_document(FSInputFile(path, filename=f'catalog-{datetime.now():%Y%m%d-%H%M}.{fmt}'))
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.exception('Error exporting catalog')
+        await message.answer('Не удалось выгрузить каталог')
+    finally:
+        os.remove(path)
+
+
+def parse_order_filters(args: List[str]) -> Dict[str, Any]:
+    """Filters from `status=<s> user=<id> from=<YYYY-MM-DD> to=<YYYY-MM-DD>` (all optional, `to` inclusive)."""
+    filters: Dict[str, Any] = {}
+    for arg in args:
+        key, _, value = arg.partition('=')
+        if key == 'status' and value:
+            filters['status'] = value
+        elif key == 'user':
+            filters['user_id'] = int(value)
+        elif key == 'from':
+            filters['date_from'] = datetime.strptime(value, '%Y-%m-%d').timestamp()
+        elif key == 'to':
+            filters['date_to'] = (datetime.strptime(value, '%Y-%m-%d') + timedelta(days=1)).timestamp()
+        else:
+            raise ValueError(arg)
+    return filters
+
+
+async def orders_view(db: DB, args: List[str], before_id: Optional[int] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    page = await db.list_orders_page(before_id=before_id, limit=ORDERS_PAGE_SIZE, **parse_order_filters(args))
+    if not page['items']:
+        return ('Заказов нет' if before_id is None else 'Больше заказов нет'), None
+    lines = [
+        f"{o['id']}: {o['order_number']} - {(o['customer_name'] or '')[:40]} - {o['status']} - {o['total']} - {format_time(o['created_at'])}"
+        for o in page['items']
+    ]
+    kb = None
+    # the filters travel in callback_data; too long filters just get no button
+    data = pack_or_none(OrdersPage(before_id=page['items'][-1]['id'], filters=' '.join(args))) if page['has_more'] else None
+    if data:
+        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='Старше »', callback_data=data)]])
+    return '\n'.join(lines), kb
+
+
+@router.message(Command(commands=['list_orders']), flags={'throttle': 'admin'})
+async def cmd_list_orders(message: Message, db: DB):
+    if not is_admin(message.from_user.id):
+        await message.answer('Только для админов')
+        return
+    try:
+        text, kb = await orders_view(db, message.text.split()[1:])
+        await message.answer(text, reply_markup=kb)
+    except ValueError:
+        await message.answer('Использование: /list_orders [status=<status>] [user=<user_id>] [from=YYYY-MM-DD] [to=YYYY-MM-DD]')
     except Exception:
         logger = __import__('logging').getLogger('handlers.admin')
         logger.exception('Error listing orders')
         await message.answer('Не удалось получить заказы')
 
 
-@router.message(Command(commands=['set_status']))
-async def cmd_set_status(message: Message):
+@table(OrdersPage, flags={'throttle': 'admin'})
+async def orders_page_cb(query: CallbackQuery, callback_data: OrdersPage, db: DB):
+    if not is_admin(query.from_user.id):
+        await query.answer('Только для админов', show_alert=True)
+        return
+    try:
+        text, kb = await orders_view(db, (callback_data.filters or '').split(), callback_data.before_id)
+        await edit_message(query, text, kb)
+        await query.answer()
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.exception('Error paging orders')
+        await query.answer('Не удалось получить заказы', show_alert=True)
+
+
+@router.message(Command(commands=['export_orders']), flags={'throttle': 'admin'})
+async def cmd_export_orders(message: Message, db: DB):
+    if not is_admin(message.from_user.id):
+        await message.answer('Только для админов')
+        return
+    try:
+        filters = parse_order_filters(message.text.split()[1:])
+    except ValueError:
+        await message.answer('Использование: /export_orders [status=<status>] [user=<user_id>] [from=YYYY-MM-DD] [to=YYYY-MM-DD]')
+        return
+    fd, path = tempfile.mkstemp(prefix='orders-', suffix='.csv')
+    os.close(fd)
+    try:
+        if not (await db.list_orders_page(limit=1, **filters))['items']:
+            await message.answer('Заказов нет')
+            return
+        await export_orders_csv(db, path, **filters)
+        await message.answer_document(FSInputFile(path, filename=f"orders-{datetime.now():%Y%m%d-%H%M}.csv"))
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.exception('Error exporting orders')
+        await message.answer('Не удалось выгрузить заказы')
+    finally:
+        os.remove(path)
+
+
+@router.message(Command(commands=['set_status']), flags={'throttle': 'admin'})
+async def cmd_set_status(message: Message, db: DB, notifier: Optional[Notifier] = None):
     if not is_admin(message.from_user.id):
         await message.answer('Только для админов')
         return
@@ -141,12 +335,71 @@ async def cmd_set_status(message: Message):
         return
     status = parts[2]
     try:
-        db: DB = DB()
-        await db.update_order_status(oid, status)
+        # the customer is notified in the background (src.notifier), the command does not wait for delivery
+        if not await db.update_order_status(oid, status, notify_text=ORDER_STATUS_TEXT):
+            await message.answer('Заказ не найден')
+            return
+        if notifier is not None:
+            notifier.wake()
         logger = __import__('logging').getLogger('handlers.admin')
         logger.info('Admin %s set order %s status %s', message.from_user.id, oid, status)
-        await message.answer('Статус обновлён')
+        await message.answer('Статус обновлён, покупатель будет уведомлён')
     except Exception:
         logger = __import__('logging').getLogger('handlers.admin')
         logger.exception('Error setting order status')
         await message.answer('Не удалось обновить статус')
+
+
+@router.message(Command(commands=['broadcast']), flags={'throttle': 'admin'})
+async def cmd_broadcast(message: Message, db: DB, notifier: Optional[Notifier] = None):
+    if not is_admin(message.from_user.id):
+        await message.answer('Только для админов')
+        return
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer('Использование: /broadcast <text>')
+        return
+    try:
+        broadcast = await db.create_broadcast(parts[1], created_by=message.from_user.id)
+        if notifier is not None:
+            notifier.wake()
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.info('Admin %s started broadcast %s to %s users', message.from_user.id, broadcast['id'], broadcast['total'])
+        if not broadcast['total']:
+            await message.answer('Некому отправлять: пользователей пока нет')
+            return
+        await message.answer(
+            f"Рассылка #{broadcast['id']} поставлена в очередь: {broadcast['total']} получателей.\n"
+            f"Прогресс: /broadcast_status {broadcast['id']}"
+        )
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.exception('Error creating broadcast')
+        await message.answer('Не удалось создать рассылку')
+
+
+@router.message(Command(commands=['broadcast_status']), flags={'throttle': 'admin'})
+async def cmd_broadcast_status(message: Message, db: DB):
+    if not is_admin(message.from_user.id):
+        await message.answer('Только для админов')
+        return
+    parts = message.text.split()
+    try:
+        broadcast_id = int(parts[1]) if len(parts) > 1 else None
+    except ValueError:
+        await message.answer('Использование: /broadcast_status [broadcast_id]')
+        return
+    try:
+        progress = await db.broadcast_progress(broadcast_id)
+        if progress is None:
+            await message.answer('Рассылка не найдена')
+            return
+        state = 'завершена' if progress['finished_at'] else 'идёт'
+        await message.answer(
+            f"Рассылка #{progress['id']} ({state}): доставлено {progress['sent']}, ошибок {progress['failed']}, "
+            f"в очереди {progress['pending'] + progress['sending']} из {progress['total']}"
+        )
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.admin')
+        logger.exception('Error reading broadcast status')
+        await message.answer('Не удалось получить статус рассылки')
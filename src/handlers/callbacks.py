@@ -0,0 +1,146 @@
+"""Typed callback_data of all inline buttons and the table that routes them.
+
+aiogram checks callback handlers one after another and runs every filter of
+every router until one matches. Here a single handler looks up the prefix of
+`query.data` in a dict, unpacks the payload once into its CallbackData class
+and calls the registered handler with it as `callback_data`.
+"""
+from enum import Enum
+from typing import Any, Dict, Optional, Tuple, Type, Union
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup
+
+from src.sender import priority
+
+router = Router()
+
+
+class CategoriesPage(CallbackData, prefix='cats'):
+    # keyset cursor: ids of the last item before the page / the first item after it
+    after_id: Optional[int] = None
+    before_id: Optional[int] = None
+
+
+class CategoryPage(CallbackData, prefix='cat'):
+    category_id: int
+    after_id: Optional[int] = None
+    before_id: Optional[int] = None
+
+
+class ProductCard(CallbackData, prefix='prod'):
+    product_id: int
+
+
+class AddToCart(CallbackData, prefix='add'):
+    product_id: int
+
+
+class CartOp(str, Enum):
+    clear = 'clear'
+    inc = 'inc'
+    dec = 'dec'
+    remove = 'remove'
+
+
+class CartAction(CallbackData, prefix='cart'):
+    op: CartOp
+    product_id: Optional[int] = None
+
+
+class OrderOp(str, Enum):
+    start = 'start'
+    confirm = 'confirm'
+    cancel = 'cancel'
+
+
+class OrderAction(CallbackData, prefix='order'):
+    op: OrderOp
+
+
+class SearchPage(CallbackData, prefix='srch'):
+    offset: int
+    query: str
+
+
+class OrdersPage(CallbackData, prefix='orders'):
+    before_id: int
+    filters: Optional[str] = None
+
+
+def pack_or_none(data: CallbackData) -> Optional[str]:
+    """Packed data, or None if it does not fit into a button (over 64 bytes or a ':' in a value)."""
+    try:
+        return data.pack()
+    except ValueError:
+        return None
+
+
+async def edit_message(query: CallbackQuery, text: str, kb: Optional[InlineKeyboardMarkup]) -> None:
+    """Replace the tapped message in place instead of sending a new one."""
+    try:
+        await query.message.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest as e:
+        # a repeated tap on the same page leaves the message unchanged
+        if 'message is not modified' not in str(e):
+            raise
+
+
+class CallbackTable:
+    """Callback handlers keyed by the prefix of their CallbackData class."""
+
+    def __init__(self):
+        self.routes: Dict[str, Tuple[Type[CallbackData], HandlerObject, Optional[int]]] = {}
+
+    def __call__(self, data_class: Type[CallbackData], send_priority: Optional[int] = None, flags: Optional[Dict[str, Any]] = None):
+        """Decorator registering a handler for `data_class`.
+
+        `send_priority` applies to its Bot API calls; `flags` are handler flags
+        as in router registration (e.g. the `throttle` group).
+        """
+
+        def wrapper(callback):
+            prefix = data_class.__prefix__
+            if prefix in self.routes:
+                raise ValueError(f'callback prefix {prefix!r} is already routed')
+            self.routes[prefix] = (data_class, HandlerObject(callback=callback, flags=dict(flags or {})), send_priority)
+            return callback
+
+        return wrapper
+
+    async def resolve(self, query: CallbackQuery) -> Union[bool, Dict[str, Any]]:
+        """Filter: the route of the query, or False for prefixes nobody handles."""
+        data = query.data or ''
+        route = self.routes.get(data.partition(':')[0])
+        if route is None:
+            return False
+        data_class, handler, level = route
+        try:
+            callback_data = data_class.unpack(data)
+        except (TypeError, ValueError):
+            # a button from an older keyboard layout
+            callback_data = None
+        return {'callback_data': callback_data, 'callback_handler': handler, 'callback_priority': level}
+
+
+table = CallbackTable()
+
+
+@router.callback_query(table.resolve)
+async def dispatch_callback(
+    query: CallbackQuery,
+    callback_data: Optional[CallbackData],
+    callback_handler: HandlerObject,
+    callback_priority: Optional[int],
+    **data: Any,
+) -> Any:
+    if callback_data is None:
+        await query.answer('Кнопка устарела, откройте меню заново', show_alert=True)
+        return None
+    if callback_priority is None:
+        return await callback_handler.call(query, callback_data=callback_data, **data)
+    with priority(callback_priority):
+        return await callback_handler.call(query, callback_data=callback_data, **data)
@@ -2,25 +2,24 @@ from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from src.db import DB
+from src.handlers.callbacks import CartAction, CartOp, OrderAction, OrderOp, table
 
 router = Router()
 
 
 @router.message(Command(commands=['cart']))
-async def show_cart(message: Message):
+async def show_cart(message: Message, db: DB):
     try:
-        db = DB()
-        cart = await db.get_cart(message.from_user.id)
-        if not cart:
+        view = await db.get_cart_view(message.from_user.id)
+        if not view['lines']:
             await message.answer('Ваша корзина пуста')
             return
-        lines = []
-        for pid_str, qty in cart.items():
-            prod = await db.get_product(int(pid_str))
-            if prod:
-                lines.append(f"{prod['name']} x{qty} — {prod['price'] * int(qty)}")
-        total = await db.cart_total(message.from_user.id)
-        rows = [[InlineKeyboardButton(text='Оформить заказ', callback_data='order:start'), InlineKeyboardButton(text='Очистить корзину', callback_data='cart:clear')]]
+        lines = [f"{line['name']} x{line['qty']} — {line['subtotal']}" for line in view['lines']]
+        total = view['total']
+        rows = [[
+            InlineKeyboardButton(text='Оформить заказ', callback_data=OrderAction(op=OrderOp.start).pack()),
+            InlineKeyboardButton(text='Очистить корзину', callback_data=CartAction(op=CartOp.clear).pack()),
+        ]]
         kb = InlineKeyboardMarkup(inline_keyboard=rows)
         await message.answer('\n'.join(lines) + f"\n\nИтого: {total}", reply_markup=kb)
     except Exception:
@@ -30,46 +29,23 @@ async def show_cart(message: Message):
 
 
 
-@router.callback_query(lambda q: any((q.data or '').startswith(p) for p in ('cart:', 'inc:', 'dec:', 'remove:')))
-async def cart_cb(query: CallbackQuery):
-    data = query.data or ''
-    # Debug print
-    print(f'cart_cb CALLBACK RECEIVED: data={data} from={getattr(query.from_user, "id", None)}')
-    db = DB()
-    if data == 'cart:clear':
-        await db.clear_cart(query.from_user.id)
-        await query.message.answer('Корзина очищена')
-        await query.answer()
-        return
-    if data.startswith('inc:'):
-        pid = data.split(':', 1)[1]
-        cart = await db.get_cart(query.from_user.id)
-        cart[pid] = int(cart.get(pid, 0)) + 1
-        await db.set_cart(query.from_user.id, cart)
-        await query.answer('Количество увеличено')
-        return
-    if data.startswith('dec:'):
-        pid = data.split(':', 1)[1]
-        cart = await db.get_cart(query.from_user.id)
-        if cart.get(pid):
-            cart[pid] = int(cart.get(pid, 1)) - 1
-            if cart[pid] <= 0:
-                del cart[pid]
-            await db.set_cart(query.from_user.id, cart)
-        await query.answer('Количество уменьшено')
-        return
-    if data.startswith('remove:'):
-        pid = data.split(':', 1)[1]
-        cart = await db.get_cart(query.from_user.id)
-        if pid in cart:
-            del cart[pid]
-            await db.set_cart(query.from_user.id, cart)
-        await query.answer('Товар удалён')
-        return
-    
-    # общая обработка ошибок
+@table(CartAction, flags={'throttle': 'cart'})
+async def cart_cb(query: CallbackQuery, callback_data: CartAction, db: DB):
     try:
-        pass
+        user_id, pid = query.from_user.id, callback_data.product_id
+        if callback_data.op is CartOp.clear:
+            await db.clear_cart(user_id)
+            await query.message.answer('Корзина очищена')
+            await query.answer()
+        elif callback_data.op is CartOp.inc:
+            await db.change_qty(user_id, pid, 1)
+            await query.answer('Количество увеличено')
+        elif callback_data.op is CartOp.dec:
+            await db.change_qty(user_id, pid, -1)
+            await query.answer('Количество уменьшено')
+        elif callback_data.op is CartOp.remove:
+            await db.remove_from_cart(user_id, pid)
+            await query.answer('Товар удалён')
     except Exception:
         logger = __import__('logging').getLogger('handlers.cart')
         logger.exception('Error in cart callback')
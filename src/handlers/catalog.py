@@ -1,53 +1,110 @@
 import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from aiogram import Router
 from aiogram.filters import Command
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from src.db import DB
+from src.handlers.callbacks import AddToCart, CategoriesPage, CategoryPage, ProductCard, edit_message, table
 
 router = Router()
 
+# Buttons per catalog page (categories and products); pages are fetched with keyset LIMIT queries
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', '8'))
+
+
+def _nav_row(page: Dict[str, Any], cursor: Callable[..., CallbackData]) -> List[InlineKeyboardButton]:
+    """Prev/next buttons carrying the keyset cursor (first/last id of the page)."""
+    row = []
+    if page['has_prev']:
+        row.append(InlineKeyboardButton(text='« Назад', callback_data=cursor(before_id=page['items'][0]['id']).pack()))
+    if page['has_next']:
+        row.append(InlineKeyboardButton(text='Далее »', callback_data=cursor(after_id=page['items'][-1]['id']).pack()))
+    return row
+
+
+async def _render_categories(db: DB, after_id: int, before_id: Optional[int]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    page = await db.list_categories_page(after_id, before_id, CATALOG_PAGE_SIZE)
+    if not page['items']:
+        return 'Категории пусты.', None
+    rows = [[InlineKeyboardButton(text=c['name'], callback_data=CategoryPage(category_id=c['id']).pack())] for c in page['items']]
+    nav = _nav_row(page, CategoriesPage)
+    if nav:
+        rows.append(nav)
+    return 'Выберите категорию:', InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+async def _render_products(db: DB, cid: int, after_id: int, before_id: Optional[int]) -> Tuple[str, InlineKeyboardMarkup]:
+    page = await db.list_products_page(cid, after_id, before_id, CATALOG_PAGE_SIZE)
+    rows = [[InlineKeyboardButton(text=f"{p['name']} — {p['price']}", callback_data=ProductCard(product_id=p['id']).pack())] for p in page['items']]
+    nav = _nav_row(page, lambda **cursor: CategoryPage(category_id=cid, **cursor))
+    if nav:
+        rows.append(nav)
+    rows.append([InlineKeyboardButton(text='К категориям', callback_data=CategoriesPage().pack())])
+    return ('Товары:' if page['items'] else 'Нет товаров в категории'), InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+async def _render_product(db: DB, pid: int) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+    p = await db.get_product(pid)
+    if not p:
+        return None
+    kb = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text='В корзину', callback_data=AddToCart(product_id=pid).pack()),
+        InlineKeyboardButton(text='Назад', callback_data=CategoryPage(category_id=p['category_id']).pack()),
+    ]])
+    txt = f"{p['name']}\n{p.get('description','')}\nЦена: {p['price']}"
+    if p.get('stock') is not None:
+        txt += f"\nВ наличии: {p['stock']}" if p['stock'] > 0 else '\nНет в наличии'
+    return txt, kb
+
+
+# The views below are rendered once per catalog state and shared between users
+# (DB.catalog_cache drops them on admin edits and stock changes, also those of other processes); do not modify the returned markup.
+
+async def categories_view(db: DB, after_id: int = 0, before_id: Optional[int] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    return await db.catalog_view('categories', (after_id, before_id), lambda: _render_categories(db, after_id, before_id))
+
+
+async def products_view(db: DB, cid: int, after_id: int = 0, before_id: Optional[int] = None) -> Tuple[str, InlineKeyboardMarkup]:
+    return await db.catalog_view(('category', cid), (after_id, before_id), lambda: _render_products(db, cid, after_id, before_id))
+
+
+async def product_view(db: DB, pid: int) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+    """Text and keyboard of a product card, or None if there is no such product."""
+    return await db.catalog_view(('product', pid), None, lambda: _render_product(db, pid))
+
 
 @router.message(Command(commands=['catalog']))
-async def show_categories(message: Message):
+async def show_categories(message: Message, db: DB):
     try:
-        db = DB()
-        cats = await db.list_categories()
-        if not cats:
-            await message.answer('Категории пусты.')
-            return
-        rows = []
-        for c in cats:
-            rows.append([InlineKeyboardButton(text=c['name'], callback_data=f'cat:{c["id"]}')])
-        kb = InlineKeyboardMarkup(inline_keyboard=rows)
-        await message.answer('Выберите категорию:', reply_markup=kb)
+        text, kb = await categories_view(db)
+        await message.answer(text, reply_markup=kb)
     except Exception:
         logger = __import__('logging').getLogger('handlers.catalog')
         logger.exception('Error showing categories')
         await message.answer('Произошла ошибка при получении категорий. Попробуйте позже.')
 
 
-@router.callback_query(lambda q: (q.data or '').startswith('cat:'))
-async def category_cb(query: CallbackQuery):
+@table(CategoriesPage)
+async def categories_page_cb(query: CallbackQuery, callback_data: CategoriesPage, db: DB):
+    try:
+        text, kb = await categories_view(db, callback_data.after_id or 0, callback_data.before_id)
+        await edit_message(query, text, kb)
+        await query.answer()
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.catalog')
+        logger.exception('Error paging categories')
+        await query.answer('Ошибка при получении категорий', show_alert=True)
+
+
+@table(CategoryPage)
+async def category_cb(query: CallbackQuery, callback_data: CategoryPage, db: DB):
     try:
-        data = query.data or ''
-        # Direct print to ensure visibility in container logs for debugging
-        print(f'category_cb CALLBACK RECEIVED: data={data} from={getattr(query.from_user, "id", None)}')
         logger = logging.getLogger('handlers.catalog')
-        logger.info('category_cb callback received: %s from %s', data, query.from_user.id)
-        if not data.startswith('cat:'):
-            return
-        cid = int(data.split(':', 1)[1])
-        db = DB()
-        products = await db.list_products_by_category(cid)
-        if not products:
-            await query.message.answer('Нет товаров в категории')
-            await query.answer()
-            return
-        rows = []
-        for p in products:
-            rows.append([InlineKeyboardButton(text=f"{p['name']} — {p['price']}", callback_data=f'prod:{p["id"]}')])
-        kb = InlineKeyboardMarkup(inline_keyboard=rows)
-        await query.message.answer('Товары:', reply_markup=kb)
+        logger.debug('category_cb callback received: %s from %s', query.data, query.from_user.id)
+        text, kb = await products_view(db, callback_data.category_id, callback_data.after_id or 0, callback_data.before_id)
+        await edit_message(query, text, kb)
         await query.answer()
     except Exception:
         logger = __import__('logging').getLogger('handlers.catalog')
@@ -55,48 +112,40 @@ async def category_cb(query: CallbackQuery):
         await query.answer('Ошибка при получении товаров', show_alert=True)
 
 
-@router.callback_query(lambda q: (q.data or '').startswith('prod:'))
-async def product_cb(query: CallbackQuery):
-    data = query.data or ''
+@table(ProductCard)
+async def product_cb(query: CallbackQuery, callback_data: ProductCard, db: DB):
     try:
-        # Direct print for debugging
-        print(f'product_cb CALLBACK RECEIVED: data={data} from={getattr(query.from_user, "id", None)}')
         logger = logging.getLogger('handlers.catalog')
-        logger.info('product_cb callback received: %s from %s', data, query.from_user.id)
-        if data.startswith('prod:'):
-            pid = int(data.split(':', 1)[1])
-            db = DB()
-            p = await db.get_product(pid)
-            if not p:
-                await query.answer('Товар не найден', show_alert=True)
-                return
-            kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='В корзину', callback_data=f'add:{pid}'), InlineKeyboardButton(text='Назад', callback_data=f'back_cat:{p["category_id"]}')]])
-            txt = f"{p['name']}\n{p.get('description','')}\nЦена: {p['price']}"
-            await query.message.answer(txt, reply_markup=kb)
-            await query.answer()
+        logger.debug('product_cb callback received: %s from %s', query.data, query.from_user.id)
+        view = await product_view(db, callback_data.product_id)
+        if view is None:
+            await query.answer('Товар не найден', show_alert=True)
+            return
+        txt, kb = view
+        await edit_message(query, txt, kb)
+        await query.answer()
     except Exception:
         logger = __import__('logging').getLogger('handlers.catalog')
         logger.exception('Error showing product')
         await query.answer('Ошибка при получении товара', show_alert=True)
 
 
-@router.callback_query(lambda q: (q.data or '').startswith('add:'))
-async def add_to_cart_cb(query: CallbackQuery):
-    data = query.data or ''
+@table(AddToCart, flags={'throttle': 'cart'})
+async def add_to_cart_cb(query: CallbackQuery, callback_data: AddToCart, db: DB):
     try:
-        # Direct print for debugging
-        print(f'add_to_cart_cb CALLBACK RECEIVED: data={data} from={getattr(query.from_user, "id", None)}')
         logger = logging.getLogger('handlers.catalog')
-        logger.info('add_to_cart_cb callback received: %s from %s', data, query.from_user.id)
-        if data.startswith('add:'):
-            pid = int(data.split(':', 1)[1])
-            db = DB()
-            cart = await db.get_cart(query.from_user.id)
-            cart[str(pid)] = int(cart.get(str(pid), 0)) + 1
-            await db.set_cart(query.from_user.id, cart)
-            await query.answer('Добавлено в корзину')
+        logger.debug('add_to_cart_cb callback received: %s from %s', query.data, query.from_user.id)
+        pid = callback_data.product_id
+        p = await db.get_product(pid)
+        if not p:
+            await query.answer('Товар не найден', show_alert=True)
+            return
+        if p.get('stock') is not None and p['stock'] <= 0:
+            await query.answer('Нет в наличии', show_alert=True)
+            return
+        await db.add_to_cart(query.from_user.id, pid)
+        await query.answer('Добавлено в корзину')
     except Exception:
         logger = __import__('logging').getLogger('handlers.catalog')
         logger.exception('Error adding to cart')
         await query.answer('Не удалось добавить товар в корзину', show_alert=True)
-
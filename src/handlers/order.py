@@ -3,10 +3,14 @@ from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from src.db import DB
-from src.utils import gen_order_number
+from src.db import DB, OutOfStockError
+from src.handlers.callbacks import OrderAction, OrderOp, table
+from src.middlewares import SendPriorityMiddleware
+from src.sender import HIGH
 
 router = Router()
+# replies of the checkout flow go ahead of regular replies and broadcasts (order buttons: see order_cb)
+router.message.middleware(SendPriorityMiddleware(HIGH))
 
 
 class OrderStates(StatesGroup):
@@ -16,12 +20,12 @@ class OrderStates(StatesGroup):
     confirm = State()
 
 
-@router.callback_query(lambda q: (q.data or '') == 'order:start')
+def _out_of_stock_text(error: OutOfStockError) -> str:
+    lines = [f"{i['name']}: в наличии {i['available']}, в корзине {i['requested']}" for i in error.items]
+    return 'Недостаточно товара на складе:\n' + '\n'.join(lines) + '\nИзмените корзину и подтвердите заказ снова.'
+
+
 async def order_start(cb: CallbackQuery, state: FSMContext):
-    # Debug print
-    print(f'order_start CALLBACK RECEIVED: data={getattr(cb, "data", None)} from={getattr(cb.from_user, "id", None)}')
-    if cb.data != 'order:start':
-        return
     try:
         await state.set_state(OrderStates.name)
         await cb.message.answer('Пожалуйста, пришлите ваше имя:')
@@ -32,48 +36,48 @@ async def order_start(cb: CallbackQuery, state: FSMContext):
         await cb.answer('Не удалось начать оформление заказа', show_alert=True)
 
 
-@router.message(OrderStates.name)
+@router.message(OrderStates.name, flags={'throttle': 'checkout'})
 async def process_name(message: Message, state: FSMContext):
     await state.update_data(name=message.text)
     await state.set_state(OrderStates.phone)
     await message.answer('Отлично, теперь пришлите телефон:')
 
 
-@router.message(OrderStates.phone)
+@router.message(OrderStates.phone, flags={'throttle': 'checkout'})
 async def process_phone(message: Message, state: FSMContext):
     await state.update_data(phone=message.text)
     await state.set_state(OrderStates.address)
     await message.answer('Укажите адрес доставки:')
 
 
-@router.message(OrderStates.address)
+@router.message(OrderStates.address, flags={'throttle': 'checkout'})
 async def process_address(message: Message, state: FSMContext):
     await state.update_data(address=message.text)
     data = await state.get_data()
     txt = f"Проверьте данные:\nИмя: {data.get('name')}\nТел: {data.get('phone')}\nАдрес: {data.get('address')}"
     await state.set_state(OrderStates.confirm)
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text='Подтвердить', callback_data='order:confirm'), InlineKeyboardButton(text='Отмена', callback_data='order:cancel')]
+        [
+            InlineKeyboardButton(text='Подтвердить', callback_data=OrderAction(op=OrderOp.confirm).pack()),
+            InlineKeyboardButton(text='Отмена', callback_data=OrderAction(op=OrderOp.cancel).pack()),
+        ]
     ])
     await message.answer(txt, reply_markup=kb)
 
 
-@router.message(Command(commands=['confirm']))
-async def confirm_order(message: Message, state: FSMContext):
+@router.message(Command(commands=['confirm']), flags={'throttle': 'checkout'})
+async def confirm_order(message: Message, state: FSMContext, db: DB):
     try:
         data = await state.get_data()
-        db = DB()
-        cart = await db.get_cart(message.from_user.id)
-        if not cart:
+        order_number = await db.checkout(message.from_user.id, data.get('name',''), data.get('phone',''), data.get('address',''), 'standard')
+        if order_number is None:
             await message.answer('Ваша корзина пуста')
             await state.clear()
             return
-        total = await db.cart_total(message.from_user.id)
-        order_number = gen_order_number()
-        await db.create_order(order_number, message.from_user.id, data.get('name',''), data.get('phone',''), data.get('address',''), 'standard', cart, total)
-        await db.clear_cart(message.from_user.id)
         await message.answer(f'Заказ подтверждён. Номер: {order_number}')
         await state.clear()
+    except OutOfStockError as e:
+        await message.answer(_out_of_stock_text(e))
     except Exception:
         logger = __import__('logging').getLogger('handlers.order')
         logger.exception('Error confirming order')
@@ -81,32 +85,28 @@ async def confirm_order(message: Message, state: FSMContext):
         await state.clear()
 
 
-@router.callback_query(lambda q: (q.data or '') == 'order:confirm')
-async def order_confirm_cb(cb: CallbackQuery, state: FSMContext):
+async def order_confirm_cb(cb: CallbackQuery, state: FSMContext, db: DB):
     try:
         # reuse the same logic as confirm_order
         data = await state.get_data()
-        db = DB()
-        cart = await db.get_cart(cb.from_user.id)
-        if not cart:
+        order_number = await db.checkout(cb.from_user.id, data.get('name',''), data.get('phone',''), data.get('address',''), 'standard')
+        if order_number is None:
             await cb.message.answer('Ваша корзина пуста')
             await state.clear()
             await cb.answer()
             return
-        total = await db.cart_total(cb.from_user.id)
-        order_number = gen_order_number()
-        await db.create_order(order_number, cb.from_user.id, data.get('name',''), data.get('phone',''), data.get('address',''), 'standard', cart, total)
-        await db.clear_cart(cb.from_user.id)
         await cb.message.answer(f'Заказ подтверждён. Номер: {order_number}')
         await state.clear()
         await cb.answer()
+    except OutOfStockError as e:
+        await cb.message.answer(_out_of_stock_text(e))
+        await cb.answer()
     except Exception:
         logger = __import__('logging').getLogger('handlers.order')
         logger.exception('Error confirming order (callback)')
         await cb.answer('Не удалось подтвердить заказ. Попробуйте позже.', show_alert=True)
 
 
-@router.callback_query(lambda q: (q.data or '') == 'order:cancel')
 async def order_cancel_cb(cb: CallbackQuery, state: FSMContext):
     try:
         await state.clear()
@@ -118,7 +118,17 @@ async def order_cancel_cb(cb: CallbackQuery, state: FSMContext):
         await cb.answer('Не удалось отменить оформление', show_alert=True)
 
 
-@router.message(Command(commands=['cancel']))
+@table(OrderAction, send_priority=HIGH, flags={'throttle': 'checkout'})
+async def order_cb(cb: CallbackQuery, callback_data: OrderAction, state: FSMContext, db: DB):
+    if callback_data.op is OrderOp.start:
+        await order_start(cb, state)
+    elif callback_data.op is OrderOp.confirm:
+        await order_confirm_cb(cb, state, db)
+    else:
+        await order_cancel_cb(cb, state)
+
+
+@router.message(Command(commands=['cancel']), flags={'throttle': 'checkout'})
 async def cancel_order(message: Message, state: FSMContext):
     await state.clear()
     await message.answer('Оформление заказа отменено')
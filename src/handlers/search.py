@@ -0,0 +1,88 @@
+import os
+from aiogram import Router
+from aiogram.filters import Command
+from aiogram.types import (
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    Message,
+)
+from typing import Optional, Tuple
+from src.db import DB
+from src.handlers.callbacks import ProductCard, SearchPage, edit_message, pack_or_none, table
+
+router = Router()
+
+# Results per /search page and per inline-mode batch
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '8'))
+INLINE_PAGE_SIZE = int(os.getenv('INLINE_PAGE_SIZE', '20'))
+
+
+async def search_view(db: DB, query: str, offset: int = 0) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    # one extra row tells whether there is a next page
+    found = await db.search_products(query, SEARCH_PAGE_SIZE + 1, offset)
+    if not found:
+        return (f'По запросу «{query}» ничего не найдено' if offset == 0 else 'Больше результатов нет'), None
+    rows = [[InlineKeyboardButton(text=f"{p['name']} — {p['price']}", callback_data=ProductCard(product_id=p['id']).pack())] for p in found[:SEARCH_PAGE_SIZE]]
+    nav = []
+    for label, target, show in (('« Назад', offset - SEARCH_PAGE_SIZE, offset > 0), ('Далее »', offset + SEARCH_PAGE_SIZE, len(found) > SEARCH_PAGE_SIZE)):
+        # very long queries (or ones with ':') do not fit into a button; inline mode pages them instead
+        data = pack_or_none(SearchPage(offset=target, query=query)) if show else None
+        if data:
+            nav.append(InlineKeyboardButton(text=label, callback_data=data))
+    if nav:
+        rows.append(nav)
+    return f'Результаты поиска «{query}»:', InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@router.message(Command(commands=['search']))
+async def cmd_search(message: Message, db: DB):
+    parts = (message.text or '').split(maxsplit=1)
+    if len(parts) < 2 or db.search_match(parts[1]) is None:
+        await message.answer('Использование: /search <запрос>, например /search стул')
+        return
+    try:
+        text, kb = await search_view(db, parts[1].strip())
+        await message.answer(text, reply_markup=kb)
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.search')
+        logger.exception('Error searching products')
+        await message.answer('Ошибка поиска. Попробуйте позже.')
+
+
+@table(SearchPage)
+async def search_page_cb(query: CallbackQuery, callback_data: SearchPage, db: DB):
+    try:
+        view, kb = await search_view(db, callback_data.query, max(callback_data.offset, 0))
+        await edit_message(query, view, kb)
+        await query.answer()
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.search')
+        logger.exception('Error paging search results')
+        await query.answer('Ошибка поиска', show_alert=True)
+
+
+@router.inline_query()
+async def inline_search(inline: InlineQuery, db: DB):
+    offset = int(inline.offset) if inline.offset.isdigit() else 0
+    try:
+        found = await db.search_products(inline.query, INLINE_PAGE_SIZE, offset) if inline.query.strip() else []
+    except Exception:
+        logger = __import__('logging').getLogger('handlers.search')
+        logger.exception('Error in inline search')
+        found = []
+    results = [
+        InlineQueryResultArticle(
+            id=str(p['id']),
+            title=p['name'],
+            description=f"{p['price']} — {(p['description'] or '')[:100]}",
+            input_message_content=InputTextMessageContent(message_text=f"{p['name']}\n{p['description'] or ''}\nЦена: {p['price']}"),
+        )
+        for p in found
+    ]
+    # Telegram asks for the next batch with this offset when the user scrolls
+    next_offset = str(offset + INLINE_PAGE_SIZE) if len(found) == INLINE_PAGE_SIZE else ''
+    await inline.answer(results, cache_time=30, next_offset=next_offset)
@@ -0,0 +1,40 @@
+import logging
+import logging.handlers
+import os
+import queue
+from typing import List
+
+# Levels: LOG_LEVEL for our code, AIOGRAM_LOG_LEVEL for the framework (its INFO logs every update)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+AIOGRAM_LOG_LEVEL = os.getenv('AIOGRAM_LOG_LEVEL', 'WARNING').upper()
+# Rotating log file; empty value logs to the console only
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+def setup_logging(level: str = LOG_LEVEL, aiogram_level: str = AIOGRAM_LOG_LEVEL, log_file: str = LOG_FILE) -> logging.handlers.QueueListener:
+    """Route all logging through a queue drained by a background thread.
+
+    Loggers only enqueue records on the event loop thread; console and
+    rotating-file I/O happen in the listener thread. Returns the started
+    listener; call ``stop()`` on it at exit to flush pending records.
+    """
+    fmt = logging.Formatter(LOG_FORMAT)
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=2_000_000, backupCount=3, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(fmt)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    logging.getLogger('aiogram').setLevel(aiogram_level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -1,14 +1,12 @@
 import logging
-import logging.handlers
 import asyncio
 import os
+from typing import Optional
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import Command
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
-from src.db import DB, init_db
-
-from src.handlers import catalog, cart, order, admin
 
 # Load .env if python-dotenv is available (optional)
 try:
@@ -20,70 +18,86 @@ except Exception:
     # dotenv not installed or failed to load; ignore and rely on environment variables
     pass
 
+# Project modules read their settings from the environment at import time, so import them after .env is loaded
+from src.db import DB, init_db
+from src.fsm_storage import SQLiteStorage
+from src.logging_setup import setup_logging
+from src.notifier import Notifier
+from src import metrics
+from src.middlewares import ThrottleMiddleware, UpdateDedupMiddleware, UpdateTraceMiddleware, mark_scope, setup_handler_metrics
+from src.sender import setup_send_scheduler
+from src.cluster import run_cluster
+from src.webhook import run_webhook
+
+from src.handlers import callbacks, catalog, cart, order, admin, search
+
 # Prefer environment variable; fallback to placeholder (will raise if not set)
 API_TOKEN = os.getenv('API_TOKEN', '<PUT_YOUR_TOKEN_HERE>')
+# How updates are received: 'polling' (default), 'webhook' (see src.webhook) or 'cluster' (polling, handled by worker processes; see src.cluster)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# FSM storage: 'sqlite' (persistent, default) or 'memory'
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
 
-# Logging setup: console + rotating file
 logger = logging.getLogger('bot')
-logger.setLevel(logging.DEBUG)
-# also enable aiogram debug logs
-logging.getLogger('aiogram').setLevel(logging.DEBUG)
-fmt = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
-ch = logging.StreamHandler()
-ch.setFormatter(fmt)
-fh = logging.handlers.RotatingFileHandler('bot.log', maxBytes=2_000_000, backupCount=3, encoding='utf-8')
-fh.setFormatter(fmt)
-logger.addHandler(ch)
-logger.addHandler(fh)
-
-
-async def main():
-    await init_db()
-    if not API_TOKEN or API_TOKEN == '<PUT_YOUR_TOKEN_HERE>':
-        logger.error('API_TOKEN is not set. Please set API_TOKEN in environment or .env file.')
-        raise SystemExit('API_TOKEN is missing')
-
-    bot = Bot(token=API_TOKEN)
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
-
-    # Reply keyboard with primary actions so users see available buttons
-    main_kb = ReplyKeyboardMarkup(keyboard=[
-        [KeyboardButton(text='Каталог'), KeyboardButton(text='Корзина')],
-        [KeyboardButton(text='Помощь')]
-    ], resize_keyboard=True)
-
-    # Log bot identity to help debug that we run the expected bot/token
-    try:
-        me = await bot.get_me()
-        logger.info('Bot running as %s (id=%s)', getattr(me, 'username', None), getattr(me, 'id', None))
-    except Exception:
-        logger.exception('Failed to get bot identity')
-
-    # Ensure webhook is cleared so polling receives updates (useful if a webhook was set earlier)
-    try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info('Webhook cleared (if existed)')
-    except Exception:
-        logger.exception('Failed to delete webhook')
 
+# Reply keyboard with primary actions so users see available buttons (built once, shared by all replies)
+main_kb = ReplyKeyboardMarkup(keyboard=[
+    [KeyboardButton(text='Каталог'), KeyboardButton(text='Корзина')],
+    [KeyboardButton(text='Помощь')]
+], resize_keyboard=True)
+
+
+def reply_button(label: str):
+    """Filter for a reply keyboard button.
+
+    It is a coroutine on purpose: aiogram runs plain (sync) filters in the
+    default thread pool, once per incoming message.
+    """
+
+    async def check(message: Message) -> bool:
+        return (message.text or '').strip().lower() == label
+
+    return check
+
+
+def build_dispatcher(db: DB, storage: Optional[BaseStorage] = None, notifier: Optional[Notifier] = None) -> Dispatcher:
+    """Create the dispatcher with all routers and the shared `db` injected into handlers.
+
+    The pool is opened on dispatcher startup and closed on shutdown (after the
+    FSM storage has been closed and flushed). The optional `notifier` is
+    injected as well and runs between the two, like the update deduplication
+    (which loads and stores its mark through `db`).
+    """
+    dp = Dispatcher(storage=storage or MemoryStorage(), db=db)
+    dp.startup.register(db.connect)
+    # Repeated updates (redelivery after a restart) and double taps never reach the handlers
+    dedup = UpdateDedupMiddleware(db, scope=mark_scope(BOT_MODE))
+    dp.update.outer_middleware(dedup)
+    dp['update_dedup'] = dedup
+    dp.startup.register(dedup.start)
+    if notifier is not None:
+        dp['notifier'] = notifier
+        dp.startup.register(notifier.start)
+        dp.shutdown.register(notifier.close)
+    dp.shutdown.register(dedup.close)
+    dp.shutdown.register(db.close)
+
+    # every inline button is routed by the callback_data prefix table (src.handlers.callbacks)
+    dp.include_router(callbacks.router)
     dp.include_router(catalog.router)
     dp.include_router(cart.router)
     dp.include_router(order.router)
     dp.include_router(admin.router)
+    dp.include_router(search.router)
 
-    # Debug: log raw updates (helps ensure callbacks reach the process)
-    @dp.update()
-    async def _log_raw_update(update):
-        try:
-            # Print minimal info so it appears in container logs
-            kind = type(update).__name__
-            # try to get callback data or message text
-            data = getattr(getattr(update, 'callback_query', None), 'data', None) or getattr(getattr(update, 'message', None), 'text', None)
-            print(f'RAW_UPDATE: type={kind} data={data}')
-            logger.debug('Raw update received: %s', update)
-        except Exception:
-            logger.exception('Failed to log raw update')
+    # Sampled structured trace of incoming updates (UPDATE_TRACE_SAMPLE)
+    dp.update.outer_middleware(UpdateTraceMiddleware())
+    # Per-user flood protection by handler group (THROTTLE_LIMITS); throttled updates never reach the metrics below
+    throttle = ThrottleMiddleware()
+    for event in ('message', 'callback_query', 'inline_query'):
+        dp.observers[event].middleware(throttle)
+    # Per-handler latency/error metrics (recorded only while src.metrics is enabled)
+    setup_handler_metrics(dp)
 
     @dp.message(Command(commands=['start']))
     async def cmd_start(message: Message):
@@ -99,8 +113,15 @@ async def main():
                     '/add_product <category_id>|<name>|<description>|<price>\n'
                     '/edit_product <product_id>|<name>|<description>|<price>\n'
                     '/delete_product <product_id>\n'
-                    '/list_orders\n'
-                    '/set_status <order_id> <status>'
+                    '/import_catalog (caption of a CSV/JSON/JSONL file)\n'
+                    '/export_catalog [csv|jsonl]\n'
+                    '/set_stock <product_id> <qty|none>\n'
+                    '/adjust_stock <product_id>:<delta>,...\n'
+                    '/list_orders [status=..] [user=..] [from=YYYY-MM-DD] [to=YYYY-MM-DD]\n'
+                    '/export_orders [same filters] (CSV file)\n'
+                    '/set_status <order_id> <status>\n'
+                    '/broadcast <text>\n'
+                    '/broadcast_status [broadcast_id]'
                 )
             else:
                 await message.answer('Только для админов')
@@ -110,23 +131,73 @@ async def main():
             await message.answer('Ошибка')
 
     # Handlers for reply keyboard buttons
-    @dp.message(lambda m: (m.text or '').strip().lower() == 'каталог')
-    async def kb_catalog(message: Message):
-        await catalog.show_categories(message)
+    @dp.message(reply_button('каталог'))
+    async def kb_catalog(message: Message, db: DB):
+        await catalog.show_categories(message, db)
 
-    @dp.message(lambda m: (m.text or '').strip().lower() == 'корзина')
-    async def kb_cart(message: Message):
-        await cart.show_cart(message)
+    @dp.message(reply_button('корзина'))
+    async def kb_cart(message: Message, db: DB):
+        await cart.show_cart(message, db)
 
-    @dp.message(lambda m: (m.text or '').strip().lower() == 'помощь')
+    @dp.message(reply_button('помощь'))
     async def kb_help(message: Message):
-        await message.answer('Доступные команды и кнопки:\nКаталог — открыть каталог товаров\nКорзина — посмотреть корзину\n/confirm — подтвердить заказ (также есть кнопка в процессе оформления)')
+        await message.answer('Доступные команды и кнопки:\nКаталог — открыть каталог товаров\n/search <запрос> — поиск товаров (или @имя_бота <запрос> в любом чате)\nКорзина — посмотреть корзину\n/confirm — подтвердить заказ (также есть кнопка в процессе оформления)')
+
+    return dp
+
+
+async def main():
+    await init_db()
+    if not API_TOKEN or API_TOKEN == '<PUT_YOUR_TOKEN_HERE>':
+        logger.error('API_TOKEN is not set. Please set API_TOKEN in environment or .env file.')
+        raise SystemExit('API_TOKEN is missing')
+
+    if BOT_MODE == 'cluster':
+        # this process only receives updates; the dispatcher runs in the worker processes
+        bot = Bot(token=API_TOKEN)
+        await bot.delete_webhook(drop_pending_updates=True)
+        await run_cluster(bot, build_dispatcher(DB(':memory:')).resolve_used_update_types())
+        return
+
+    # One pooled DB instance for the whole process; handlers receive it as the `db` argument
+    db = DB()
+    storage = SQLiteStorage(db) if FSM_STORAGE == 'sqlite' else MemoryStorage()
+    bot = Bot(token=API_TOKEN)
+    # Every Bot API call is paced by per-chat and global token buckets (see src.sender)
+    scheduler = setup_send_scheduler(bot)
+    # Order status notifications and broadcasts are delivered in the background from SQLite
+    dp = build_dispatcher(db, storage, Notifier(db, bot))
+    dp.shutdown.register(scheduler.close)
+    if metrics.METRICS_PORT:
+        metrics_runner = await metrics.start_metrics_server()
+        dp.shutdown.register(metrics_runner.cleanup)
+
+    # Log bot identity to help debug that we run the expected bot/token
+    try:
+        me = await bot.get_me()
+        logger.info('Bot running as %s (id=%s)', getattr(me, 'username', None), getattr(me, 'id', None))
+    except Exception:
+        logger.exception('Failed to get bot identity')
+
+    if BOT_MODE == 'webhook':
+        await run_webhook(dp, bot)
+        return
+
+    # Ensure webhook is cleared so polling receives updates (useful if a webhook was set earlier)
+    try:
+        await bot.delete_webhook(drop_pending_updates=True)
+        logger.info('Webhook cleared (if existed)')
+    except Exception:
+        logger.exception('Failed to delete webhook')
 
     await dp.start_polling(bot)
 
 
 if __name__ == '__main__':
+    listener = setup_logging()
     try:
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logger.info('Bot stopped')
+    finally:
+        listener.stop()
@@ -0,0 +1,195 @@
+"""Minimal Prometheus-style metrics (no external dependency).
+
+Instrumentation is off unless :func:`enable` is called (``METRICS_PORT`` > 0
+in ``src.main``); every hook first checks the module-level ``enabled`` flag,
+so disabled metrics cost a single attribute lookup.
+"""
+import bisect
+import logging
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Port of the local /metrics endpoint; 0 disables instrumentation entirely
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+enabled = False
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [f'{self.name}{_labels(self.labelnames, k)} {v}' for k, v in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) - amount
+
+    def set(self, *labels: str, value: float) -> None:
+        self.values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket..., count in +Inf only], sum
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total[0]}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram('bot_handler_seconds', 'Handler latency in seconds', ('event', 'handler')))
+HANDLER_ERRORS = REGISTRY.register(Counter('bot_handler_errors_total', 'Handler calls that raised', ('event', 'handler')))
+HANDLERS_IN_FLIGHT = REGISTRY.register(Gauge('bot_handlers_in_flight', 'Handler calls currently running', ('event', 'handler')))
+DB_SECONDS = REGISTRY.register(Histogram('bot_db_query_seconds', 'SQLite statement latency in seconds', ('statement',)))
+DB_ERRORS = REGISTRY.register(Counter('bot_db_query_errors_total', 'SQLite statements that failed', ('statement',)))
+DB_IN_FLIGHT = REGISTRY.register(Gauge('bot_db_queries_in_flight', 'SQLite statements currently running'))
+SEND_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'bot_send_wait_seconds', 'Time Bot API calls waited for a rate-limit slot', ('priority',),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+))
+SEND_QUEUED = REGISTRY.register(Gauge('bot_send_queued', 'Bot API calls waiting for a rate-limit slot', ('priority',)))
+SEND_RETRY_AFTER = REGISTRY.register(Counter('bot_send_retry_after_total', 'Bot API calls answered with 429 retry_after', ('method',)))
+NOTIFICATIONS = REGISTRY.register(Counter('bot_notifications_total', 'Notification delivery attempts by outcome', ('kind', 'result')))
+UPDATES_DROPPED = REGISTRY.register(Counter('bot_updates_dropped_total', 'Repeated updates and callback taps not handled', ('reason',)))
+THROTTLED = REGISTRY.register(Counter('bot_throttled_total', 'Updates rejected by the per-user rate limit', ('group',)))
+
+_WHITESPACE = re.compile(r'\s+')
+_statement_labels: Dict[str, str] = {}
+
+
+def statement_label(sql: str) -> str:
+    """Collapse a SQL string into a short, stable label (memoized per distinct SQL)."""
+    label = _statement_labels.get(sql)
+    if label is None:
+        label = _WHITESPACE.sub(' ', sql).strip()[:80]
+        if len(_statement_labels) < 1000:
+            _statement_labels[sql] = label
+    return label
+
+
+class track_db:
+    """Context manager timing one DB call; does nothing while metrics are disabled."""
+
+    __slots__ = ('sql', 'start')
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.start: Optional[float] = None
+
+    def __enter__(self) -> 'track_db':
+        if enabled:
+            self.start = time.perf_counter()
+            DB_IN_FLIGHT.inc()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.start is None:
+            return
+        label = statement_label(self.sql)
+        DB_IN_FLIGHT.dec()
+        DB_SECONDS.observe(time.perf_counter() - self.start, label)
+        if exc_type is not None:
+            DB_ERRORS.inc(label)
+
+
+def enable() -> None:
+    global enabled
+    enabled = True
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=REGISTRY.render().encode('utf-8'), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    """Enable instrumentation and serve GET /metrics; returns the runner to clean up on shutdown."""
+    enable()
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('Metrics endpoint on http://%s:%s/metrics', host, port)
+    return runner
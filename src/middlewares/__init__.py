@@ -0,0 +1,15 @@
+from .dedup import UpdateDedupMiddleware, mark_scope
+from .metrics import HandlerMetricsMiddleware, setup_handler_metrics
+from .priority import SendPriorityMiddleware
+from .throttle import ThrottleMiddleware
+from .trace import UpdateTraceMiddleware
+
+__all__ = [
+    'HandlerMetricsMiddleware',
+    'SendPriorityMiddleware',
+    'ThrottleMiddleware',
+    'UpdateDedupMiddleware',
+    'UpdateTraceMiddleware',
+    'mark_scope',
+    'setup_handler_metrics',
+]
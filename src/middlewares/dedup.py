@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from src import metrics
+from src.db import DB
+from src.utils import NODE_ID
+
+logger = logging.getLogger(__name__)
+
+# Recently seen update ids and callback query ids remembered in memory
+UPDATE_DEDUP_SIZE = int(os.getenv('UPDATE_DEDUP_SIZE', '10000'))
+# Seconds between writes of the handled-updates mark to SQLite; 0 disables the mark
+UPDATE_MARK_INTERVAL = float(os.getenv('UPDATE_MARK_INTERVAL', '1'))
+# Row of update_marks used by this process; processes receiving different update streams need different
+# scopes. Unset: one row for long polling, one per replica in webhook mode (see mark_scope)
+UPDATE_MARK_SCOPE = os.getenv('UPDATE_MARK_SCOPE')
+# Telegram may restart update ids after a week without updates, so older marks are ignored
+UPDATE_MARK_MAX_AGE = 7 * 24 * 3600
+
+
+def mark_scope(mode: str = 'polling') -> str:
+    """UPDATE_MARK_SCOPE, or the default scope of the mark for BOT_MODE ``mode``.
+
+    A bot has a single long polling consumer, but every webhook replica
+    behind a load balancer sees only its part of the updates, so each keeps
+    its own mark: keyed by NODE_ID when set, else by the host name (which a
+    container keeps across restarts).
+    """
+    if UPDATE_MARK_SCOPE:
+        return UPDATE_MARK_SCOPE
+    if mode == 'webhook':
+        return f'webhook-{NODE_ID}' if NODE_ID is not None else f'webhook-{socket.gethostname()}'
+    return 'bot'
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """Outer update middleware that keeps repeated updates and taps away from the handlers.
+
+    An update is dropped when
+
+    - its ``update_id`` or callback query id is among the last ``size`` seen;
+    - its ``update_id`` is at or below the mark stored in ``update_marks`` by
+      the previous run: Telegram redelivers updates that were fetched but not
+      confirmed when the bot stopped;
+    - it is a callback query with the same data from the same user as one
+      that is still being handled (a double tap); the duplicate is only
+      answered, so the button stops spinning.
+
+    The mark is the highest ``update_id`` below which every update received
+    has been handled; it is written every ``mark_interval`` seconds and on
+    :meth:`close`, so after a crash up to that much work may run again.
+    Updates queued before they reach the middleware (a cluster worker waiting
+    for a free slot or for the previous update of the chat) are registered
+    with :meth:`accept` and keep the mark below them until :meth:`release`.
+    """
+
+    def __init__(
+        self,
+        db: DB,
+        scope: Optional[str] = None,
+        size: int = UPDATE_DEDUP_SIZE,
+        mark_interval: float = UPDATE_MARK_INTERVAL,
+    ):
+        self.db = db
+        self.scope = scope or mark_scope()
+        self.size = size
+        self.mark_interval = mark_interval
+        # update ids at or below this were handled before the start
+        self.start_mark: Optional[int] = None
+        self.dropped = 0
+        self._seen: 'OrderedDict[Hashable, None]' = OrderedDict()
+        self._handling: Dict[int, None] = {}
+        # accepted by the caller but not yet finished: update_id -> times accepted
+        self._accepted: Dict[int, int] = {}
+        self._taps: Set[Tuple[int, str]] = set()
+        self._max_handled: Optional[int] = None
+        self._saved_mark: Optional[int] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.mark_interval <= 0:
+            return
+        row = await self.db.get_update_mark(self.scope)
+        if row is not None and row['updated_at'] >= time.time() - UPDATE_MARK_MAX_AGE:
+            self.start_mark = self._saved_mark = row['update_id']
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def accept(self, update_id: int) -> None:
+        """Register an update that will be fed to the dispatcher later; :meth:`release` it once done."""
+        self._accepted[update_id] = self._accepted.get(update_id, 0) + 1
+
+    def release(self, update_id: int) -> None:
+        count = self._accepted.pop(update_id, 0) - 1
+        if count > 0:
+            self._accepted[update_id] = count
+        if self._max_handled is None or update_id > self._max_handled:
+            self._max_handled = update_id
+
+    def mark(self) -> Optional[int]:
+        """Highest update_id such that every update received up to it has been handled."""
+        waiting = [min(ids) for ids in (self._handling, self._accepted) if ids]
+        if waiting:
+            return min(waiting) - 1
+        return self._max_handled
+
+    async def save_mark(self) -> None:
+        mark = self.mark()
+        if mark is not None and (self._saved_mark is None or mark > self._saved_mark):
+            await self.db.set_update_mark(self.scope, mark)
+            self._saved_mark = mark
+
+    async def _write_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.mark_interval)
+            try:
+                await self.save_mark()
+            except Exception:
+                logger.exception('Saving the update mark failed')
+
+    async def close(self) -> None:
+        if self._writer is None:
+            return
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._writer = None
+        await self.save_mark()
+
+    def _seen_before(self, key: Hashable) -> bool:
+        if key in self._seen:
+            return True
+        self._seen[key] = None
+        if len(self._seen) > self.size:
+            self._seen.popitem(last=False)
+        return False
+
+    def _drop(self, reason: str) -> None:
+        self.dropped += 1
+        if metrics.enabled:
+            metrics.UPDATES_DROPPED.inc(reason)
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        update_id = event.update_id
+        if self.start_mark is not None and update_id <= self.start_mark:
+            self._drop('mark')
+            return None
+        if self._seen_before(update_id):
+            self._drop('update_id')
+            return None
+        query = event.callback_query
+        tap = None
+        if query is not None:
+            if self._seen_before(('callback', query.id)):
+                self._drop('callback_id')
+                return None
+            tap = (query.from_user.id, query.data or '')
+            if tap in self._taps:
+                self._drop('in_flight')
+                try:
+                    await data['bot'].answer_callback_query(query.id)
+                except Exception:
+                    logger.warning('Could not answer a repeated callback query %s', query.id)
+                return None
+            self._taps.add(tap)
+        self._handling[update_id] = None
+        try:
+            return await handler(event, data)
+        finally:
+            del self._handling[update_id]
+            if self._max_handled is None or update_id > self._max_handled:
+                self._max_handled = update_id
+            if tap is not None:
+                self._taps.discard(tap)
@@ -0,0 +1,46 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+
+from src import metrics
+
+# Observers whose handlers are instrumented
+INSTRUMENTED_EVENTS = ('message', 'callback_query', 'inline_query')
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware recording latency, errors and in-flight calls per handler."""
+
+    def __init__(self, event: str):
+        self.event = event
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not metrics.enabled:
+            return await handler(event, data)
+        # callback queries are dispatched by prefix; label them with the routed handler
+        handler_object = data.get('callback_handler') or data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        labels = (self.event, name)
+        metrics.HANDLERS_IN_FLIGHT.inc(*labels)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(*labels)
+            raise
+        finally:
+            metrics.HANDLER_SECONDS.observe(time.perf_counter() - start, *labels)
+            metrics.HANDLERS_IN_FLIGHT.dec(*labels)
+
+
+def setup_handler_metrics(dp: Dispatcher) -> None:
+    """Instrument every handler of the dispatcher and its included routers."""
+    for event in INSTRUMENTED_EVENTS:
+        dp.observers[event].middleware(HandlerMetricsMiddleware(event))
@@ -0,0 +1,22 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from src.sender import priority
+
+
+class SendPriorityMiddleware(BaseMiddleware):
+    """Inner middleware: Bot API calls made by the router's handlers use the given send priority."""
+
+    def __init__(self, level: int):
+        self.level = level
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        with priority(self.level):
+            return await handler(event, data)
@@ -0,0 +1,111 @@
+import logging
+import math
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject, User
+
+from src import metrics
+from src.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Per-user limits by handler group as "group=rate/burst,...": actions per second and the burst allowed at once
+THROTTLE_LIMITS = os.getenv('THROTTLE_LIMITS', 'browse=2/10,cart=2/10,checkout=1/10,admin=5/30')
+# Limits of users idle for this many seconds are forgotten (must exceed burst/rate of every group)
+THROTTLE_IDLE = float(os.getenv('THROTTLE_IDLE', '60'))
+
+# Group of handlers without a `throttle` flag
+DEFAULT_GROUP = 'browse'
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """``'browse=2/10,cart=1/5'`` -> ``{'browse': (2.0, 10.0), 'cart': (1.0, 5.0)}``."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        group, _, value = item.partition('=')
+        rate, _, burst = value.partition('/')
+        limits[group.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class _UserLimit(TokenBucket):
+    """Token bucket of one user in one group; ``warned`` is set once the user was told to slow down."""
+
+    __slots__ = ('warned',)
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        super().__init__(rate, capacity, now)
+        self.warned = False
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    """Inner middleware limiting how often each user reaches the handlers of a group.
+
+    The group is the handler's ``throttle`` flag (``flags={'throttle': 'cart'}``
+    on the router or callback table registration), ``'browse'`` by default;
+    groups without a limit are not throttled. Every user has one token bucket
+    per group used, and buckets idle for ``idle`` seconds are dropped.
+
+    A throttled callback query is answered with a short notice; a throttled
+    message gets one reply per flood, not one per message, so the bot does not
+    spend its own send limits on the flooder.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float]]] = None, idle: float = THROTTLE_IDLE):
+        self.limits = parse_limits(THROTTLE_LIMITS) if limits is None else limits
+        self.idle = idle
+        self.throttled = 0
+        self._users: Dict[Tuple[str, int], _UserLimit] = {}
+        self._last_prune = time.monotonic()
+
+    def _prune(self, now: float) -> None:
+        if now - self._last_prune < self.idle:
+            return
+        self._last_prune = now
+        for key in [k for k, b in self._users.items() if now - b.updated >= self.idle]:
+            del self._users[key]
+
+    def active_users(self) -> int:
+        return len(self._users)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: Optional[User] = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+        # callback queries are dispatched by prefix; the flag is on the routed handler
+        group = get_flag(data.get('callback_handler') or data, 'throttle', default=DEFAULT_GROUP)
+        limit = self.limits.get(group)
+        if limit is None:
+            return await handler(event, data)
+        now = time.monotonic()
+        self._prune(now)
+        key = (group, user.id)
+        bucket = self._users.get(key)
+        if bucket is None:
+            bucket = self._users[key] = _UserLimit(limit[0], limit[1], now)
+        if bucket.try_take(now):
+            bucket.warned = False
+            return await handler(event, data)
+
+        self.throttled += 1
+        if metrics.enabled:
+            metrics.THROTTLED.inc(group)
+        text = f'Слишком часто. Подождите {math.ceil(bucket.delay(now))} с.'
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer(text)
+            elif isinstance(event, Message) and not bucket.warned:
+                await event.answer(text)
+        except Exception:
+            logger.warning('Could not answer a throttled update from user %s', user.id)
+        bucket.warned = True
+        return None
@@ -0,0 +1,60 @@
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger('bot.trace')
+
+# Fraction of updates written to the trace log (0 disables, 1 traces everything)
+UPDATE_TRACE_SAMPLE = float(os.getenv('UPDATE_TRACE_SAMPLE', '0.01'))
+
+
+def describe_update(update: Update) -> Dict[str, Any]:
+    """Small, flat summary of an update: never the full repr of the pydantic model."""
+    info: Dict[str, Any] = {'update_id': update.update_id}
+    if update.callback_query is not None:
+        info.update(type='callback_query', user_id=update.callback_query.from_user.id, data=update.callback_query.data)
+    elif update.message is not None:
+        user = update.message.from_user
+        info.update(type='message', user_id=user.id if user else None, text=(update.message.text or '')[:64])
+    elif update.inline_query is not None:
+        info.update(type='inline_query', user_id=update.inline_query.from_user.id, query=update.inline_query.query[:64])
+    else:
+        info['type'] = 'other'
+    return info
+
+
+class UpdateTraceMiddleware(BaseMiddleware):
+    """Outer update middleware logging a sampled, structured line per update.
+
+    Unsampled updates cost one ``random()`` call; sampled ones are logged as a
+    JSON object with the update summary, outcome and handling time.
+    """
+
+    def __init__(self, sample_rate: float = UPDATE_TRACE_SAMPLE):
+        self.sample_rate = sample_rate
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return await handler(event, data)
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            return await handler(event, data)
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            info = describe_update(event)
+            info.update(outcome=outcome, ms=round((time.perf_counter() - start) * 1000, 2))
+            logger.info('update %s', json.dumps(info, ensure_ascii=False))
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from src import metrics
+from src.db import DB
+from src.sender import LOW, NORMAL, priority
+
+logger = logging.getLogger(__name__)
+
+# Notifications claimed per round; the send scheduler paces them to Telegram's limits
+NOTIFY_BATCH = int(os.getenv('NOTIFY_BATCH', '50'))
+# Seconds between polls of the queue when nothing woke the notifier up
+NOTIFY_POLL_INTERVAL = float(os.getenv('NOTIFY_POLL_INTERVAL', '5'))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '5'))
+# Claims older than this (a crashed process) are handed out again
+NOTIFY_CLAIM_TIMEOUT = float(os.getenv('NOTIFY_CLAIM_TIMEOUT', '300'))
+
+ORDER_STATUS_TEXT = 'Статус заказа {order_number}: {status}'
+
+
+class Notifier:
+    """Background delivery of queued notifications (table ``notifications``).
+
+    Order status changes and admin broadcasts are written to SQLite by
+    ``DB.update_order_status`` / ``DB.create_broadcast``; the notifier claims
+    them in batches, sends them through the bot (broadcasts in the LOW send
+    lane, so they never delay replies) and records the outcome. Failed sends
+    are retried with backoff up to ``max_attempts``; users who blocked the bot
+    are marked failed at once. Because the queue lives in the database,
+    delivery resumes after a restart. When a broadcast has nothing left to
+    deliver its author receives a summary.
+    """
+
+    def __init__(
+        self,
+        db: DB,
+        bot: Bot,
+        batch_size: int = NOTIFY_BATCH,
+        poll_interval: float = NOTIFY_POLL_INTERVAL,
+        max_attempts: int = NOTIFY_MAX_ATTEMPTS,
+    ):
+        self.db = db
+        self.bot = bot
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._claimed: Set[int] = set()
+
+    def wake(self) -> None:
+        """Deliver newly queued notifications now instead of at the next poll."""
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._claimed:
+            # interrupted mid-batch: hand the unsent notifications back
+            await self.db.release_notifications(ids=list(self._claimed))
+            self._claimed.clear()
+
+    async def _run(self) -> None:
+        released = await self.db.release_notifications(older_than=NOTIFY_CLAIM_TIMEOUT)
+        if released:
+            logger.info('Resuming %s interrupted notifications', released)
+        while True:
+            try:
+                delivered = await self.deliver_batch()
+            except Exception:
+                logger.exception('Notification delivery failed')
+                delivered = 0
+            if delivered:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def deliver_batch(self) -> int:
+        """Claim and send one batch; returns the number of notifications processed."""
+        batch = await self.db.claim_notifications(self.batch_size)
+        if not batch:
+            return 0
+        self._claimed = {n['id'] for n in batch}
+        results = await asyncio.gather(*(self._send(n) for n in batch))
+        sent: List[int] = []
+        failed: List[tuple] = []
+        retry: List[tuple] = []
+        for n, error in zip(batch, results):
+            if error is None:
+                sent.append(n['id'])
+                result = 'sent'
+            elif error.startswith('permanent:') or n['attempts'] >= self.max_attempts:
+                failed.append((n['id'], error))
+                result = 'failed'
+            else:
+                retry.append((n['id'], error, time.time() + min(2 ** n['attempts'], 300)))
+                result = 'retry'
+            if metrics.enabled:
+                metrics.NOTIFICATIONS.inc(n['kind'], result)
+        await self.db.finish_notifications(sent, failed, retry)
+        self._claimed = set()
+        logger.info('Notifications delivered: %s sent, %s failed, %s to retry', len(sent), len(failed), len(retry))
+        broadcasts = [n['broadcast_id'] for n in batch if n['broadcast_id'] is not None]
+        if broadcasts:
+            for progress in await self.db.finish_broadcasts(broadcasts):
+                await self._report(progress)
+        return len(batch)
+
+    async def _send(self, notification: Dict[str, Any]) -> Optional[str]:
+        """Send one notification; returns None on success or the error text."""
+        try:
+            with priority(LOW if notification['kind'] == 'broadcast' else NORMAL):
+                await self.bot.send_message(notification['user_id'], notification['text'])
+            return None
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # bot blocked by the user, chat not found, ...: retrying will not help
+            return f'permanent: {e}'
+        except Exception as e:
+            logger.warning('Failed to notify user %s: %s', notification['user_id'], e)
+            return str(e) or type(e).__name__
+
+    async def _report(self, progress: Dict[str, Any]) -> None:
+        logger.info('Broadcast %s finished: %s sent, %s failed of %s', progress['id'], progress['sent'], progress['failed'], progress['total'])
+        if progress['created_by'] is None:
+            return
+        try:
+            await self.bot.send_message(
+                progress['created_by'],
+                f"Рассылка #{progress['id']} завершена: доставлено {progress['sent']} из {progress['total']}, ошибок {progress['failed']}",
+            )
+        except Exception:
+            logger.exception('Failed to report broadcast %s', progress['id'])
@@ -0,0 +1,54 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator
+
+from src.db import DB
+
+ORDER_CSV_COLUMNS = [
+    'id', 'order_number', 'created_at', 'status', 'user_id', 'customer_name',
+    'phone', 'address', 'delivery_method', 'items', 'total',
+]
+
+
+def format_time(ts: Any) -> str:
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S') if ts else ''
+
+
+async def iter_orders_csv(db: DB, chunk_size: int = 500, **filters) -> AsyncIterator[str]:
+    """Yield the CSV export (header first) as text chunks of up to ``chunk_size`` orders.
+
+    ``filters`` are those of :meth:`DB.iter_orders`. Only one chunk of rows
+    is held in memory at a time.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ORDER_CSV_COLUMNS)
+    async for orders in db.iter_orders(chunk_size=chunk_size, **filters):
+        for o in orders:
+            # items are stored as a JSON object product_id -> qty; keep it compact in one cell
+            items = ' '.join(f'{pid}x{qty}' for pid, qty in json.loads(o['items'] or '{}').items())
+            writer.writerow([
+                o['id'], o['order_number'], format_time(o['created_at']), o['status'], o['user_id'], o['customer_name'],
+                o['phone'], o['address'], o['delivery_method'], items, o['total'],
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def export_orders_csv(db: DB, path: str, **filters) -> int:
+    """Stream matching orders into a CSV file at ``path``; returns the number of bytes written.
+
+    File writes run in a worker thread so the event loop keeps serving updates.
+    """
+    written = 0
+    # utf-8-sig so that Excel detects the encoding of Cyrillic names
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        async for chunk in iter_orders_csv(db, **filters):
+            written += await asyncio.to_thread(f.write, chunk)
+    return written
@@ -0,0 +1,44 @@
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, at most ``capacity`` stored.
+
+    Refill is computed lazily from the monotonic clock on each call, so an idle
+    bucket costs nothing.
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: Optional[float] = None) -> float:
+        """Seconds until one token is available (0 if available now)."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def try_take(self, now: Optional[float] = None) -> bool:
+        """Take one token if available."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def pause(self, seconds: float, now: Optional[float] = None) -> None:
+        """Drain the bucket so no token is available for ``seconds`` (e.g. after a 429)."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
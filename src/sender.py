@@ -0,0 +1,252 @@
+"""Outgoing request scheduling that respects Telegram's flood limits.
+
+Every Bot API call goes through :class:`SendSchedulerMiddleware` (attached to
+``bot.session`` in ``src.main``). Calls that post into a chat take one token
+from a global bucket (``SEND_GLOBAL_RATE`` per second) and one from the chat's
+own bucket (``SEND_CHAT_RATE``, or ``SEND_GROUP_RATE`` for groups) before they
+are made. When tokens are short, callers wait in priority lanes: checkout
+confirmations (HIGH) go before regular replies (NORMAL), which go before
+broadcasts (LOW). A 429 answer pauses the chat for ``retry_after`` seconds and
+the call is retried up to ``SEND_MAX_RETRIES`` times.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from src import metrics
+from src.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+SEND_GLOBAL_BURST = float(os.getenv('SEND_GLOBAL_BURST', '30'))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+SEND_CHAT_BURST = float(os.getenv('SEND_CHAT_BURST', '3'))
+# Telegram allows about 20 messages per minute into one group
+SEND_GROUP_RATE = float(os.getenv('SEND_GROUP_RATE', str(20 / 60)))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+# Chat buckets idle (and full) for this long are forgotten
+SEND_CHAT_IDLE = float(os.getenv('SEND_CHAT_IDLE', '60'))
+
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = ('high', 'normal', 'low')
+
+# Priority of requests made from the current task (see :func:`priority`)
+send_priority: contextvars.ContextVar[int] = contextvars.ContextVar('send_priority', default=NORMAL)
+
+# Methods that post or change messages in a chat and count towards flood limits
+_LIMITED_PREFIXES = ('Send', 'Forward', 'Copy', 'EditMessage')
+_UNLIMITED = frozenset({'SendChatAction'})
+
+ChatId = Union[int, str]
+
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """Make Bot API calls inside the block use the given priority lane."""
+    token = send_priority.set(level)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+def limited_chat(method: TelegramMethod) -> Optional[ChatId]:
+    """Chat the call counts against, or None if the call is not flood-limited."""
+    name = type(method).__name__
+    if name in _UNLIMITED or not name.startswith(_LIMITED_PREFIXES):
+        return None
+    return getattr(method, 'chat_id', None)
+
+
+class _Waiter:
+    __slots__ = ('chat_id', 'future', 'queued_at')
+
+    def __init__(self, chat_id: ChatId, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class SendScheduler:
+    """Token buckets per chat and globally, with priority lanes for waiting senders.
+
+    :meth:`acquire` returns at once while both buckets have tokens and nobody
+    is queued; otherwise the caller is queued in its lane and a single pump
+    task hands out global tokens, each to the first waiter (highest lane,
+    oldest first) whose chat bucket is ready. A chat that is rate-limited does
+    not hold back other chats queued behind it.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = SEND_GLOBAL_RATE,
+        global_burst: float = SEND_GLOBAL_BURST,
+        chat_rate: float = SEND_CHAT_RATE,
+        chat_burst: float = SEND_CHAT_BURST,
+        group_rate: float = SEND_GROUP_RATE,
+        chat_idle: float = SEND_CHAT_IDLE,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.chat_idle = chat_idle
+        self._chats: Dict[ChatId, TokenBucket] = {}
+        self._lanes: Tuple[Deque[_Waiter], ...] = tuple(deque() for _ in PRIORITY_NAMES)
+        self._wakeup = asyncio.Event()
+        self._pump: Optional[asyncio.Task] = None
+        self._last_prune = time.monotonic()
+
+    def _chat_bucket(self, chat_id: ChatId, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # negative ids are groups and channels
+            rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, max(1.0, min(self.chat_burst, rate * 60)), now)
+        return bucket
+
+    def queued(self) -> int:
+        return sum(len(lane) for lane in self._lanes)
+
+    async def acquire(self, chat_id: ChatId, level: Optional[int] = None) -> float:
+        """Wait for a send slot for ``chat_id``; returns the seconds spent waiting."""
+        level = send_priority.get() if level is None else level
+        now = time.monotonic()
+        self._prune(now)
+        chat = self._chat_bucket(chat_id, now)
+        if not self.queued() and chat.delay(now) == 0 and self.global_bucket.try_take(now):
+            chat.try_take(now)
+            return 0.0
+        waiter = _Waiter(chat_id, asyncio.get_running_loop().create_future())
+        self._lanes[level].append(waiter)
+        if metrics.enabled:
+            metrics.SEND_QUEUED.inc(PRIORITY_NAMES[level])
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        self._wakeup.set()
+        try:
+            await waiter.future
+        finally:
+            if metrics.enabled:
+                metrics.SEND_QUEUED.dec(PRIORITY_NAMES[level])
+        waited = time.monotonic() - waiter.queued_at
+        if metrics.enabled:
+            metrics.SEND_WAIT_SECONDS.observe(waited, PRIORITY_NAMES[level])
+        return waited
+
+    def _next_ready(self, now: float) -> Tuple[Optional[_Waiter], float]:
+        """First waiter whose chat has a token, or the time until some chat will."""
+        soonest = float('inf')
+        for lane in self._lanes:
+            for waiter in list(lane):
+                if waiter.future.done():  # cancelled by the caller
+                    lane.remove(waiter)
+                    continue
+                delay = self._chat_bucket(waiter.chat_id, now).delay(now)
+                if delay == 0:
+                    lane.remove(waiter)
+                    return waiter, 0.0
+                soonest = min(soonest, delay)
+        return None, soonest
+
+    async def _run_pump(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            wait = self.global_bucket.delay(now)
+            if wait == 0:
+                waiter, wait = self._next_ready(now)
+                if waiter is not None:
+                    self.global_bucket.try_take(now)
+                    self._chat_bucket(waiter.chat_id, now).try_take(now)
+                    waiter.future.set_result(None)
+                    continue
+                if wait == float('inf'):
+                    if not self.queued():
+                        return
+                    wait = None
+            try:
+                # new waiters may be able to go before the current soonest one
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def penalize(self, chat_id: Optional[ChatId], retry_after: float) -> None:
+        """Block a chat (or, without a chat, every send) for ``retry_after`` seconds."""
+        now = time.monotonic()
+        bucket = self.global_bucket if chat_id is None else self._chat_bucket(chat_id, now)
+        bucket.pause(retry_after, now)
+
+    def _prune(self, now: float) -> None:
+        if now - self._last_prune < self.chat_idle:
+            return
+        self._last_prune = now
+        busy = {w.chat_id for lane in self._lanes for w in lane}
+        for chat_id in [c for c, b in self._chats.items() if c not in busy and now - b.updated >= self.chat_idle and b.delay(now) == 0]:
+            del self._chats[chat_id]
+
+    async def close(self) -> None:
+        if self._pump is not None:
+            self._pump.cancel()
+            try:
+                await self._pump
+            except asyncio.CancelledError:
+                pass
+            self._pump = None
+        for lane in self._lanes:
+            for waiter in lane:
+                if not waiter.future.done():
+                    waiter.future.cancel()
+            lane.clear()
+
+
+class SendSchedulerMiddleware(BaseRequestMiddleware):
+    """Session middleware routing Bot API calls through a :class:`SendScheduler`."""
+
+    def __init__(self, scheduler: SendScheduler, max_retries: int = SEND_MAX_RETRIES):
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = limited_chat(method)
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                await self.scheduler.acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if metrics.enabled:
+                    metrics.SEND_RETRY_AFTER.inc(type(method).__name__)
+                if attempt > self.max_retries:
+                    raise
+                logger.warning('Flood limit on %s (chat %s), retrying in %ss', type(method).__name__, chat_id, e.retry_after)
+                if chat_id is None:
+                    await asyncio.sleep(e.retry_after)
+                else:
+                    self.scheduler.penalize(chat_id, e.retry_after)
+
+
+def setup_send_scheduler(bot: Bot, scheduler: Optional[SendScheduler] = None) -> SendScheduler:
+    """Attach a scheduler to the bot's session and return it (close it on shutdown)."""
+    scheduler = scheduler or SendScheduler()
+    bot.session.middleware(SendSchedulerMiddleware(scheduler))
+    return scheduler
@@ -1,16 +1,95 @@
 import logging
+import os
 import random
+import secrets
+import socket
 import string
-from typing import Final
+import time
+from typing import Final, Optional
 
 logger = logging.getLogger(__name__)
 
+# 'sequence' (default): time + node + counter, unique by construction across processes
+# 'random': legacy 6 random characters
+ORDER_NUMBER_MODE = os.getenv('ORDER_NUMBER_MODE', 'sequence')
+# Must differ between bot processes sharing one database (0..1023); when unset, every
+# process leases a node id no other process holds from the database (DB.lease_node_id)
+NODE_ID: Optional[int] = int(os.environ['NODE_ID']) if os.getenv('NODE_ID') else None
+
+# Crockford base32: no I, L, O, U, so numbers are easy to dictate over the phone
+BASE32: Final = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+
+def encode_base32(value: int) -> str:
+    """Encode a non-negative integer in Crockford base32."""
+    if value == 0:
+        return BASE32[0]
+    out = []
+    while value:
+        value, rem = divmod(value, 32)
+        out.append(BASE32[rem])
+    return ''.join(reversed(out))
+
+
+class OrderNumberGenerator:
+    """Monotonic, collision-free id source in the spirit of Snowflake ids.
+
+    Each id packs milliseconds since ``EPOCH_MS`` (41 bits), the node id
+    (10 bits) and a per-millisecond sequence (12 bits). Ids from one node are
+    strictly increasing even if the wall clock steps back, and ids from
+    different nodes never collide as long as every process has its own
+    ``node_id``. No locking: intended to be called from the event loop thread.
+
+    Without a ``node_id`` the generator is ``leased``: :meth:`DB.lease_node_id`
+    assigns it a node id held by no other process (as ``owner``) and renews the
+    lease before ``lease_due``; ids cannot be generated before that.
+    """
+
+    EPOCH_MS: Final = 1704067200000  # 2024-01-01T00:00:00Z
+    NODE_BITS: Final = 10
+    SEQUENCE_BITS: Final = 12
+
+    def __init__(self, node_id: Optional[int] = NODE_ID):
+        if node_id is not None and not 0 <= node_id < (1 << self.NODE_BITS):
+            raise ValueError(f'node_id must be in [0, {1 << self.NODE_BITS})')
+        self.node_id = node_id
+        self.leased = node_id is None
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}'
+        self.lease_due = 0.0
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self) -> int:
+        if self.node_id is None:
+            raise RuntimeError('No node id: set NODE_ID or lease one with DB.lease_node_id')
+        now = int(time.time() * 1000) - self.EPOCH_MS
+        if now > self._last_ms:
+            self._last_ms = now
+            self._sequence = 0
+        else:
+            # same millisecond or clock went back: keep counting on the last timestamp
+            self._sequence += 1
+            if self._sequence >> self.SEQUENCE_BITS:
+                # sequence exhausted: borrow the next millisecond
+                self._last_ms += 1
+                self._sequence = 0
+        return (self._last_ms << (self.NODE_BITS + self.SEQUENCE_BITS)) | (self.node_id << self.SEQUENCE_BITS) | self._sequence
+
+    def next_number(self, prefix: str = 'ORD') -> str:
+        return f'{prefix}-{encode_base32(self.next_id())}'
+
+
+# Generator of this process, used by gen_order_number
+order_numbers = OrderNumberGenerator()
+
 
 def gen_order_number(prefix: str = 'ORD') -> str:
-    """Generate a short unique order number.
+    """Generate a unique order number.
 
-    The function returns a string like "ORD-1A2B3C" where the suffix is 6
-    random alphanumeric characters.
+    In the default 'sequence' mode the function returns a string like
+    "ORD-1C8ZJ5XK2G0" built by :class:`OrderNumberGenerator`; in 'random'
+    mode the suffix is 6 random alphanumeric characters (collisions are
+    possible and handled by a retry in ``DB.checkout``).
 
     Args:
         prefix: Optional prefix for the order number.
@@ -18,9 +97,11 @@ def gen_order_number(prefix: str = 'ORD') -> str:
     Returns:
         A string order number.
     """
-    ALPHANUM: Final = string.ascii_uppercase + string.digits
-    rnd = ''.join(random.choices(ALPHANUM, k=6))
-    order = f"{prefix}-{rnd}"
+    if ORDER_NUMBER_MODE == 'random':
+        ALPHANUM: Final = string.ascii_uppercase + string.digits
+        rnd = ''.join(random.choices(ALPHANUM, k=6))
+        order = f"{prefix}-{rnd}"
+    else:
+        order = order_numbers.next_number(prefix)
     logger.debug('Generated order number: %s', order)
     return order
-
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+import secrets
+import signal
+from contextlib import suppress
+from typing import List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+# Webhook mode settings (BOT_MODE=webhook in src.main)
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Public URL registered with Telegram; leave empty when another replica or the load balancer owns it
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '16'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """aiohttp server that accepts Telegram webhook POSTs and feeds them to the dispatcher.
+
+    Requests are acknowledged as soon as the update is parsed and queued; a
+    fixed pool of workers drains the bounded queue through
+    ``Dispatcher.feed_update``. When the queue is full the server answers 503
+    with Retry-After, so Telegram redelivers later (or the load balancer picks
+    another replica) instead of the process buffering without limit.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        path: str = WEBHOOK_PATH,
+        secret_token: str = WEBHOOK_SECRET,
+        workers: int = WEBHOOK_WORKERS,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.rejected = 0
+        self._tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/healthz', self.handle_health)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token and not secrets.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret_token):
+            return web.Response(status=401)
+        try:
+            update = Update(**await request.json())
+        except Exception:
+            logger.warning('Malformed webhook payload rejected')
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning('Update queue full (%s), rejecting update %s', self.queue.maxsize, update.update_id)
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        return web.json_response({})
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({'queued': self.queue.qsize(), 'capacity': self.queue.maxsize, 'rejected': self.rejected})
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                logger.exception('Failed to process update %s', update.update_id)
+            finally:
+                self.queue.task_done()
+
+    async def _on_startup(self, app: web.Application) -> None:
+        await self.dp.emit_startup(dispatcher=self.dp, bot=self.bot, bots=[self.bot], **self.dp.workflow_data)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _on_cleanup(self, app: web.Application) -> None:
+        # finish what was already acknowledged to Telegram before stopping the workers
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=10)
+        except asyncio.TimeoutError:
+            logger.warning('Dropping %s queued updates on shutdown', self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.dp.emit_shutdown(dispatcher=self.dp, bot=self.bot, bots=[self.bot], **self.dp.workflow_data)
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> None:
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info('Webhook server listening on %s:%s%s', host, port, self.path)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """Register the webhook (if WEBHOOK_URL is set) and serve until SIGINT/SIGTERM."""
+    server = WebhookServer(dp, bot)
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info('Webhook set to %s', WEBHOOK_URL)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):  # not supported on Windows
+            loop.add_signal_handler(sig, stop.set)
+    await server.start()
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        await bot.session.close()
@@ -1,6 +1,10 @@
 import asyncio
+import csv
+import io
 
 from src.db import DB, init_db
+from src.handlers.admin import parse_order_filters
+from src.order_export import export_orders_csv, iter_orders_csv
 
 
 def run(coro):
@@ -49,3 +53,45 @@ def test_update_no_fields_and_delete_nonexistent(tmp_path):
     # delete non-existent
     run(db.delete_product(99999))
     assert run(db.get_product(pid)) is not None
+
+
+def test_orders_pagination_filters_and_export(tmp_path):
+    db_path = tmp_path / 'orders.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    ids = [run(db.create_order(f'ON{i}', 100 + i % 2, 'Иван', 'P', 'A', 'std', {'1': i + 1}, float(i))) for i in range(7)]
+    run(db.update_order_status(ids[0], 'shipped'))
+    # an order from before created_at existed
+    run(db._execute('UPDATE orders SET created_at = NULL WHERE id = ?', (ids[1],)))
+
+    page = run(db.list_orders_page(limit=3))
+    assert [o['id'] for o in page['items']] == ids[6:3:-1] and page['has_more']
+    page = run(db.list_orders_page(before_id=page['items'][-1]['id'], limit=3))
+    assert [o['id'] for o in page['items']] == ids[3:0:-1] and page['has_more']
+    page = run(db.list_orders_page(before_id=page['items'][-1]['id'], limit=3))
+    assert [o['id'] for o in page['items']] == [ids[0]] and not page['has_more']
+
+    assert [o['id'] for o in run(db.list_orders_page(status='shipped'))['items']] == [ids[0]]
+    assert [o['id'] for o in run(db.list_orders_page(user_id=101))['items']] == [ids[5], ids[3], ids[1]]
+    filters = parse_order_filters(['from=2000-01-01', 'user=100'])
+    assert {o['id'] for o in run(db.list_orders_page(**filters))['items']} == {ids[0], ids[2], ids[4], ids[6]}
+    assert run(db.list_orders_page(**parse_order_filters(['to=2000-01-01'])))['items'] == []
+
+    chunks = []
+
+    async def collect():
+        async for chunk in iter_orders_csv(db, chunk_size=2):
+            chunks.append(chunk)
+
+    run(collect())
+    assert len(chunks) == 4  # 7 orders in chunks of 2
+    rows = list(csv.reader(io.StringIO(''.join(chunks))))
+    assert rows[0][:3] == ['id', 'order_number', 'created_at']
+    assert [r[1] for r in rows[1:]] == [f'ON{i}' for i in range(7)]
+    assert rows[1][3] == 'shipped' and rows[1][9] == '1x1' and rows[2][2] == ''
+
+    out = tmp_path / 'orders.csv'
+    run(export_orders_csv(db, str(out), status='shipped'))
+    rows = list(csv.reader(out.open(encoding='utf-8-sig')))
+    assert len(rows) == 2 and rows[1][5] == 'Иван'
+    run(db.close())
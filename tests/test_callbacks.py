@@ -0,0 +1,118 @@
+import asyncio
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import AnswerCallbackQuery, EditMessageText
+from aiogram.types import CallbackQuery
+
+from benchmarks.fake_telegram import BOT_ID, FakeSession, callback_update
+from src.db import DB, init_db
+
+from src.handlers import callbacks
+from src.handlers.callbacks import (
+    CallbackTable,
+    CartAction,
+    CartOp,
+    CategoryPage,
+    SearchPage,
+    dispatch_callback,
+    pack_or_none,
+)
+from src.sender import HIGH, send_priority
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def make_query(data):
+    return CallbackQuery(id='1', chat_instance='1', data=data, **{'from': {'id': 7, 'is_bot': False, 'first_name': 'U'}})
+
+
+def test_pack_unpack_roundtrip():
+    assert CategoryPage(category_id=5).pack() == 'cat:5::'
+    page = CategoryPage.unpack(CategoryPage(category_id=5, after_id=40).pack())
+    assert (page.category_id, page.after_id, page.before_id) == (5, 40, None)
+    assert CartAction.unpack('cart:remove:3') == CartAction(op=CartOp.remove, product_id=3)
+    # values with the separator or over 64 bytes do not fit into a button
+    assert pack_or_none(SearchPage(offset=0, query='a:b')) is None
+    assert pack_or_none(SearchPage(offset=0, query='x' * 60)) is None
+
+
+def test_table_routes_by_prefix_and_parses_once():
+    table = CallbackTable()
+    calls = []
+
+    @table(CategoryPage)
+    async def category(query, callback_data, db):
+        calls.append((callback_data, db, send_priority.get()))
+        return 'category'
+
+    @table(CartAction, send_priority=HIGH)
+    async def cart(query, callback_data):
+        calls.append((callback_data, None, send_priority.get()))
+        return 'cart'
+
+    try:
+        table(CategoryPage)(category)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('duplicate prefix accepted')
+
+    assert run(table.resolve(make_query('nope:1'))) is False
+    route = run(table.resolve(make_query('cat:3::')))
+    assert route['callback_handler'].callback is category and route['callback_data'].category_id == 3
+    assert run(dispatch_callback(make_query('cat:3::'), db='DB', state=None, **route)) == 'category'
+    route = run(table.resolve(make_query('cart:clear:')))
+    assert run(dispatch_callback(make_query('cart:clear:'), **route)) == 'cart'
+    assert calls[0][1] == 'DB' and calls[0][2] != HIGH
+    assert calls[1][0].op is CartOp.clear and calls[1][2] == HIGH
+
+    # a known prefix in an outdated layout is answered instead of reaching the handler
+    assert run(table.resolve(make_query('cat:3')))['callback_data'] is None
+
+
+def test_every_prefix_of_the_app_is_routed():
+    assert {'cats', 'cat', 'prod', 'add', 'cart', 'order', 'srch', 'orders'} <= set(callbacks.table.routes)
+
+
+class SameTextSession(FakeSession):
+    """Answers like Telegram when a message is edited to the text it already has."""
+
+    def __init__(self):
+        super().__init__()
+        self.texts = {}
+        self.alerts = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, EditMessageText):
+            if self.texts.get(method.message_id) == method.text:
+                raise TelegramBadRequest(method=method, message='Bad Request: message is not modified')
+            self.texts[method.message_id] = method.text
+        if isinstance(method, AnswerCallbackQuery):
+            self.alerts.append(bool(method.show_alert))
+        return await super().make_request(bot, method, timeout)
+
+
+def test_double_tap_on_search_page_is_not_an_error(tmp_path):
+    from src.handlers.search import search_page_cb
+
+    db_path = str(tmp_path / 'search.db')
+    run(init_db(db_path))
+    db = DB(db_path)
+    cid = run(db.add_category('C'))
+    run(db.add_product(cid, 'Стул', 'd', 1.0, None))
+    session = SameTextSession()
+    bot = Bot(f'{BOT_ID}:FAKE', session=session)
+    token = Bot.set_current(bot)
+    try:
+        query = callback_update(7, SearchPage(offset=0, query='стул').pack()).callback_query
+        for _ in range(2):
+            run(search_page_cb(query, SearchPage(offset=0, query='стул'), db))
+    finally:
+        Bot.reset_current(token)
+    # the second edit was refused as unchanged, and both taps were answered without an alert
+    assert session.calls['editMessageText'] == 1
+    assert session.alerts == [False, False]
+    run(db.close())
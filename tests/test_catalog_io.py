@@ -0,0 +1,107 @@
+import asyncio
+import csv
+import io
+import json
+
+from src.catalog_io import _iter_json_array, export_catalog, import_catalog
+from src.db import DB, init_db
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_csv_import_validates_and_upserts(tmp_path):
+    db_path = str(tmp_path / 'io.db')
+    run(init_db(db_path))
+    db = DB(db_path)
+    existing = run(db.add_category('Стулья'))
+    src = tmp_path / 'catalog.csv'
+    src.write_text(
+        'category,name,description,price,stock\n'
+        'Стулья,Стул A,деревянный,10.5,3\n'
+        'Столы,Стол B,,20,\n'
+        'Столы,,без имени,1,\n'
+        'Столы,Стол C,,дорого,\n'
+        'Столы,Стол D,,5,-1\n'
+        'Столы,Стол E,,7,1\n',
+        encoding='utf-8',
+    )
+    report = run(import_catalog(db, str(src), batch_size=2))
+    assert (report['inserted'], report['updated'], report['errors']) == (3, 0, 3)
+    assert [line for line, _ in report['error_samples']] == [4, 5, 6]
+    cats = {c['name']: c['id'] for c in run(db.list_categories())}
+    assert cats['Стулья'] == existing and 'Столы' in cats
+    chair = run(db.search_products('стул'))[0]
+    assert chair['stock'] == 3 and chair['category_id'] == existing
+
+    # re-importing an export with edited rows updates by id and keeps the search index in sync
+    out = tmp_path / 'export.csv'
+    run(export_catalog(db, str(out)))
+    rows = list(csv.DictReader(out.open(encoding='utf-8')))
+    assert [r['name'] for r in rows] == ['Стул A', 'Стол B', 'Стол E']
+    rows[0]['name'] = 'Табурет A'
+    rows[1]['stock'] = '9'
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    out.write_text(buf.getvalue(), encoding='utf-8')
+    report = run(import_catalog(db, str(out)))
+    assert (report['inserted'], report['updated'], report['errors']) == (0, 3, 0)
+    assert run(db.search_products('стул')) == []
+    assert [p['name'] for p in run(db.search_products('табурет'))] == ['Табурет A']
+    assert run(db.get_product(int(rows[1]['id'])))['stock'] == 9
+    run(db.close())
+
+
+def test_json_and_jsonl_import(tmp_path):
+    db_path = str(tmp_path / 'io_json.db')
+    run(init_db(db_path))
+    db = DB(db_path)
+    cid = run(db.add_category('C'))
+    items = [{'category_id': cid, 'name': f'P{i}', 'price': i, 'description': 'x ' * i} for i in range(50)]
+    array = tmp_path / 'catalog.json'
+    array.write_text(json.dumps(items, ensure_ascii=False, indent=1), encoding='utf-8')
+    # the array is decoded incrementally, element by element
+    with array.open(encoding='utf-8') as f:
+        assert [obj['name'] for _, obj in _iter_json_array(f, chunk_size=7)] == [f'P{i}' for i in range(50)]
+    assert run(import_catalog(db, str(array)))['inserted'] == 50
+
+    lines = tmp_path / 'catalog.jsonl'
+    lines.write_text('{"category": "New", "name": "Q", "price": 1}\n{broken\n\n', encoding='utf-8')
+    report = run(import_catalog(db, str(lines)))
+    assert (report['inserted'], report['errors']) == (1, 1)
+    assert report['error_samples'][0][0] == 2
+    assert len(run(db.list_products_by_category(cid))) == 50
+    run(db.close())
+
+
+def test_repeated_id_in_batch_is_counted_once(tmp_path):
+    db_path = str(tmp_path / 'io_dup.db')
+    run(init_db(db_path))
+    db = DB(db_path)
+    cid = run(db.add_category('C'))
+    counts = run(db.upsert_products([
+        {'id': 100, 'category_id': cid, 'name': 'Old', 'price': 1},
+        {'id': 101, 'category_id': cid, 'name': 'Other', 'price': 2},
+        {'id': 100, 'category_id': cid, 'name': 'New', 'price': 3},
+    ]))
+    assert counts == {'inserted': 2, 'updated': 0}
+    assert run(db.get_product(100))['name'] == 'New'
+    assert [p['name'] for p in run(db.search_products('new'))] == ['New']
+    counts = run(db.upsert_products([{'id': 101, 'category_id': cid, 'name': 'A', 'price': 2}] * 2))
+    assert counts == {'inserted': 0, 'updated': 1}
+    run(db.close())
+
+
+def test_concurrent_imports_create_a_category_once(tmp_path):
+    db_path = str(tmp_path / 'io_race.db')
+    run(init_db(db_path))
+    # two processes importing the same new categories at the same time
+    first, second = DB(db_path), DB(db_path)
+    results = run(asyncio.gather(*(db.category_ids(['Столы', 'Стулья']) for db in (first, second, first, second))))
+    assert all(ids == results[0] for ids in results)
+    assert sorted(c['name'] for c in run(first.list_categories())) == ['Столы', 'Стулья']
+    run(first.close())
+    run(second.close())
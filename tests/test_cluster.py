@@ -0,0 +1,166 @@
+import asyncio
+import random
+
+from benchmarks.fake_telegram import callback_update_data, message_update_data
+from src.cluster import Supervisor, Worker, shard_key
+from src.db import DB, CatalogCache, init_db
+from src.middlewares import UpdateDedupMiddleware
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class RecordingDispatcher:
+    def __init__(self):
+        self.seen = []
+        self.running = 0
+        self.max_running = 0
+
+    async def feed_update(self, bot, update):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(random.random() / 100)
+        self.seen.append((update.message.chat.id, update.message.text))
+        self.running -= 1
+
+
+class DedupDispatcher:
+    """Feeds updates through the dedup middleware to ``handle``."""
+
+    def __init__(self, dedup, handle):
+        self.dedup = dedup
+        self.handle = handle
+
+    async def feed_update(self, bot, update):
+        return await self.dedup(self.handle, update, {})
+
+
+def test_shard_key_prefers_chat_then_user():
+    assert shard_key(message_update_data(5, 'hi')) == 5
+    assert shard_key(callback_update_data(6, 'cat:1::')) == 6
+    group = message_update_data(7, 'hi')
+    group['message']['chat'] = {'id': -100, 'type': 'group'}
+    assert shard_key(group) == -100
+    inline = {'update_id': 9, 'inline_query': {'id': '1', 'from': {'id': 8}, 'query': '', 'offset': ''}}
+    assert shard_key(inline) == 8
+    assert shard_key({'update_id': 10, 'poll': {'id': '1'}}) == 10
+
+
+def test_worker_keeps_chat_order_and_acknowledges():
+    dp = RecordingDispatcher()
+    sent = []
+    worker = Worker(dp, None, sent.append, concurrency=4)
+    updates = [message_update_data(chat, str(i)) for i in range(10) for chat in (1, 2, 3)]
+
+    async def scenario():
+        for update in updates:
+            worker.submit(update)
+        await worker.join()
+
+    run(scenario())
+    for chat in (1, 2, 3):
+        assert [text for c, text in dp.seen if c == chat] == [str(i) for i in range(10)]
+    assert 1 < dp.max_running <= 3
+    acked = [i for message in sent for i in message['ack']]
+    assert sorted(acked) == sorted(u['update_id'] for u in updates)
+    assert worker.handled == 30 and worker.queued == 0
+
+
+def test_catalog_cache_changes_replay_in_other_process_cache():
+    source, replica = CatalogCache(), CatalogCache()
+    source.on_invalidate = replica.apply
+    replica.products[3] = {'id': 3}
+    replica.by_category[1] = []
+    replica.categories = []
+    source.invalidate(category_ids=[1], product_ids=(p for p in [3]))
+    assert 3 not in replica.products and 1 not in replica.by_category and replica.categories == []
+    source.clear()
+    assert replica.categories is None and replica.version == 2
+
+
+def test_supervisor_restarts_dead_worker_and_redelivers(tmp_path):
+    path = str(tmp_path / 'cluster.db')
+    run(init_db(path))
+    env = {'DB_PATH': path, 'FSM_STORAGE': 'memory', 'LOG_FILE': '', 'LOG_LEVEL': 'WARNING'}
+
+    async def scenario():
+        supervisor = Supervisor(2, worker_args=['--fake'], env=env, restart_delay=0.1)
+        await supervisor.start()
+        try:
+            await asyncio.wait_for(supervisor.wait_ready(), 60)
+            for user in range(1, 11):
+                await supervisor.dispatch(message_update_data(user, '/start'))
+            await asyncio.wait_for(supervisor.drain(), 30)
+            assert [w['handled'] for w in supervisor.stats()] == [5, 5]
+
+            # updates sent to a killed worker are delivered again to its replacement
+            supervisor.workers[0].process.kill()
+            for user in (2, 4, 6):
+                await supervisor.dispatch(message_update_data(user, '/catalog'))
+            await asyncio.wait_for(supervisor.drain(), 60)
+            stats = supervisor.stats()
+            assert stats[0]['restarts'] == 1 and stats[0]['handled'] >= 8
+            assert stats[1]['restarts'] == 0 and stats[1]['handled'] == 5
+        finally:
+            await supervisor.stop()
+
+    run(scenario())
+
+
+def test_worker_mark_stays_below_queued_updates(tmp_path):
+    path = str(tmp_path / 'marks.db')
+    run(init_db(path))
+    first, second, third = (message_update_data(chat, 'hi') for chat in (1, 1, 2))
+
+    async def crashed_run():
+        db = DB(path)
+        await db.connect()
+        dedup = UpdateDedupMiddleware(db, scope='worker', mark_interval=3600)
+        await dedup.start()
+        first_done, saved = asyncio.Event(), asyncio.Event()
+
+        async def handle(update, data):
+            if update.update_id == first['update_id']:
+                await first_done.wait()
+            elif update.update_id == third['update_id']:
+                # the second update is waiting for the slot behind the first one of its chat
+                await dedup.save_mark()
+                saved.set()
+            else:
+                await asyncio.Event().wait()
+
+        # one slot: the first update holds it, the third (other chat) gets it next
+        worker = Worker(DedupDispatcher(dedup, handle), None, lambda message: None, concurrency=1, dedup=dedup)
+        for update in (first, third, second):
+            worker.submit(update)
+        await asyncio.sleep(0)
+        first_done.set()
+        await asyncio.wait_for(saved.wait(), 5)
+        assert (await db.get_update_mark('worker'))['update_id'] < second['update_id']
+        # the worker dies before the second update ran
+        for task in list(worker._tasks):
+            task.cancel()
+        await asyncio.gather(*worker._tasks, return_exceptions=True)
+        await db.close()
+
+    async def restarted_run():
+        db = DB(path)
+        await db.connect()
+        dedup = UpdateDedupMiddleware(db, scope='worker', mark_interval=3600)
+        await dedup.start()
+        handled = []
+
+        async def handle(update, data):
+            handled.append(update.update_id)
+
+        worker = Worker(DedupDispatcher(dedup, handle), None, lambda message: None, dedup=dedup)
+        for update in (second, third):
+            worker.submit(update)
+        await worker.join()
+        await dedup.close()
+        await db.close()
+        return handled
+
+    run(crashed_run())
+    assert second['update_id'] in run(restarted_run())
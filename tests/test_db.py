@@ -1,8 +1,9 @@
 import asyncio
 import os
+import sqlite3
 import tempfile
 
-from src.db import DB, init_db
+from src.db import CatalogCache, DB, init_db
 
 
 def run(coro):
@@ -23,3 +24,196 @@ def test_init_and_category_product_lifecycle(tmp_path):
     prod = run(db.get_product(pid))
     assert prod['name'] == 'P'
 
+
+
+def test_pool_reuses_connections(tmp_path):
+    db_path = tmp_path / 'pool.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path), readers=2)
+    run(db.connect())
+    writer = db._writer
+    cid = run(db.add_category('Pool'))
+    run(db.add_product(cid, 'P', 'desc', 1.0, None))
+    assert len(run(db.list_products_by_category(cid))) == 1
+    # the same connections serve subsequent calls
+    assert db._writer is writer
+    assert len(db._idle_readers) == 2
+    run(db.close())
+    assert not db.is_connected
+
+
+def test_reader_pool_serves_waiters_in_order(tmp_path):
+    db_path = tmp_path / 'fifo.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path), readers=1)
+    order = []
+
+    async def borrow(name, hold):
+        async with db._reader():
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def scenario():
+        await db.connect()
+        first = asyncio.ensure_future(borrow('first', 0.01))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(borrow(f'w{i}', 0)) for i in range(3)]
+        await asyncio.sleep(0)
+        # a newcomer arriving as the connection is released must not jump the queue
+        await first
+        await asyncio.gather(borrow('late', 0), *waiters)
+
+    run(scenario())
+    assert order == ['first', 'w0', 'w1', 'w2', 'late']
+    run(db.close())
+
+
+def test_init_enables_wal_and_indexes(tmp_path):
+    db_path = tmp_path / 'wal.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    assert run(db.fetchall('PRAGMA journal_mode'))[0][0] == 'wal'
+    plan = run(db.fetchall('EXPLAIN QUERY PLAN SELECT * FROM products WHERE category_id = ?', (1,)))
+    assert any('idx_products_category' in row['detail'] for row in plan)
+    run(db.close())
+
+
+def test_catalog_cache_hits_and_invalidation(tmp_path):
+    db_path = tmp_path / 'cache.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    cid = run(db.add_category('C'))
+    pid = run(db.add_product(cid, 'A', 'd', 1.0, None))
+    run(db.list_products_by_category(cid))
+    misses = db.cache_stats()['misses']
+    # steady state browsing is served from memory
+    assert run(db.list_products_by_category(cid))[0]['name'] == 'A'
+    assert run(db.get_product(pid))['name'] == 'A'
+    assert db.cache_stats()['misses'] == misses
+    run(db.update_product(pid, name='B'))
+    assert run(db.get_product(pid))['name'] == 'B'
+    assert run(db.list_products_by_category(cid))[0]['name'] == 'B'
+    run(db.delete_product(pid))
+    assert run(db.get_product(pid)) is None
+    assert run(db.list_products_by_category(cid)) == []
+    run(db.close())
+
+
+def test_catalog_changes_of_other_process_reach_the_cache(tmp_path, monkeypatch):
+    from src.handlers.catalog import categories_view, product_view
+
+    monkeypatch.setattr('src.db.CATALOG_SYNC_INTERVAL', 0)
+    db_path = str(tmp_path / 'replicas.db')
+    run(init_db(db_path))
+    # two replicas (or a replica and a script) on one database file
+    replica, other = DB(db_path), DB(db_path)
+    cid = run(other.add_category('C'))
+    pid = run(other.add_product(cid, 'A', 'd', 1.0, None))
+    keep = run(other.add_product(cid, 'K', 'd', 1.0, None))
+    assert run(replica.get_product(pid))['name'] == 'A'
+    kept, card = run(replica.get_product(keep)), run(product_view(replica, pid))
+    assert len(run(categories_view(replica))[1].inline_keyboard) == 1
+    run(other.update_product(pid, name='B'))
+    run(other.set_stock(pid, 0))
+    run(other.add_category('D'))
+    assert run(replica.get_product(pid))['name'] == 'B'
+    assert 'Нет в наличии' in run(product_view(replica, pid))[0]
+    assert len(run(categories_view(replica))[1].inline_keyboard) == 2
+    # only the changed entries were dropped
+    assert keep in replica.catalog_cache.products and run(replica.get_product(keep)) == kept
+    # a bulk import is one change that drops everything
+    run(other.upsert_products([{'id': keep, 'category_id': cid, 'name': 'L', 'price': 2}]))
+    assert run(replica.get_product(keep))['name'] == 'L'
+    run(replica.close())
+    run(other.close())
+
+
+def test_rendered_views_are_cached_until_invalidated(tmp_path):
+    from src.handlers.catalog import categories_view, product_view, products_view
+
+    db_path = tmp_path / 'views.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    cid = run(db.add_category('C'))
+    pid = run(db.add_product(cid, 'A', 'd', 1.0, None))
+    cats, page, card = run(categories_view(db)), run(products_view(db, cid)), run(product_view(db, pid))
+    # the same objects are served again without querying or rendering
+    misses = db.cache_stats()['view_misses']
+    assert run(categories_view(db)) is cats and run(products_view(db, cid)) is page and run(product_view(db, pid)) is card
+    assert db.cache_stats()['view_misses'] == misses
+    run(db.set_stock(pid, 0))
+    assert 'Нет в наличии' in run(product_view(db, pid))[0]
+    assert run(categories_view(db)) is cats
+    run(db.update_product(pid, price=2.5))
+    assert '2.5' in run(products_view(db, cid))[1].inline_keyboard[0][0].text
+    run(db.add_category('D'))
+    assert len(run(categories_view(db))[1].inline_keyboard) == 2
+    run(db.close())
+
+    cache = CatalogCache(max_views=2)
+
+    async def render():
+        return object()
+
+    for i in range(3):
+        run(cache.view(('product', i), None, render))
+    # a full view cache starts over instead of growing
+    assert cache.stats()['views'] == 1
+
+
+def test_keyset_pagination(tmp_path):
+    db_path = tmp_path / 'pages.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    cid = run(db.add_category('C'))
+    other = run(db.add_category('Other'))
+    pids = [run(db.add_product(cid, f'P{i}', 'd', 1.0, None)) for i in range(7)]
+    run(db.add_product(other, 'X', 'd', 1.0, None))
+
+    first = run(db.list_products_page(cid, limit=3))
+    assert [p['id'] for p in first['items']] == pids[:3]
+    assert (first['has_prev'], first['has_next']) == (False, True)
+    second = run(db.list_products_page(cid, after_id=first['items'][-1]['id'], limit=3))
+    assert [p['id'] for p in second['items']] == pids[3:6]
+    last = run(db.list_products_page(cid, after_id=second['items'][-1]['id'], limit=3))
+    assert [p['id'] for p in last['items']] == pids[6:]
+    assert (last['has_prev'], last['has_next']) == (True, False)
+    back = run(db.list_products_page(cid, before_id=last['items'][0]['id'], limit=3))
+    assert back['items'] == second['items'] and back['has_prev'] and back['has_next']
+    back = run(db.list_products_page(cid, before_id=second['items'][0]['id'], limit=3))
+    assert back['items'] == first['items'] and not back['has_prev']
+
+    cats = run(db.list_categories_page(limit=1))
+    assert [c['name'] for c in cats['items']] == ['C'] and cats['has_next']
+    plan = run(db.fetchall('EXPLAIN QUERY PLAN SELECT id FROM products WHERE category_id = ? AND id > ? ORDER BY id LIMIT 9', (cid, 0)))
+    assert any('idx_products_category' in row['detail'] for row in plan)
+    run(db.close())
+
+
+def test_full_text_search(tmp_path):
+    db_path = tmp_path / 'search.db'
+    # a product that existed before the search index was introduced
+    conn = sqlite3.connect(str(db_path))
+    conn.execute('CREATE TABLE products (id INTEGER PRIMARY KEY AUTOINCREMENT, category_id INTEGER, name TEXT NOT NULL, description TEXT, price REAL NOT NULL DEFAULT 0.0, photo TEXT)')
+    conn.execute("INSERT INTO products(category_id, name, description, price) VALUES (1, 'Старый диван', 'угловой', 10)")
+    conn.commit()
+    conn.close()
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    cid = run(db.add_category('Мебель'))
+    chair = run(db.add_product(cid, 'Красивый стул', 'деревянный', 199.0, None))
+    table = run(db.add_product(cid, 'Стол', 'к нему подходит красивый стул', 299.0, None))
+
+    assert [p['name'] for p in run(db.search_products('диван'))] == ['Старый диван']
+    # prefix match on every word, name matches ranked above description matches
+    assert [p['id'] for p in run(db.search_products('крас СТУ'))] == [chair, table]
+    assert [p['id'] for p in run(db.search_products('крас', limit=1, offset=1))] == [table]
+    assert run(db.search_products('"; DROP TABLE products --')) == []
+    assert run(db.search_products('   ')) == []
+
+    run(db.update_product(chair, name='Табурет', description='деревянный'))
+    assert [p['id'] for p in run(db.search_products('табур'))] == [chair]
+    assert [p['id'] for p in run(db.search_products('красивый'))] == [table]
+    run(db.delete_product(table))
+    assert run(db.search_products('красивый')) == []
+    run(db.close())
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from src.db import DB, init_db
+from src.fsm_storage import SQLiteStorage
+from src.handlers.order import OrderStates
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+def test_state_survives_restart(tmp_path):
+    db_path = str(tmp_path / 'fsm.db')
+    run(init_db(db_path))
+    db = DB(db_path)
+    storage = SQLiteStorage(db, flush_interval=60)
+    run(storage.set_state(None, KEY, OrderStates.phone))
+    run(storage.update_data(None, KEY, {'name': 'Ann'}))
+    # write-back: nothing reaches SQLite until a flush
+    assert run(db.fetchall('SELECT COUNT(*) FROM fsm_state'))[0][0] == 0
+    run(storage.close())
+    run(db.close())
+
+    db = DB(db_path)
+    restarted = SQLiteStorage(db)
+    assert run(restarted.get_state(None, KEY)) == OrderStates.phone.state
+    assert run(restarted.get_data(None, KEY)) == {'name': 'Ann'}
+    # clearing the context removes the row
+    run(restarted.set_state(None, KEY, None))
+    run(restarted.set_data(None, KEY, {}))
+    run(restarted.close())
+    assert run(db.fetchall('SELECT COUNT(*) FROM fsm_state'))[0][0] == 0
+
+
+def test_write_through_and_ttl_expiry(tmp_path):
+    db_path = str(tmp_path / 'fsm_ttl.db')
+    run(init_db(db_path))
+    db = DB(db_path)
+    storage = SQLiteStorage(db, flush_interval=0, ttl=60)
+    run(storage.set_state(None, KEY, OrderStates.address))
+    assert run(db.fetchall('SELECT state FROM fsm_state'))[0]['state'] == OrderStates.address.state
+    run(db._execute('UPDATE fsm_state SET updated_at = ?', (time.time() - 120,)))
+    assert run(storage.get_state(None, KEY)) is None
+    assert run(storage.expire()) == 1
+    run(storage.close())
@@ -0,0 +1,63 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiohttp import web
+
+from src import metrics
+from src.db import DB, init_db
+from src.middlewares import HandlerMetricsMiddleware
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class FakeHandlerObject:
+    def __init__(self, callback):
+        self.callback = callback
+
+
+async def category_cb(event, data):
+    return 'ok'
+
+
+async def broken_cb(event, data):
+    raise RuntimeError('boom')
+
+
+def test_handler_and_db_metrics_exposed(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    mw = HandlerMetricsMiddleware('callback_query')
+    assert run(mw(category_cb, object(), {'handler': FakeHandlerObject(category_cb)})) == 'ok'
+    try:
+        run(mw(broken_cb, object(), {'handler': FakeHandlerObject(broken_cb)}))
+    except RuntimeError:
+        pass
+    assert metrics.HANDLER_ERRORS.values[('callback_query', 'broken_cb')] >= 1
+    assert metrics.HANDLERS_IN_FLIGHT.values[('callback_query', 'category_cb')] == 0
+
+    db_path = str(tmp_path / 'm.db')
+    run(init_db(db_path))
+    db = DB(db_path)
+    run(db.list_categories())
+    run(db.close())
+
+    async def scrape():
+        app = web.Application()
+        app.router.add_get('/metrics', metrics.handle_metrics)
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get('/metrics')
+            assert resp.headers['Content-Type'].startswith('text/plain')
+            return await resp.text()
+
+    text = run(scrape())
+    assert 'bot_handler_seconds_count{event="callback_query",handler="category_cb"}' in text
+    assert 'bot_db_query_seconds_bucket{statement="SELECT id, name FROM categories",le="+Inf"}' in text
+
+
+def test_disabled_metrics_record_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', False)
+    before = dict(metrics.DB_SECONDS.values)
+    with metrics.track_db('SELECT 1'):
+        pass
+    assert metrics.DB_SECONDS.values == before
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.types import Message, Update, User
+
+from benchmarks.fake_telegram import DATE, fake_bot
+
+from src.db import DB, init_db
+from src.middlewares import ThrottleMiddleware, UpdateDedupMiddleware, UpdateTraceMiddleware, mark_scope
+from src.middlewares.throttle import parse_limits
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def callback_update(update_id: int = 1, user_id: int = 7, data: str = 'cat:1', query_id: str = None) -> Update:
+    return Update(**{
+        'update_id': update_id,
+        'callback_query': {
+            'id': query_id or str(update_id),
+            'chat_instance': 'ci',
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'T'},
+            'data': data,
+        },
+    })
+
+
+async def ok_handler(event, data):
+    return 'handled'
+
+
+def test_trace_middleware_samples_structured_lines(caplog):
+    caplog.set_level(logging.INFO, logger='bot.trace')
+    assert run(UpdateTraceMiddleware(sample_rate=0)(ok_handler, callback_update(), {})) == 'handled'
+    assert not caplog.records
+    assert run(UpdateTraceMiddleware(sample_rate=1)(ok_handler, callback_update(5), {})) == 'handled'
+    line = json.loads(caplog.records[0].getMessage().split(' ', 1)[1])
+    assert line['update_id'] == 5 and line['type'] == 'callback_query' and line['data'] == 'cat:1'
+    assert line['outcome'] == 'ok'
+
+
+class AnsweringBot:
+    def __init__(self):
+        self.answered = []
+
+    async def answer_callback_query(self, callback_query_id):
+        self.answered.append(callback_query_id)
+
+
+def test_dedup_drops_repeated_updates_and_in_flight_taps(tmp_path):
+    path = str(tmp_path / 'dedup.db')
+    run(init_db(path))
+    db = DB(path)
+    bot = AnsweringBot()
+    dedup = UpdateDedupMiddleware(db, size=10, mark_interval=0)
+    release = asyncio.Event()
+    calls = []
+
+    async def slow_handler(event, data):
+        calls.append(event.update_id)
+        await release.wait()
+
+    async def scenario():
+        first = asyncio.ensure_future(dedup(slow_handler, callback_update(1, data='add:5'), {'bot': bot}))
+        await asyncio.sleep(0)
+        # a double tap while the first one is still handled is answered, not handled
+        await dedup(slow_handler, callback_update(2, data='add:5'), {'bot': bot})
+        # another user or other data goes through
+        other = asyncio.ensure_future(dedup(slow_handler, callback_update(3, user_id=8, data='add:5'), {'bot': bot}))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(first, other)
+        # a redelivered update and a redelivered callback query id
+        await dedup(slow_handler, callback_update(1, data='add:5'), {'bot': bot})
+        await dedup(slow_handler, callback_update(9, query_id='3'), {'bot': bot})
+        # the same tap once the first one has finished is a new action
+        await dedup(slow_handler, callback_update(10, data='add:5'), {'bot': bot})
+
+    run(scenario())
+    assert calls == [1, 3, 10]
+    assert bot.answered == ['2']
+    assert dedup.dropped == 3
+
+
+def test_dedup_mark_survives_restart(tmp_path):
+    path = str(tmp_path / 'mark.db')
+    run(init_db(path))
+    db = DB(path)
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.update_id)
+
+    async def session(update_ids, pending=None):
+        dedup = UpdateDedupMiddleware(db, scope='test')
+        await dedup.start()
+        blocker = asyncio.Event()
+
+        async def blocked(event, data):
+            await blocker.wait()
+
+        stuck = None
+        if pending is not None:
+            stuck = asyncio.ensure_future(dedup(blocked, callback_update(pending, data=f'cat:{pending}'), {}))
+            await asyncio.sleep(0)
+        for update_id in update_ids:
+            await dedup(handler, callback_update(update_id, data=f'cat:{update_id}'), {})
+        mark = dedup.mark()
+        await dedup.close()
+        if stuck is not None:
+            stuck.cancel()
+        return mark
+
+    async def scenario():
+        await db.connect()
+        try:
+            # update 12 never finished: the stored mark stays below it
+            assert await session([10, 11, 13], pending=12) == 11
+            assert await session([10, 11, 12, 13, 14]) == 14
+            assert await session([14, 15]) == 15
+        finally:
+            await db.close()
+
+    run(scenario())
+    assert handled == [10, 11, 13, 12, 13, 14, 15]
+
+
+def test_webhook_replicas_keep_their_own_mark(monkeypatch):
+    import src.middlewares.dedup as dedup
+    assert mark_scope('polling') == 'bot'
+    monkeypatch.setattr(dedup.socket, 'gethostname', lambda: 'replica-a')
+    assert mark_scope('webhook') == 'webhook-replica-a'
+    monkeypatch.setattr(dedup, 'NODE_ID', 7)
+    assert mark_scope('webhook') == 'webhook-7'
+    # set explicitly (the cluster supervisor does so for its workers), the scope is used as is
+    monkeypatch.setattr(dedup, 'UPDATE_MARK_SCOPE', 'cluster-0-of-2')
+    assert mark_scope('webhook') == mark_scope('cluster') == 'cluster-0-of-2'
+
+
+def test_parse_throttle_limits():
+    assert parse_limits('browse=2/10, cart=0.5/3,admin=5') == {'browse': (2.0, 10.0), 'cart': (0.5, 3.0), 'admin': (5.0, 5.0)}
+    assert parse_limits('') == {}
+
+
+def test_throttle_limits_each_user_per_group_and_replies_once():
+    bot = fake_bot()
+    token = Bot.set_current(bot)
+    throttle = ThrottleMiddleware(limits={'browse': (0.001, 2), 'cart': (0.001, 1)}, idle=3600)
+    browse = HandlerObject(callback=ok_handler)
+    cart = HandlerObject(callback=ok_handler, flags={'throttle': 'cart'})
+    free = HandlerObject(callback=ok_handler, flags={'throttle': 'admin'})
+    flooder, other = User(id=1, is_bot=False, first_name='F'), User(id=2, is_bot=False, first_name='O')
+    message = Message(message_id=1, date=DATE, chat={'id': 1, 'type': 'private'}, text='/catalog')
+    query = callback_update(data='add:1').callback_query
+
+    def call(event, user, handler, callback_handler=None):
+        data = {'event_from_user': user, 'handler': handler}
+        if callback_handler is not None:
+            data['callback_handler'] = callback_handler
+        return run(throttle(ok_handler, event, data))
+
+    try:
+        assert [call(message, flooder, browse) for _ in range(5)] == ['handled', 'handled', None, None, None]
+        # one polite reply per flood, not one per message
+        assert bot.session.calls['sendMessage'] == 1
+        # other users, other groups and groups without a limit are not affected
+        assert call(message, other, browse) == 'handled'
+        assert call(query, flooder, browse, callback_handler=cart) == 'handled'
+        assert call(query, flooder, browse, callback_handler=cart) is None
+        assert bot.session.calls['answerCallbackQuery'] == 1
+        assert all(call(message, flooder, free) == 'handled' for _ in range(5))
+        assert throttle.throttled == 4 and throttle.active_users() == 3
+    finally:
+        Bot.reset_current(token)
+
+    # limits of idle users are forgotten
+    throttle.idle = 0
+    throttle._prune(time.monotonic())
+    assert throttle.active_users() == 0
@@ -0,0 +1,67 @@
+import asyncio
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+from src.db import DB, init_db
+from src.notifier import ORDER_STATUS_TEXT, Notifier
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class FakeBot:
+    """Records sends; user 2 has blocked the bot, user 3 fails once with a transient error."""
+
+    def __init__(self):
+        self.sent = []
+        self.flaky = {3}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == 2:
+            raise TelegramForbiddenError(SendMessage(chat_id=chat_id, text=text), 'Forbidden: bot was blocked by the user')
+        if chat_id in self.flaky:
+            self.flaky.discard(chat_id)
+            raise RuntimeError('connection reset')
+        self.sent.append((chat_id, text))
+
+
+def test_order_status_and_broadcast_delivery(tmp_path):
+    db_path = str(tmp_path / 'notify.db')
+    run(init_db(db_path))
+    db = DB(db_path)
+    oid = run(db.create_order('ON1', 1, 'C', 'P', 'A', 'std', {}, 1.0))
+    run(db.create_order('ON2', 2, 'C', 'P', 'A', 'std', {}, 1.0))
+    run(db.add_to_cart(3, 1))
+
+    assert run(db.update_order_status(oid, 'shipped', notify_text=ORDER_STATUS_TEXT))
+    assert not run(db.update_order_status(999, 'shipped', notify_text=ORDER_STATUS_TEXT))
+    broadcast = run(db.create_broadcast('Скидки!', created_by=99))
+    assert broadcast['total'] == 3
+
+    bot = FakeBot()
+    notifier = Notifier(db, bot, batch_size=10, max_attempts=3)
+    assert run(notifier.deliver_batch()) == 4
+    assert sorted(bot.sent) == [(1, 'Скидки!'), (1, 'Статус заказа ON1: shipped')]
+    progress = run(db.broadcast_progress(broadcast['id']))
+    assert (progress['sent'], progress['failed'], progress['pending']) == (1, 1, 1)
+    assert progress['finished_at'] is None
+
+    # the transient failure is retried after its backoff
+    assert run(notifier.deliver_batch()) == 0
+    run(db._execute('UPDATE notifications SET not_before = 0'))
+
+    # a claim interrupted by a crash is handed out again
+    claimed = run(db.claim_notifications(10))
+    assert [n['user_id'] for n in claimed] == [3]
+    assert run(db.release_notifications(older_than=-1)) == 1
+
+    assert run(notifier.deliver_batch()) == 1
+    assert (3, 'Скидки!') in bot.sent
+    progress = run(db.broadcast_progress())
+    assert (progress['sent'], progress['failed'], progress['pending'], progress['sending']) == (2, 1, 0, 0)
+    assert progress['finished_at'] is not None
+    # the author gets a summary once the broadcast is done
+    assert bot.sent[-1][0] == 99
+    run(db.close())
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from src.sender import HIGH, LOW, NORMAL, SendScheduler, priority, setup_send_scheduler
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def fake_bot_api(calls: list, flood_first: int = 0) -> web.Application:
+    """Local stand-in for api.telegram.org answering sendMessage (429 for the first `flood_first` calls)."""
+
+    async def handle(request: web.Request) -> web.Response:
+        data = await request.post()
+        calls.append((request.match_info['method'], data.get('chat_id'), data.get('text'), time.monotonic()))
+        if len(calls) <= flood_first:
+            return web.json_response(
+                {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1', 'parameters': {'retry_after': 1}},
+                status=429,
+            )
+        message = {'message_id': len(calls), 'date': 1700000000, 'chat': {'id': int(data['chat_id']), 'type': 'private'}, 'text': data.get('text')}
+        return web.json_response({'ok': True, 'result': message})
+
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', handle)
+    return app
+
+
+def test_retry_after_is_honoured_against_fake_api():
+    calls = []
+
+    async def scenario():
+        async with TestServer(fake_bot_api(calls, flood_first=1)) as server:
+            session = AiohttpSession(api=TelegramAPIServer.from_base(str(server.make_url('')).rstrip('/')))
+            bot = Bot('42:TEST', session=session)
+            scheduler = setup_send_scheduler(bot, SendScheduler(global_rate=100, global_burst=100, chat_rate=100, chat_burst=5))
+            try:
+                message = await bot.send_message(7, 'hello')
+            finally:
+                await scheduler.close()
+                await session.close()
+            return message
+
+    message = run(scenario())
+    assert message.text == 'hello'
+    assert [c[0] for c in calls] == ['sendMessage', 'sendMessage']
+    # the retry waited for the chat's retry_after instead of failing
+    assert calls[1][3] - calls[0][3] >= 0.9
+
+
+def test_per_chat_rate_limit_against_fake_api():
+    calls = []
+
+    async def scenario():
+        async with TestServer(fake_bot_api(calls)) as server:
+            session = AiohttpSession(api=TelegramAPIServer.from_base(str(server.make_url('')).rstrip('/')))
+            bot = Bot('42:TEST', session=session)
+            scheduler = setup_send_scheduler(bot, SendScheduler(global_rate=1000, global_burst=1000, chat_rate=20, chat_burst=1))
+            try:
+                await asyncio.gather(*(bot.send_message(1, f'a{i}') for i in range(4)), bot.send_message(2, 'b'))
+            finally:
+                await scheduler.close()
+                await session.close()
+
+    run(scenario())
+    chat1 = [c[3] for c in calls if c[1] == '1']
+    assert len(chat1) == 4
+    # 20 msg/s with no burst: consecutive sends into one chat are spaced by ~50ms
+    assert chat1[-1] - chat1[0] >= 0.13
+    # the other chat is not held back behind chat 1's queue
+    assert next(c[3] for c in calls if c[1] == '2') < chat1[-1]
+
+
+def test_priority_lanes():
+    order = []
+
+    async def scenario():
+        scheduler = SendScheduler(global_rate=50, global_burst=1, chat_rate=1000, chat_burst=1000)
+        await scheduler.acquire(0)  # drain the global burst so the next callers queue
+
+        async def send(chat_id, level):
+            with priority(level):
+                await scheduler.acquire(chat_id)
+            order.append(level)
+
+        tasks = [asyncio.create_task(send(1, LOW)), asyncio.create_task(send(2, NORMAL))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(send(3, HIGH)))
+        await asyncio.gather(*tasks)
+        await scheduler.close()
+
+    run(scenario())
+    assert order == [HIGH, NORMAL, LOW]
@@ -7,11 +7,61 @@ def run(coro):
     return asyncio.get_event_loop().run_until_complete(coro)
 
 
-def test_gen_order_number():
+def test_gen_order_number(monkeypatch):
+    import src.utils
+    monkeypatch.setattr(src.utils, 'order_numbers', src.utils.OrderNumberGenerator(1))
     n = gen_order_number()
     assert n.startswith('ORD-') and len(n) > 4
 
 
+def test_order_number_generator_is_monotonic_and_node_unique():
+    from src.utils import OrderNumberGenerator
+    a, b = OrderNumberGenerator(1), OrderNumberGenerator(2)
+    ids_a = [a.next_id() for _ in range(20000)]
+    ids_b = [b.next_id() for _ in range(20000)]
+    assert ids_a == sorted(set(ids_a))
+    assert not set(ids_a) & set(ids_b)
+
+
+def test_default_generators_lease_distinct_node_ids(tmp_path, monkeypatch):
+    import src.db
+    from src.utils import OrderNumberGenerator
+    db_path = tmp_path / 'nodes.db'
+    run(init_db(str(db_path)))
+    # two processes (each with its own pool) started without NODE_ID
+    first, second = DB(str(db_path)), DB(str(db_path))
+    a, b = OrderNumberGenerator(), OrderNumberGenerator()
+    assert a.leased and a.node_id is None
+    assert run(first.lease_node_id(a)) != run(second.lease_node_id(b))
+    # renewal keeps the node id
+    node_a = a.node_id
+    assert run(first.lease_node_id(a)) == node_a
+    # an expired lease is taken over, and its former holder moves on at its next renewal
+    monkeypatch.setattr(src.db, 'ORDER_NODE_LEASE', -1)
+    run(first.lease_node_id(a))
+    monkeypatch.setattr(src.db, 'ORDER_NODE_LEASE', 3600)
+    c = OrderNumberGenerator()
+    assert run(second.lease_node_id(c)) == node_a
+    assert run(first.lease_node_id(a)) not in (node_a, b.node_id)
+    run(first.close())
+    run(second.close())
+
+
+def test_checkout_retries_on_order_number_conflict(tmp_path, monkeypatch):
+    import src.db
+    db_path = tmp_path / 'conflict.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    cid = run(db.add_category('C'))
+    pid = run(db.add_product(cid, 'A', 'd', 1.0, None))
+    run(db.create_order('ORD-TAKEN', 1, 'N', 'P', 'A', 'std', {}, 0.0))
+    numbers = iter(['ORD-TAKEN', 'ORD-FREE'])
+    monkeypatch.setattr(src.db, 'gen_order_number', lambda: next(numbers))
+    run(db.add_to_cart(2, pid))
+    assert run(db.checkout(2, 'N', 'P', 'A')) == 'ORD-FREE'
+    assert run(db.get_cart(2)) == {}
+
+
 def test_cart_set_get(tmp_path):
     db_path = tmp_path / 'test2.db'
     run(init_db(str(db_path)))
@@ -51,3 +101,99 @@ def test_empty_cart_behavior(tmp_path):
     total = run(db.cart_total(user_id))
     assert total == 0.0
 
+
+
+def test_cart_view(tmp_path):
+    db_path = tmp_path / 'view.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    cid = run(db.add_category('C'))
+    p1 = run(db.add_product(cid, 'A', 'd', 5.0, None))
+    p2 = run(db.add_product(cid, 'B', 'd', 3.0, None))
+    run(db.set_cart(7, {str(p1): 2, str(p2): 1, '9999': 4}))
+    view = run(db.get_cart_view(7))
+    assert [(l['name'], l['qty'], l['subtotal']) for l in view['lines']] == [('A', 2, 10.0), ('B', 1, 3.0)]
+    assert view['items'] == {str(p1): 2, str(p2): 1}
+    assert view['total'] == 13.0
+    assert run(db.get_cart_view(8)) == {'lines': [], 'items': {}, 'total': 0.0}
+
+
+def test_cart_atomic_quantity_updates(tmp_path):
+    db_path = tmp_path / 'items.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    user_id = 5
+
+    async def storm():
+        await asyncio.gather(*(db.add_to_cart(user_id, 1) for _ in range(20)))
+
+    run(storm())
+    assert run(db.get_cart(user_id)) == {'1': 20}
+    assert run(db.change_qty(user_id, 1, -19)) == 1
+    assert run(db.change_qty(user_id, 1, -1)) == 0
+    assert run(db.get_cart(user_id)) == {}
+    assert run(db.change_qty(user_id, 2, -1)) == 0
+    run(db.add_to_cart(user_id, 3, 2))
+    run(db.remove_from_cart(user_id, 3))
+    assert run(db.get_cart(user_id)) == {}
+
+
+def test_legacy_json_carts_are_migrated(tmp_path):
+    import sqlite3
+    db_path = tmp_path / 'legacy.db'
+    conn = sqlite3.connect(str(db_path))
+    conn.execute('CREATE TABLE carts (user_id INTEGER PRIMARY KEY, items TEXT)')
+    conn.execute('INSERT INTO carts VALUES (1, ?)', ('{"4": 2, "5": 0}',))
+    conn.commit()
+    conn.close()
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    assert run(db.get_cart(1)) == {'4': 2}
+    assert run(db.fetchall('SELECT COUNT(*) FROM carts'))[0][0] == 0
+
+
+def test_checkout_is_atomic_and_idempotent(tmp_path):
+    db_path = tmp_path / 'checkout.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    cid = run(db.add_category('C'))
+    p1 = run(db.add_product(cid, 'A', 'd', 5.0, None))
+    run(db.add_to_cart(11, p1, 3))
+
+    async def double_tap():
+        return await asyncio.gather(*(db.checkout(11, 'N', 'P', 'A') for _ in range(2)))
+
+    numbers = run(double_tap())
+    placed = [n for n in numbers if n]
+    assert len(placed) == 1 and numbers.count(None) == 1
+    orders = run(db.list_orders())
+    assert len(orders) == 1
+    assert orders[0]['order_number'] == placed[0] and orders[0]['total'] == 15.0
+    assert run(db.get_cart(11)) == {}
+
+
+def test_checkout_reserves_stock_without_overselling(tmp_path):
+    from src.db import OutOfStockError
+    db_path = tmp_path / 'stock.db'
+    run(init_db(str(db_path)))
+    db = DB(str(db_path))
+    cid = run(db.add_category('C'))
+    limited = run(db.add_product(cid, 'L', 'd', 2.0, None))
+    free = run(db.add_product(cid, 'F', 'd', 1.0, None))
+    run(db.set_stock(limited, 3))
+    for user_id in range(1, 6):
+        run(db.add_to_cart(user_id, limited))
+        run(db.add_to_cart(user_id, free))
+
+    async def flash_sale():
+        return await asyncio.gather(*(db.checkout(u, 'N', 'P', 'A') for u in range(1, 6)), return_exceptions=True)
+
+    results = run(flash_sale())
+    assert len([r for r in results if isinstance(r, str)]) == 3
+    assert all(isinstance(r, OutOfStockError) for r in results if not isinstance(r, str))
+    assert run(db.get_product(limited))['stock'] == 0
+    assert run(db.get_product(free))['stock'] is None
+    # failed checkouts keep the cart untouched
+    assert run(db.get_cart(5)) == {str(limited): 1, str(free): 1}
+    assert run(db.adjust_stock({limited: 5, free: 2})) == 2
+    assert run(db.get_product(limited))['stock'] == 5
@@ -0,0 +1,57 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+
+from src.webhook import SECRET_HEADER, WebhookServer
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def make_update(update_id: int, text: str) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 1700000000,
+            'chat': {'id': 42, 'type': 'private'},
+            'from': {'id': 42, 'is_bot': False, 'first_name': 'T'},
+            'text': text,
+        },
+    }
+
+
+def test_webhook_feeds_dispatcher_and_applies_backpressure():
+    received = []
+    dp = Dispatcher()
+
+    @dp.message()
+    async def collect(message: Message):
+        received.append(message.text)
+
+    async def scenario():
+        server = WebhookServer(dp, Bot('42:TEST'), path='/wh', secret_token='s3cret', workers=2, queue_size=2)
+        async with TestClient(TestServer(server.make_app())) as client:
+            headers = {SECRET_HEADER: 's3cret'}
+            assert (await client.post('/wh', json=make_update(1, 'a'))).status == 401
+            assert (await client.post('/wh', data='nope', headers=headers)).status == 400
+            for i, text in enumerate(['x', 'y', 'z']):
+                assert (await client.post('/wh', json=make_update(10 + i, text), headers=headers)).status == 200
+            await server.queue.join()
+
+            # no free workers: the bounded queue fills up and further updates are refused
+            for task in server._tasks:
+                task.cancel()
+            statuses = [(await client.post('/wh', json=make_update(20 + i, 'q'), headers=headers)).status for i in range(3)]
+            assert statuses == [200, 200, 503]
+            health = await (await client.get('/healthz')).json()
+            assert health == {'queued': 2, 'capacity': 2, 'rejected': 1}
+            while not server.queue.empty():
+                server.queue.get_nowait()
+                server.queue.task_done()
+
+    run(scenario())
+    assert sorted(received) == ['x', 'y', 'z']